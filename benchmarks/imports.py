@@ -0,0 +1,105 @@
+"""Import and startup time of the bots package
+
+Imports each module in a fresh interpreter with -X importtime and reports
+its cumulative import time and the slowest packages it pulls in. Modules
+that tooling and the start-bots entry point import must not need a
+config.json nor import the server dependencies (FastAPI, socketio,
+python-telegram-bot, uvicorn), otherwise the benchmark fails.
+
+The startup time is the time from importing bots.app to the end of its
+startup handlers, with an empty app config.
+
+Run with: python -m benchmarks.imports [runs]
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+
+# Must import without config.json and without the heavy dependencies
+LIGHT_MODULES = ["bots", "bots.config", "bots.utils", "bots.log", "bots.__main__"]
+HEAVY_PACKAGES = {"fastapi", "socketio", "telegram", "uvicorn"}
+
+MODULES = LIGHT_MODULES + ["bots.applications.manager", "bots.api"]
+
+STARTUP_SCRIPT = """
+import asyncio, time
+
+async def main():
+    started = time.perf_counter()
+    import bots.app
+    imported = time.perf_counter()
+    await bots.app.app.router.startup()
+    ready = time.perf_counter()
+    await bots.app.app.router.shutdown()
+    print(imported - started, ready - imported)
+
+asyncio.run(main())
+"""
+
+
+def run(args: list[str], cwd: str) -> subprocess.CompletedProcess[str]:
+    env = os.environ | {"PYTHONPATH": str(ROOT)}
+    return subprocess.run([sys.executable, *args], cwd=cwd, env=env, capture_output=True, text=True)
+
+
+def import_times(module: str | None, cwd: str) -> dict[str, int]:
+    """Cumulative import time in microseconds of every imported module, None for interpreter startup"""
+    result = run(["-X", "importtime", "-c", f"import {module}" if module else "pass"], cwd)
+    if result.returncode:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+    times = {}
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line.split("|")
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative)
+    return times
+
+
+def main() -> None:
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    failed = False
+
+    with tempfile.TemporaryDirectory() as directory:
+        startup_modules = import_times(None, directory).keys()
+        print(f"{'module':<30} {'import (median)':>16}  slowest dependencies")
+        for module in MODULES:
+            samples = [import_times(module, directory) for _ in range(runs)]
+            total = statistics.median(times[module] for times in samples)
+            times = samples[-1]
+            packages = {
+                name: time
+                for name, time in times.items()
+                if "." not in name and name != "bots" and name not in startup_modules
+            }
+            slowest = sorted(packages, key=packages.__getitem__, reverse=True)[:3]
+            print(
+                f"{module:<30} {total / 1000:>13.1f} ms  "
+                + ", ".join(f"{name} {packages[name] / 1000:.0f} ms" for name in slowest)
+            )
+            if module in LIGHT_MODULES and (heavy := HEAVY_PACKAGES & packages.keys()):
+                print(f"  FAIL: {module} imports {', '.join(sorted(heavy))}")
+                failed = True
+
+        Path(directory, "config.json").write_text(json.dumps({"app_configs": []}))
+        samples = []
+        for _ in range(runs):
+            result = run(["-c", STARTUP_SCRIPT], directory)
+            if result.returncode:
+                raise RuntimeError(f"Starting bots.app failed:\n{result.stderr}")
+            samples.append([float(value) for value in result.stdout.split()])
+        print(f"{'import bots.app':<30} {statistics.median(sample[0] for sample in samples) * 1000:>13.1f} ms")
+        print(f"{'startup bots.app':<30} {statistics.median(sample[1] for sample in samples) * 1000:>13.1f} ms")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Microbenchmark for MarkdownV2 escaping and message building
+
+Compares the old regex based stabelise_string() with the translation
+tables of bots.utils.markdown, and building a long message by string
+concatenation with the MarkdownV2 builder (including splitting it).
+
+Run with: python -m benchmarks.markdown [number of lines]
+"""
+import re
+import sys
+import timeit
+from typing import Any
+
+from bots.utils import MarkdownV2, escape_markdown
+
+
+def legacy_stabelise_string(text: str, entity_type: str = "") -> str:
+    if entity_type in ["pre", "code"]:
+        escape_chars = r"\`"
+    elif entity_type == "text_link":
+        escape_chars = r"\)"
+    elif entity_type == "all":
+        escape_chars = r"\_*[]()~`>#+-=|{}.!"
+    else:
+        escape_chars = r"\[]()~>#+-=|{}.!"
+
+    return re.sub(f"([{re.escape(escape_chars)}])", r"\\\1", text)
+
+
+def legacy_build(lines: list[tuple[str, str]]) -> str:
+    text = ""
+    for name, value in lines:
+        text += "*" + legacy_stabelise_string(name, "all") + "*: "
+        text += "`" + legacy_stabelise_string(value, "code") + "`\n"
+    return text
+
+
+def build(lines: list[tuple[str, str]]) -> MarkdownV2:
+    message = MarkdownV2()
+    for name, value in lines:
+        message.bold(name).text(": ").code(value).text("\n")
+    return message
+
+
+def bench(name: str, func: Any, number: int) -> float:
+    result = min(timeit.repeat(func, number=number, repeat=5)) / number
+    print(f"{name:<40} {result * 1000:>10.3f} ms")
+    return result
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    sample = "Hello (world)! 1+1=2 - see [docs] at example.com #tag > `code` {x} | y ~ z_1 *bold* \\ end."
+    for entity_type in ("", "all", "code", "text_link"):
+        assert legacy_stabelise_string(sample, entity_type) == escape_markdown(sample, entity_type)
+
+    print(f"Escaping a {len(sample)} character string")
+    old = bench("stabelise_string (regex)", lambda: legacy_stabelise_string(sample, "all"), 20_000)
+    new = bench("escape_markdown (translate)", lambda: escape_markdown(sample, "all"), 20_000)
+    print(f"{'speedup':<40} {old / new:>10.1f} x")
+
+    lines = [(f"app.{index}", f"value-{index} (ok)") for index in range(count)]
+    assert legacy_build(lines) == build(lines).build()
+
+    print(f"Building a message with {count} lines")
+    old = bench("concatenation + stabelise_string", lambda: legacy_build(lines), 50)
+    new = bench("MarkdownV2 builder", lambda: build(lines).build(), 50)
+    print(f"{'speedup':<40} {old / new:>10.1f} x")
+    bench("MarkdownV2 builder + split()", lambda: build(lines).split(), 50)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Microbenchmark for the API payload serialisation
+
+Compares the old pure Python recursive serialiser + stdlib json with the
+current pydantic-core / orjson based path on a large "apps_update" payload.
+
+Run with: python -m benchmarks.serialise [number of apps]
+"""
+import json as stdlib_json
+import sys
+import timeit
+from pathlib import Path
+from typing import Any
+
+from pydantic import BaseModel, Field
+from pydantic_core import PydanticUndefined, to_jsonable_python
+
+from bots.utils import json, model_schema, serialise
+
+
+class Arguments(BaseModel):
+    sample_field_1: str = "Foo"
+    sample_field_2: int
+    sample_field_3: Path = Field(default_factory=lambda: Path(__file__))
+
+
+def legacy_serialise(data: Any) -> Any:
+    match data:
+        case dict():
+            return {item: legacy_serialise(value) for item, value in data.items()}
+        case list():
+            return [legacy_serialise(item) for item in data]
+        case str() | int() | float() | bool() | None:
+            return data
+        case x if x is PydanticUndefined:
+            return None
+        case _:
+            return to_jsonable_python(data)
+
+
+def build_payload(apps: int) -> dict[str, Any]:
+    return {
+        "apps_update": [
+            {
+                "id": f"app-{index}",
+                "telegram_token": f"{index}:abcdefghijklmnopqrstuvwxyz",
+                "initialized": True,
+                "running": bool(index % 2),
+                "bot": {
+                    "id": index,
+                    "first_name": f"Bot {index}",
+                    "username": f"bot_{index}_bot",
+                    "is_bot": True,
+                    "can_join_groups": True,
+                    "link": f"https://t.me/bot_{index}_bot",
+                },
+                "type": "Echo",
+                "config": {"sample_field_2": index, "sample_field_3": Path(f"/srv/bots/{index}")},
+                "fields": {
+                    name: {
+                        "type": "str",
+                        "help": None,
+                        "default": field.get_default(),
+                        "current": None,
+                        "required": field.is_required(),
+                    }
+                    for name, field in Arguments.model_fields.items()
+                },
+            }
+            for index in range(apps)
+        ]
+    }
+
+
+def bench(name: str, func: Any, number: int) -> float:
+    result = min(timeit.repeat(func, number=number, repeat=5)) / number
+    print(f"{name:<40} {result * 1000:>10.3f} ms")
+    return result
+
+
+def main() -> None:
+    apps = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    payload = build_payload(apps)
+    print(f"apps_update payload with {apps} apps")
+
+    old = bench("legacy serialise + json.dumps", lambda: stdlib_json.dumps(legacy_serialise(payload)), 20)
+    new = bench("serialise + orjson dumps", lambda: json.dumps(serialise(payload)), 20)
+    print(f"{'speedup':<40} {old / new:>10.1f} x")
+
+    old = bench("model_json_schema()", Arguments.model_json_schema, 200)
+    new = bench("model_schema() (cached)", lambda: model_schema(Arguments), 200)
+    print(f"{'speedup':<40} {old / new:>10.1f} x")
+
+
+if __name__ == "__main__":
+    main()
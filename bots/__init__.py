@@ -1,3 +1,15 @@
-from .applications import Application
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from .applications import Application
 
 __all__ = ["Application"]
+
+
+def __getattr__(name: str) -> Any:
+    # Imported on first use, so importing a submodule doesn't import all of bots
+    if name == "Application":
+        from .applications import Application
+
+        return Application
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
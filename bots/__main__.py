@@ -1,13 +1,16 @@
-import uvicorn
+from typing import Any
 
 from bots.config import config
 
 
 def main() -> None:
+    import uvicorn
+
+    uvicorn_args: dict[str, Any] = {"ws_per_message_deflate": config.socket_compression} | config.uvicorn_args
     uvicorn.run(
         "bots.app:app",
         host=config.host,
         port=config.port,
         log_level=config.web_log_level_int,
-        **config.uvicorn_args,
+        **uvicorn_args,
     )
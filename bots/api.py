@@ -1,112 +1,275 @@
 import asyncio
-import json
-from pathlib import Path
-from typing import Any
+from typing import Any, AsyncIterator, Iterable
 
-from pydantic import ValidationError
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, ValidationError
 
 from bots.applications import _base, app_manager
-from bots.config import ApplicationConfig, config
-from bots.utils import JsonSerialisableData, Namespace, serialise, serialise_model
+from bots.applications.manager import OPERATION_DONE, AppOperation, AppOperationResult
+from bots.archive import log_archive
+from bots.broadcast import BroadcastProgress
+from bots.cluster import FORWARDED_HEADER
+from bots.config import CONFIG_FILE, ApplicationConfig, config
+from bots.hibernation import HibernatedApp
+from bots.log import logger
+from bots.utils import JsonSerialisableData, Namespace, json, model_schema, per_model_cache, serialise, serialise_model
 
 sync_lock = asyncio.Lock()
 
+router = APIRouter(prefix="/api")
+
+
+@per_model_cache
+def arguments_fields(model: type[BaseModel]) -> dict[str, dict[str, Any]]:
+    """Static field info of an app arguments model, the current value is added per app"""
+    return {
+        name: {
+            "type": getattr(field.annotation, "__name__", repr(field.annotation).replace("|", "or")),
+            "help": field.description,
+            "default": serialise(field.get_default()),
+            "required": field.is_required(),
+        }
+        for name, field in model.model_fields.items()
+    }
+
+
+def app_topics(app_id: str) -> tuple[str, str]:
+    """Topics of events about an app, "apps" is subscribed to all apps"""
+    return ("apps", f"app:{app_id}")
+
+
+def is_status_topic(topic: str) -> bool:
+    return topic == "status" or topic.startswith("status:")
+
+
+async def app_info(app: _base.Application) -> JsonSerialisableData:
+    bot = await app.get_bot()
+    bot_dict = bot.to_dict()
+    bot_dict["link"] = bot.link
+
+    type = app.__class__.__name__
+    bases = ", ".join([base.__name__ for base in app.__class__.__bases__ if base != _base.Application])
+    if bases:
+        type += f"[{bases}]"
+
+    config = serialise_model(app.arguments, exclude_defaults=True)
+
+    return serialise(
+        {
+            "id": app.id,
+            "node": app_manager.cluster.id if app_manager.cluster else None,
+            "telegram_token": app.config.telegram_token,
+            "initialized": app.initialized,
+            "running": app.running,
+            "hibernated": None,
+            "wake_latency": app_manager.hibernator.wake_latencies.get(app.id),
+            "updates": dict(app.update_processor.stats()),
+            "jobs": dict(app.job_scheduler.stats()),
+            "bot": bot_dict,
+            "type": type,
+            "config": config,
+            "fields": {
+                name: field | {"current": config.get(name, field["default"])}  # type: ignore[union-attr]
+                for name, field in arguments_fields(app.Arguments).items()
+            },
+        }
+    )
+
+
+def hibernated_app_info(stub: HibernatedApp) -> JsonSerialisableData:
+    """Like app_info() with what is known about a hibernated app"""
+    return serialise(
+        {
+            "id": stub.id,
+            "node": app_manager.cluster.id if app_manager.cluster else None,
+            "telegram_token": stub.telegram_token,
+            "initialized": False,
+            "running": False,
+            "hibernated": stub.since,
+            "wake_latency": app_manager.hibernator.wake_latencies.get(stub.id),
+            "updates": None,
+            "jobs": None,
+            "bot": stub.bot,
+            "type": stub.type,
+            "config": {},
+            "fields": {},
+        }
+    )
+
+
+async def apps_info(local: bool = False) -> list[JsonSerialisableData]:
+    """Info of all apps, in cluster mode including the apps of the other nodes unless local"""
+    infos = [await app_info(app) for app in app_manager.apps.values()]
+    infos += [hibernated_app_info(stub) for stub in app_manager.hibernator.apps.values()]
+    if app_manager.cluster and not local:
+        infos += await app_manager.cluster.remote_apps_info()
+    return infos
+
+
+async def run_operation(
+    operation: AppOperation, app_ids: Iterable[str] = (), timeout: float | None = None, forwarded: bool = False
+) -> AsyncIterator[tuple[AppOperationResult, _base.Application | None]]:
+    """AppManager.run_operation() under the sync lock, in cluster mode on the apps of all nodes"""
+    if app_manager.cluster:
+        # Only holds the lock for the local apps, other nodes may be waiting for ours
+        async for item in app_manager.cluster.run_operation(operation, app_ids, timeout, forwarded, sync_lock):
+            yield item
+        return
+
+    async with sync_lock:
+        async for item in app_manager.run_operation(operation, app_ids, timeout):
+            yield item
+
 
 class ApiNamespace(Namespace):
-    namespace = "/api"
+    """App management
 
-    async def app_info(self, app: _base.Application) -> JsonSerialisableData:
-        bot = await app.get_bot()
-        bot_dict = bot.to_dict()
-        bot_dict["link"] = bot.link
+    Topics: "apps" for events of all apps, "app:<app id>" for a single app.
+    "status" for the live status of all apps and the fleet, "status:<app id>"
+    for the live status of a single app.
+    """
 
-        type = app.__class__.__name__
-        bases = ", ".join([base.__name__ for base in app.__class__.__bases__ if base != _base.Application])
-        if bases:
-            type += f"[{bases}]"
+    namespace = "/api"
+    default_topics = ("apps",)
 
-        config = app.arguments.model_dump(exclude_defaults=True)
+    def __init__(self, namespace: str | None = None) -> None:
+        super().__init__(namespace)
+        app_manager.broadcast_listeners.append(self.emit_broadcast_progress)
+        self.status_emitter = asyncio.create_task(self.status_emitter_loop())
 
-        return serialise(
-            {
-                "id": app.id,
-                "telegram_token": app.config.telegram_token,
-                "initialized": app.initialized,
-                "running": app.running,
-                "bot": bot_dict,
-                "type": type,
-                "config": config,
-                "fields": {
-                    name: {
-                        "type": getattr(field.annotation, "__name__", repr(field.annotation).replace("|", "or")),
-                        "help": field.description,
-                        "default": field.get_default(),
-                        "current": config.get(name, field.get_default()),
-                        "required": field.is_required(),
-                    }
-                    for name, field in app.Arguments.model_fields.items()
-                },
-            }
-        )
+    def valid_topic(self, topic: str) -> bool:
+        return topic == "apps" or topic.startswith("app:") or is_status_topic(topic)
 
-    async def apps_info(self) -> list[JsonSerialisableData]:
-        return [await self.app_info(app) for app in app_manager.apps.values()]
+    async def subscribe(self, sid: str, topics: Iterable[str]) -> None:
+        topics = list(topics)
+        await super().subscribe(sid, topics)
+        # Status updates only contain what changed, so new subscribers start with the full status
+        if any(is_status_topic(topic) for topic in topics):
+            await self.on_status(sid)
 
     async def on_connect(self, sid: str, environ: dict[str, str]) -> None:
         await super().on_connect(sid, environ)
-        await self.emit_success("connect", "Connection established", {"apps_update": await self.apps_info()})
+        await self.emit_success("connect", "Connection established", {"apps_update": await apps_info()}, sid=sid)
+        await self.on_broadcasts(sid)
 
     # ================
     # ACTIONS ALL APPS
     # ================
 
-    async def on_apps_reload(self, _: str) -> None:
-        async with sync_lock:
-            await app_manager.reload_apps()
+    async def run_operation(self, event: str, operation: AppOperation, sid: str, data: dict[str, Any] | None) -> None:
+        """Run a bulk operation and report every app as soon as it is done
+
+        data may contain "appIds" to only include some apps and a "timeout"
+        per app in seconds. Results go to the requesting client and the
+        subscribers of the apps.
+        """
+        data = data or {}
+        results = []
+        async for result, app in run_operation(operation, data.get("appIds") or (), data.get("timeout")):
+            results.append(result)
+            topics = app_topics(result["app_id"])
+            if result["status"] != "success":
+                await self.emit_error(f"app_{operation}", result["message"], {"result": result}, sid, topics)
+                continue
+
+            payload: dict[str, Any] = {"result": result}
+            if app and self.has_receivers(sid, topics):
+                try:
+                    payload["app_update"] = await app_info(app)
+                except Exception as error:
+                    logger.error(f"Failed to get info of {app.id}: {error}")
+            await self.emit_success(f"app_{operation}", result["message"], payload, sid, topics)
+
+        if not self.has_receivers(sid, ("apps",)):
+            return
+        failed = sum(result["status"] != "success" for result in results)
+        await self.emit_default(
+            event,
+            "warning" if failed else "success",
+            f"Apps {OPERATION_DONE[operation]}, {len(results) - failed} succeeded, {failed} failed",
+            {"results": results, "apps_update": await apps_info()},
+            sid,
+            ("apps",),
+        )
 
-        await self.emit_success("apps_reload", "Apps reloaded", {"apps_update": await self.apps_info()})
+    async def on_apps_reload(self, sid: str, data: dict[str, Any] | None = None) -> None:
+        await self.run_operation("apps_reload", "reload", sid, data)
 
-    async def on_apps_start(self, _: str) -> None:
-        async with sync_lock:
-            await app_manager.start_apps()
-        await self.emit_success("apps_start", "Apps started", {"apps_update": await self.apps_info()})
+    async def on_apps_start(self, sid: str, data: dict[str, Any] | None = None) -> None:
+        await self.run_operation("apps_start", "start", sid, data)
 
-    async def on_apps_pause(self, _: str) -> None:
-        async with sync_lock:
-            await app_manager.pause_apps()
-        await self.emit_success("apps_pause", "Apps paused", {"apps_update": await self.apps_info()})
+    async def on_apps_pause(self, sid: str, data: dict[str, Any] | None = None) -> None:
+        await self.run_operation("apps_pause", "pause", sid, data)
 
     # ==================
     # ACTIONS SINGLE APP
     # ==================
 
-    async def get_app_or_send_error(self, event: str, sid: str, app_id: str | None) -> _base.Application | None:
+    async def get_app_or_send_error(
+        self, event: str, sid: str, app_id: str | None, start: bool = False
+    ) -> _base.Application | None:
+        """The app, hibernated apps are woken up first (only started again if start)"""
         if app_id and (app := app_manager.apps.get(app_id)):
             return app
-        await self.emit_error(event, message=f"App with ID {app_id} not found!", sid=sid)
+        if app_id and app_id in app_manager.hibernator.apps:
+            try:
+                return await app_manager.hibernator.wake(app_id, start=start)
+            except Exception as error:
+                await self.emit_error(event, message=f"App {app_id} failed to wake up: {error}", sid=sid)
+                return None
+        if app_id and app_manager.cluster and (lease := (await app_manager.cluster.store.leases()).get(app_id)):
+            await self.emit_error(event, message=f"App {app_id} runs on node {lease['node_id']}", sid=sid)
+        else:
+            await self.emit_error(event, message=f"App with ID {app_id} not found!", sid=sid)
         return None
 
+    async def run_remote_operation(self, operation: AppOperation, sid: str, app_id: str | None) -> bool:
+        """Run the operation on the node of the app if it runs on another node
+
+        Returns False if the app doesn't run on another node.
+        """
+        if not app_manager.cluster or not app_id or app_id in app_manager.app_ids:
+            return False
+        if (await app_manager.cluster.store.leases()).get(app_id) is None:
+            return False
+
+        await self.run_operation(f"app_{operation}", operation, sid, {"appIds": [app_id]})
+        return True
+
     async def on_app_reload(self, sid: str, data: dict[str, Any]) -> None:
-        app = await self.get_app_or_send_error("app_reload", sid, data.get("appId"))
+        if await self.run_remote_operation("reload", sid, data.get("appId")):
+            return
+        app = await self.get_app_or_send_error("app_reload", sid, data.get("appId"), start=True)
         if not app:
             return
 
         async with sync_lock:
             app = await app_manager.reload_app(app.id)
 
-        await self.emit_success("app_reload", f"App {app.id} reloaded", {"app_update": await self.app_info(app)})
+        if self.has_receivers(sid, app_topics(app.id)):
+            await self.emit_success(
+                "app_reload", f"App {app.id} reloaded", {"app_update": await app_info(app)}, sid, app_topics(app.id)
+            )
 
     async def on_app_start(self, sid: str, data: dict[str, Any]) -> None:
-        app = await self.get_app_or_send_error("app_start", sid, data.get("appId"))
+        if await self.run_remote_operation("start", sid, data.get("appId")):
+            return
+        app = await self.get_app_or_send_error("app_start", sid, data.get("appId"), start=True)
         if not app:
             return
 
         async with sync_lock:
             await app_manager.start_app(app)
 
-        await self.emit_success("app_start", f"App {app.id} started", {"app_update": await self.app_info(app)})
+        if self.has_receivers(sid, app_topics(app.id)):
+            await self.emit_success(
+                "app_start", f"App {app.id} started", {"app_update": await app_info(app)}, sid, app_topics(app.id)
+            )
 
     async def on_app_pause(self, sid: str, data: dict[str, Any]) -> None:
+        if await self.run_remote_operation("pause", sid, data.get("appId")):
+            return
         app = await self.get_app_or_send_error("app_pause", sid, data.get("appId"))
         if not app:
             return
@@ -114,7 +277,10 @@ class ApiNamespace(Namespace):
         async with sync_lock:
             await app_manager.pause_app(app)
 
-        await self.emit_success("app_pause", f"App {app.id} paused", {"app_update": await self.app_info(app)})
+        if self.has_receivers(sid, app_topics(app.id)):
+            await self.emit_success(
+                "app_pause", f"App {app.id} paused", {"app_update": await app_info(app)}, sid, app_topics(app.id)
+            )
 
     async def on_app_edit(self, sid: str, data: dict[str, Any]) -> None:
         app_id: str = data.get("appId")  # type: ignore[assignment]
@@ -124,36 +290,38 @@ class ApiNamespace(Namespace):
 
         new_config = data.get("config")
         if new_config is None:
-            return await self.emit_error("app_edit", message='"config" not set!')
+            return await self.emit_error("app_edit", message='"config" not set!', sid=sid)
         old_config = serialise_model(app.arguments, exclude_defaults=True)
 
         try:
             parsed_config = app.Arguments.model_validate(new_config)
         except ValidationError as error:
-            return await self.emit_error("app_edit", message=f"Config validation error: {error}")
+            return await self.emit_error("app_edit", message=f"Config validation error: {error}", sid=sid)
 
         if app.arguments == parsed_config:
-            return await self.emit_warning("app_edit", "Nothing has changed")
+            return await self.emit_warning("app_edit", "Nothing has changed", sid=sid)
 
         async with sync_lock:
             app_config: ApplicationConfig = config.app_config(app_id)  # type: ignore[assignment]
             app_config.arguments = serialise_model(parsed_config, exclude_defaults=True)  # type: ignore[assignment]
             config.set_app_config(app_config)
 
-            Path("config.json").write_text(
-                json.dumps(json.loads(config.model_dump_json()), ensure_ascii=False, sort_keys=True, indent=2)
-            )
+            CONFIG_FILE.write_bytes(json.dumpb(config.model_dump(mode="json"), sort_keys=True, indent=True))
 
             app = await app_manager.reload_app(app.id)
 
+        if not self.has_receivers(sid, app_topics(app.id)):
+            return
         await self.emit_success(
             "app_edit",
             f"App {app.id} edited and reloaded",
             {
-                "app_update": await self.app_info(app),
+                "app_update": await app_info(app),
                 "new_config": serialise_model(app.arguments, exclude_defaults=True),
                 "old_config": old_config,
             },
+            sid,
+            app_topics(app.id),
         )
 
     async def on_app_schema(self, sid: str, data: dict[str, Any]) -> None:
@@ -166,25 +334,168 @@ class ApiNamespace(Namespace):
             "app_schema",
             f"Got schema for {app.id}",
             {
-                "schema": app.arguments.model_json_schema(),
+                "schema": model_schema(app.Arguments),
             },
+            sid=sid,
         )
 
     # ====
     # READ
     # ====
 
-    async def on_apps_config(self, _: str) -> None:
+    async def on_apps_config(self, sid: str) -> None:
         async with sync_lock:
             await self.emit_success(
                 "all_app_configs",
                 "All app info retrieved",
-                {"apps_update": [await self.app_info(app) for app in app_manager.apps.values()]},
+                {"apps_update": await apps_info()},
+                sid=sid,
             )
 
+    # ==========
+    # BROADCASTS
+    # ==========
+
+    async def emit_broadcast_progress(self, progress: BroadcastProgress, sid: str | None = None) -> None:
+        """Send progress to sid or, without sid, to the subscribers of the app"""
+        await self.emit_success(
+            "broadcast_progress", None, dict(progress), sid, None if sid else app_topics(progress["app_id"])
+        )
+
+    async def on_broadcasts(self, sid: str) -> None:
+        for job in app_manager.broadcasts.values():
+            await self.emit_broadcast_progress(job.progress(), sid=sid)
+
+    async def on_broadcast_cancel(self, sid: str, data: dict[str, Any]) -> None:
+        job_id = data.get("jobId")
+        if not job_id or not (job := app_manager.broadcasts.get(job_id)):
+            return await self.emit_error("broadcast_cancel", f"Broadcast {job_id} not found!", sid=sid)
+
+        await job.cancel()
+        await self.emit_success("broadcast_cancel", f"Broadcast {job.id} cancelled", None, sid, app_topics(job.app.id))
+
+    # ======
+    # STATUS
+    # ======
+
+    async def status_emitter_loop(self) -> None:
+        """Send the live status to the subscribers, see StatusMonitor
+
+        "status" gets the fleet and the apps that changed in one "status"
+        event, "status:<app id>" an "app_status" event when the app changed.
+        """
+        try:
+            async for update in app_manager.status.stream(config.status_interval):
+                await self.emit_success("status", None, dict(update), topics=("status",))
+                for status in update["apps"]:
+                    await self.emit_success("app_status", None, dict(status), topics=(f"status:{status['id']}",))
+        except asyncio.CancelledError:
+            pass
+
+    async def on_status(self, sid: str) -> None:
+        """The full current status of the subscribed apps and the fleet"""
+        current = app_manager.status.current()
+        subscribed = self.subscriptions.get(sid, set())
+        if "status" in subscribed:
+            await self.emit_success("status", None, dict(current), sid=sid)
+        for status in current["apps"]:
+            if f"status:{status['id']}" in subscribed:
+                await self.emit_success("app_status", None, dict(status), sid=sid)
+
+    # ======
+    # TRACES
+    # ======
+
+    async def on_traces(self, sid: str, data: dict[str, Any] | None = None) -> None:
+        """The slowest recent traces of all or the given app"""
+        data = data or {}
+        apps = [app_manager.apps[data["appId"]]] if data.get("appId") in app_manager.apps else app_manager.apps.values()
+        limit = int(data.get("limit") or 10)
+        traces = {app.id: app.tracer.slowest(limit) for app in apps}
+        await self.emit_success("traces", "", {"traces": traces}, sid=sid)
+
+    async def on_cache_stats(self, sid: str) -> None:
+        await self.emit_success(
+            "cache_stats",
+            "",
+            {"api_cache": app_manager.api_cache.get_stats(), "media_cache": app_manager.media_cache.get_stats()},
+            sid=sid,
+        )
+
+    async def on_hibernation_stats(self, sid: str) -> None:
+        await self.emit_success("hibernation_stats", "", dict(app_manager.hibernator.get_stats()), sid=sid)
+
     async def on_app_config(self, sid: str, data: dict[str, Any]) -> None:
         app = await self.get_app_or_send_error("app_config", sid, data.get("appId"))
         if not app:
             return
 
-        await self.emit_success("single_app_config", "App info retrieved", {"app_update": await self.app_info(app)})
+        await self.emit_success("single_app_config", "App info retrieved", {"app_update": await app_info(app)}, sid=sid)
+
+
+class BatchOperation(BaseModel):
+    app_ids: list[str] = []
+    # Per app, defaults to app_operation_timeout of the config
+    timeout: float | None = None
+
+
+def is_forwarded(request: Request) -> bool:
+    """The request comes from another node of the cluster"""
+    return FORWARDED_HEADER in request.headers
+
+
+@router.get("/apps", response_class=Response)
+async def get_apps(request: Request) -> Response:
+    """Info of all apps, requests of other nodes only get the apps of this node"""
+    return Response(json.dumpb(await apps_info(local=is_forwarded(request))), media_type="application/json")
+
+
+@router.post("/apps/{operation}", response_class=StreamingResponse)
+async def apps_operation(operation: AppOperation, batch: BatchOperation, request: Request) -> StreamingResponse:
+    """Start, pause or reload all or the given apps
+
+    Streams one JSON line per app as soon as it is done. In cluster mode the
+    apps of other nodes are forwarded to them.
+    """
+
+    async def results() -> AsyncIterator[bytes]:
+        async for result, _ in run_operation(operation, batch.app_ids, batch.timeout, is_forwarded(request)):
+            yield json.dumpb(result) + b"\n"
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+
+@router.get("/status", response_class=Response)
+async def get_status() -> Response:
+    """The latest live status of all apps of this node and the fleet"""
+    return Response(json.dumpb(app_manager.status.current()), media_type="application/json")
+
+
+@router.get("/cluster", response_class=Response)
+async def get_cluster() -> Response:
+    """The nodes of the cluster and which node owns which app"""
+    if not app_manager.cluster:
+        raise HTTPException(404, "Cluster mode is not enabled")
+    return Response(json.dumpb(await app_manager.cluster.status()), media_type="application/json")
+
+
+@router.get("/logs", response_class=Response)
+async def search_logs(
+    start: float | None = None,
+    end: float | None = None,
+    app: str | None = None,
+    level: str | None = None,
+    text: str | None = None,
+    cursor: str | None = None,
+    limit: int = 100,
+) -> Response:
+    """Search the log archive, newest entries first
+
+    start and end are unix timestamps, app an app id or "manager". Pass the
+    returned cursor to get the next page.
+    """
+    try:
+        page = await asyncio.to_thread(log_archive.search, start, end, app, level, text, cursor, min(limit, 1000))
+    except (KeyError, ValueError) as error:
+        raise HTTPException(400, f"Invalid search: {error}")
+    return Response(json.dumpb(page), media_type="application/json")
@@ -4,90 +4,235 @@ import logging
 import os
 import signal
 import time
-from typing import Any
+from typing import Any, Iterable
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, Response
 from fastapi.responses import HTMLResponse
-from fastapi.staticfiles import StaticFiles
 from fastapi_socketio import SocketManager
 
 from bots.api import ApiNamespace
+from bots.api import router as api_router
 from bots.applications import app_manager
+from bots.archive import ArchiveHandler, log_archive
+from bots.cluster import ClusterNode
 from bots.config import config
-from bots.log import LogEntry, SocketLogHandler, runtime_logs
-from bots.utils import Namespace
+from bots.log import LogEntry, SocketLogHandler, runtime_logs, setup_logging
+from bots.utils import Namespace, json
+from bots.utils.static import AssetStore
 
 HERE = importlib.resources.files("bots")
 
 app = FastAPI()
-manager: SocketManager = SocketManager(app)
+app.include_router(api_router)
+manager: SocketManager = SocketManager(
+    app,
+    json=json,
+    serializer=config.socket_serializer,
+    http_compression=config.socket_compression,
+    compression_threshold=config.socket_compression_threshold,
+)
 
 socket_log_handler = SocketLogHandler()
 socket_log_handler.setFormatter(logging.Formatter("%(name)s: %(message)s"))
 
-logging.basicConfig(
-    level=config.global_log_level_int,
-    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
-    handlers=[logging.StreamHandler(), socket_log_handler],
-)
+log_archive.open()
+log_listener = setup_logging(socket_log_handler, ArchiveHandler(log_archive))
 
 logger = logging.getLogger("bot_manager")
 logger.setLevel(config.local_log_level_int)
 
 
 app_manager.set_server(app)
+app_manager.media_cache.open()
+
+static_assets = AssetStore(HERE / "static", "/static")
+public_assets = AssetStore(HERE / "public", "")
+
+SOCKET_IO_CLIENTS = {
+    "default": "/static/socket.io/socket.io.min.js",
+    "msgpack": "/static/socket.io/socket.io.msgpack.min.js",
+}
+
+
+async def load_assets() -> None:
+    """Load static files into memory and render the index page"""
+    try:
+        await static_assets.load()
 
-# Add these lines to serve the 'index.html' file from the 'static' folder
-app.mount("/static", StaticFiles(directory=str(HERE / "static")), name="static")
+        # The client has to use the same packet parser as the server
+        index = (
+            (HERE / "public/index.html")
+            .read_text()
+            .replace(SOCKET_IO_CLIENTS["default"], SOCKET_IO_CLIENTS[config.socket_serializer])
+        )
+        public_assets.add("index.html", static_assets.hash_urls(index).encode(), "text/html")
+    except BaseException as error:
+        public_assets.error = error
+        raise
+    finally:
+        public_assets.loaded.set()
+
+
+def assets_loaded(task: "asyncio.Task[None]") -> None:
+    if not task.cancelled() and (error := task.exception()):
+        logger.error(f"Loading the assets failed: {error}", exc_info=error)
+
+
+@app.api_route("/static/{path:path}", methods=["GET", "HEAD"], include_in_schema=False)
+async def get_static(request: Request, path: str) -> Response:
+    return await static_assets.response(request, path)
 
 
 @app.get("/", response_class=HTMLResponse)
-async def get_index() -> str:
-    return (HERE / "public/index.html").read_text()
+async def get_index(request: Request) -> Response:
+    return await public_assets.response(request, "index.html")
 
 
 @app.on_event("shutdown")
 async def on_shutdown() -> None:
+    await app_manager.hibernator.stop()
+    if app_manager.cluster:
+        # Hands the apps over to the other nodes right away
+        await app_manager.cluster.stop()
     await app_manager.destroy_apps()
+    await app_manager.storage.close()
+    app_manager.trace_exporter.close()
+    log_listener.stop()
 
 
 @app.on_event("startup")
 async def on_startup() -> None:
+    # Compressing the assets takes a few seconds, requests for them wait until it's done
+    app.state.assets_loader = asyncio.create_task(load_assets())
+    app.state.assets_loader.add_done_callback(assets_loaded)
+
+    app_manager.hibernator.start()
+    if config.cluster.enabled:
+        # The node loads and starts the apps it owns itself
+        app_manager.cluster = ClusterNode.from_config(app_manager, config.cluster)
+        await app_manager.cluster.start()
+        return
+
     apps = await app_manager.initialize_apps(await app_manager.load_apps())
     for task in asyncio.as_completed([app_manager.start_app(app) for app in apps if app.auto_start]):
-        app = await task
-        entry = LogEntry(text=f"{app.name} auto started", status="success", timestamp=int(time.time()))
+        started = await task
+        entry = LogEntry(text=f"{started.name} auto started", status="success", timestamp=int(time.time()))
         logger.info(entry["text"])
         runtime_logs.append(entry)
 
 
+def log_topic_level(topic: str) -> int | None:
+    """The minimum level of a "log:<LEVEL>" topic, None for other topics"""
+    if topic.startswith("log:"):
+        return logging.getLevelNamesMapping().get(topic[4:].upper())
+    return None
+
+
 class ServerNamespace(Namespace):
+    """Server wide events and logs
+
+    Topics: "server" for server wide events, "log:<LEVEL>" for all logs of
+    the level and up. A client can only subscribe to one log level.
+    """
+
     namespace = "/server"
+    default_topics = ("server", f"log:{config.local_log_level.upper()}")
 
-    def __init__(self, log_queue: asyncio.Queue[dict[str, Any]], namespace: str | None = None) -> None:
+    def __init__(self, log_handler: SocketLogHandler, namespace: str | None = None) -> None:
         super().__init__(namespace)
 
-        self.log_queue = log_queue
+        self.log_handler = log_handler
+        self.log_queue = log_handler.queue
         self.log_emitter = asyncio.create_task(self.log_emitter_loop())
 
+    def valid_topic(self, topic: str) -> bool:
+        return topic == "server" or log_topic_level(topic) is not None
+
+    async def subscribe(self, sid: str, topics: Iterable[str]) -> None:
+        topics = list(topics)
+        if log_topics := [topic for topic in topics if log_topic_level(topic) is not None]:
+            # Replaces the current log level, otherwise the client would get logs twice
+            current = [topic for topic in self.subscriptions.get(sid, ()) if log_topic_level(topic) is not None]
+            await self.unsubscribe(sid, current)
+            topics = [topic for topic in topics if topic not in log_topics] + log_topics[-1:]
+        await super().subscribe(sid, topics)
+        self.update_log_level()
+
+    async def unsubscribe(self, sid: str, topics: Iterable[str]) -> None:
+        await super().unsubscribe(sid, topics)
+        self.update_log_level()
+
+    def update_log_level(self) -> None:
+        """Only let logs through to the queue that someone is subscribed to"""
+        levels = [level for topic in self.subscribers if (level := log_topic_level(topic)) is not None]
+        self.log_handler.min_level = min(levels, default=None)
+
     async def log_emitter_loop(self) -> None:
+        """Send queued logs to the clients
+
+        All logs that queued up while the previous batch was sent are sent
+        together in one "log_batch" event, so bursts of logs don't result in
+        one packet per entry. Each log level topic gets the logs of its level
+        and up.
+        """
         try:
             while True:
-                item: dict[str, Any] = await self.log_queue.get()
-                await self.emit_default("log", **item)
-                self.log_queue.task_done()
+                items: list[dict[str, Any]] = [await self.log_queue.get()]
+                while not self.log_queue.empty() and len(items) < config.socket_log_batch_size:
+                    items.append(self.log_queue.get_nowait())
+
+                for topic in list(self.subscribers):
+                    if (level := log_topic_level(topic)) is None:
+                        continue
+                    selected = [item for item in items if item["data"]["level"] >= level]
+                    if len(selected) == 1:
+                        await self.emit_default("log", **selected[0], topics=(topic,))
+                    elif selected:
+                        await self.emit_success("log_batch", None, selected, topics=(topic,))
+
+                for _ in items:
+                    self.log_queue.task_done()
         except asyncio.CancelledError:
             pass
 
     async def on_connect(self, sid: str, environ: dict[str, str]) -> None:
         await super().on_connect(sid, environ)
-        await self.emit_success("connect", "Connection established")
+        await self.emit_success("connect", "Connection established", sid=sid)
 
-    async def on_shutdown(self, _: str) -> None:
-        await app_manager.destroy_apps()
-        await self.emit_success("shutdown", "Stopped all apps and shutting down now...")
+    async def on_log_search(self, sid: str, data: dict[str, Any]) -> None:
+        """Search the log archive, results are streamed in "log_search" events
+
+        Every event contains a chunk of entries and the cursor to continue
+        with, the last one has done set.
+        """
+        query = {key: data.get(key) for key in ("start", "end", "app", "level", "text")}
+        cursor = data.get("cursor")
+        remaining = min(int(data.get("limit") or 100), 1000)
+        try:
+            while True:
+                page = await asyncio.to_thread(
+                    log_archive.search, **query, cursor=cursor, limit=min(remaining, config.log_search_chunk_size)
+                )
+                cursor = page["cursor"]
+                remaining -= len(page["entries"])
+                done = not cursor or remaining <= 0
+                await self.emit_success("log_search", "", {**page, "done": done}, sid=sid)
+                if done:
+                    return
+        except (KeyError, ValueError) as error:
+            await self.emit_error("log_search", f"Invalid search: {error}", sid=sid)
+
+    async def on_shutdown(self, sid: str) -> None:
+        report = await app_manager.destroy_apps()
+        await self.emit_success(
+            "shutdown",
+            f"Stopped all apps in {report['duration']:.2f}s and shutting down now...",
+            dict(report),
+            sid,
+            ("server",),
+        )
         os.kill(os.getpid(), signal.SIGINT)
 
 
-app.sio.register_namespace(ServerNamespace(socket_log_handler.queue))  # type: ignore[attr-defined]
+app.sio.register_namespace(ServerNamespace(socket_log_handler))  # type: ignore[attr-defined]
 app.sio.register_namespace(ApiNamespace())  # type: ignore[attr-defined]
@@ -1,4 +1,17 @@
-from ._base import Application
-from .manager import AppManager, app_manager
+import importlib
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from ._base import Application
+    from .manager import AppManager, app_manager
 
 __all__ = ["Application", "AppManager", "app_manager"]
+
+# Imported on first use, so importing an app module doesn't import the manager
+_EXPORTS = {"Application": "._base", "AppManager": ".manager", "app_manager": ".manager"}
+
+
+def __getattr__(name: str) -> Any:
+    if module := _EXPORTS.get(name):
+        return getattr(importlib.import_module(module, __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
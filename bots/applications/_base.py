@@ -1,15 +1,27 @@
+import asyncio
 import logging
-from typing import TYPE_CHECKING
+import time
+from typing import TYPE_CHECKING, Any
 
-from fastapi import APIRouter
 from pydantic import BaseModel, Field
-from telegram import User
-from telegram.ext import ApplicationBuilder
+from telegram import Update, User
+from telegram.ext import Application as TelegramApplication
+from telegram.ext import ApplicationBuilder, ExtBot, TypeHandler
 
-from bots.config import ApplicationConfig
+from bots.cache import CachedLookups
+from bots.config import ApplicationConfig, PollingConfig, UpdateQueueConfig
 from bots.config import config as global_config
+from bots.log import app_loggers
+from bots.media import BotMedia
+from bots.scheduler import SchedulerNamespace, SharedJobQueue
+from bots.storage import KeyValuePersistence, KeyValueStore
+from bots.tracing import TimedUpdateQueue, Tracer, TracingRequest
+from bots.updates import ChatOrderedUpdateProcessor, CountingApplication
+from bots.utils.telegram import allowed_updates
 
 if TYPE_CHECKING:
+    from bots.broadcast import BroadcastJob, ChatIdSource, SendCallback
+
     from .manager import AppManager
 
 
@@ -28,6 +40,9 @@ class AppStatus(BaseModel):
 
 
 class Application:
+    # Handler group of internal handlers that have to see every update first
+    internal_handler_group = -1_000_000
+
     class Arguments(BaseModel):
         pass
 
@@ -35,6 +50,12 @@ class Application:
         id: str
         telegram_token: str
         auto_start: bool = False
+        persistence: bool = False
+        concurrent_updates: int = 1
+        polling: PollingConfig = PollingConfig()
+        update_queue: UpdateQueueConfig = UpdateQueueConfig()
+        trace_sample_rate: float | None = None
+        hibernate_after: float | None = None
 
     def __init__(self, manager: "AppManager", config: ApplicationConfig) -> None:
         self.manager = manager
@@ -42,16 +63,68 @@ class Application:
         self.arguments = self.Arguments.model_validate(config.arguments)
 
         self.logger = logging.getLogger(self.id)
+        app_loggers.add(self.id)
         self.logger.setLevel(global_config.local_log_level_int)
 
         self.name = f"{self.__class__.__name__}-{self.config.id}"
 
         self.initialized: bool = False
         self.running: bool = False
+        self.started_at: float | None = None
+
+        # FastAPI is only imported once apps are created by the server
+        from fastapi import APIRouter
+
+        self.router = APIRouter()
+
+        # Persistent key value store only accessible by this app
+        self.storage: KeyValueStore = manager.storage.namespace(self.id)
+
+        sample_rate = self.config.trace_sample_rate
+        self.tracer = Tracer(
+            self.id,
+            global_config.trace_sample_rate if sample_rate is None else sample_rate,
+            manager.trace_exporter,
+            history=global_config.trace_history,
+        )
 
-        self.router: APIRouter = APIRouter()
+        queue = self.config.update_queue
+        # Once the processor stops taking updates with the "wait" policy, polling stops as well
+        update_queue = TimedUpdateQueue((queue.max_size or 0) if queue.overflow == "wait" else 0)
+        self.update_processor: ChatOrderedUpdateProcessor = ChatOrderedUpdateProcessor(
+            self.config.concurrent_updates,
+            max_size=queue.max_size,
+            overflow=queue.overflow,
+            prioritise=queue.prioritise,
+            priority_reserve=queue.priority_reserve,
+            max_age=queue.max_age,
+            max_age_reply=queue.max_age_reply,
+            tracer=self.tracer,
+            update_queue=update_queue,
+            activity=manager.status.activity,
+        )
+
+        # Jobs of self.application.job_queue run on the scheduler shared by all apps
+        self.job_scheduler: SchedulerNamespace = manager.scheduler.namespace(self.id)
+
+        builder = (
+            ApplicationBuilder()
+            .application_class(CountingApplication)
+            .token(self.config.telegram_token)
+            .concurrent_updates(self.update_processor)
+            .job_queue(SharedJobQueue(self.job_scheduler))
+            .update_queue(update_queue)
+            # Same pool size as PTB's default request
+            .request(TracingRequest(connection_pool_size=256))
+        )
+        if self.config.persistence:
+            builder = builder.persistence(KeyValuePersistence(self.storage))
+        self.application: TelegramApplication[ExtBot[Any], Any, Any, Any, Any, Any] = builder.build()
 
-        self.application = ApplicationBuilder().token(self.config.telegram_token).build()
+        # Bot API lookups cached across all apps, e.g. self.lookups.get_chat(chat_id)
+        self.lookups: CachedLookups = CachedLookups(manager.api_cache, self.application.bot)
+        # Cached downloads and file_id reuse for uploads, e.g. self.media.download(message.document)
+        self.media: BotMedia = BotMedia(manager.media_cache, self.lookups)
 
     @property
     def id(self) -> str:
@@ -61,6 +134,16 @@ class Application:
     def auto_start(self) -> bool:
         return self.config.auto_start
 
+    @property
+    def errors(self) -> int:
+        """Number of errors raised by the handlers and jobs so far"""
+        return self.application.errors if isinstance(self.application, CountingApplication) else 0
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of updates received but not processed yet"""
+        return self.update_processor.queued + self.application.update_queue.qsize()
+
     async def get_bot(self) -> User:
         if not self.application.bot._bot_user:
             await self.application.bot.get_me()
@@ -69,6 +152,26 @@ class Application:
     async def refresh_bot(self) -> User:
         return await self.application.bot.get_me()
 
+    def allowed_updates(self) -> list[str]:
+        """Update types polled, from the config or derived from the handlers"""
+        if (updates := self.config.polling.allowed_updates) is not None:
+            return updates
+        return allowed_updates(self.application, exclude_groups=[self.internal_handler_group])
+
+    def broadcast(self, chat_ids: "ChatIdSource", send: "SendCallback", **kwargs: Any) -> "BroadcastJob":
+        """Send a message to many chats in the background
+
+        chat_ids is an (async) iterable of chat ids or a file with one chat id
+        per line, send is called as send(bot, chat_id) for each of them:
+
+            job = self.broadcast(Path("chats.txt"), lambda bot, chat_id: bot.send_message(chat_id, "Hi"))
+            progress = await job.wait()
+
+        Pass a job_id to be able to resume an interrupted broadcast. See
+        BroadcastJob for all options.
+        """
+        return self.manager.start_broadcast(self, chat_ids, send, **kwargs)
+
     # =========
     # LIFECYCLE
     # =========
@@ -99,6 +202,9 @@ class Application:
             self.add_routes()
             if error_handler := getattr(self, "handle_error", None):
                 self.application.add_error_handler(error_handler)
+            self.application.add_handler(
+                TypeHandler(Update, self.lookups.invalidate_from_update), group=self.internal_handler_group
+            )
 
             await self.application.initialize()
             self.initialized = True
@@ -144,12 +250,26 @@ class Application:
             - shutdown()
         """
         if not self.running:
+            self.tracer.instrument(self.application)
             await self.application.start()
             if not self.application.updater:
                 raise RuntimeError("Trying to start bot before initialisation")
-            await self.application.updater.start_polling()
+
+            polling = self.config.polling
+            updates = self.allowed_updates()
+            if polling.allowed_updates is None:
+                self.logger.debug(f"Allowed updates: {', '.join(updates)}")
+
+            await self.application.updater.start_polling(
+                poll_interval=polling.poll_interval,
+                timeout=polling.timeout,
+                bootstrap_retries=polling.bootstrap_retries,
+                allowed_updates=updates,
+                drop_pending_updates=polling.drop_pending_updates,
+            )
 
             self.running = True
+            self.started_at = time.time()
 
             await self.on_start()
             self.logger.info("Started")
@@ -202,9 +322,9 @@ class Application:
     async def pause(self) -> None:
         """Pause the application
 
-        Waits for running tasks to finish then stops receiving updates from
-        Telegram, stops the update queue and the job queue. If there are sill
-        unprocessed updates in the queue, they will not be processed.
+        Stops receiving updates from Telegram, waits for the already received
+        updates to be processed (see drain()), then stops the update queue and
+        the job queue.
 
         Lifecycle:
             - initialize()
@@ -222,6 +342,7 @@ class Application:
             if not self.application.updater:
                 raise RuntimeError("Trying to pause bot while it hasn't been initialised")
             await self.application.updater.stop()
+            await self.drain(global_config.drain_timeout)
             await self.application.stop()
 
             self.running = False
@@ -229,11 +350,32 @@ class Application:
         else:
             self.logger.debug("Already paused")
 
+    async def drain(self, timeout: float) -> None:
+        """Wait for already received updates to be processed
+
+        Updates that are not done after timeout seconds are cancelled, those
+        still waiting in the queue are dropped.
+        """
+        update_queue = self.application.update_queue
+
+        async def join() -> None:
+            await update_queue.join()
+            await self.update_processor.join()
+
+        try:
+            await asyncio.wait_for(join(), timeout)
+        except asyncio.TimeoutError:
+            self.logger.warning(f"Updates not processed within {timeout}s, cancelling them")
+            while not update_queue.empty():
+                update_queue.get_nowait()
+                update_queue.task_done()
+            await self.update_processor.cancel()
+
     async def on_shutdown(self) -> None:
         """Right before the app is shut down
 
-        Override this instead of shutdown. Here you can save any in memory data,
-        close potential database connections and so on.
+        Override this instead of shutdown. Here you can save any in memory data
+        (e.g. to self.storage), close potential database connections and so on.
 
         Lifecycle:
             - initialize()
@@ -276,6 +418,8 @@ class Application:
 
             self.logger.info("Shutdown")
 
+        await self.storage.flush()
+
     async def reload(self) -> "Application":
         """Reload the whole app
 
@@ -1,17 +1,54 @@
+import asyncio
 import importlib
+import time
 from asyncio import gather
 from logging import getLogger
 from types import ModuleType
-from typing import Iterable, Type
-
-from fastapi import FastAPI
+from typing import TYPE_CHECKING, Any, AsyncIterator, Awaitable, Callable, Iterable, Literal, Type, TypedDict
 
 from bots.applications._base import Application
+from bots.broadcast import BroadcastJob, BroadcastProgress, ChatIdSource, SendCallback
+from bots.cache import ApiCache
 from bots.config import config
-from bots.utils.fastapi import remove_routes
+from bots.hibernation import Hibernator
+from bots.media import MediaCache
+from bots.scheduler import JobScheduler
+from bots.status import StatusMonitor
+from bots.storage import Storage
+from bots.tracing import TraceExporter
+from bots.utils.misc import LazyObject
+from bots.utils.pydantic import invalidate_model_caches
+
+if TYPE_CHECKING:
+    from fastapi import FastAPI
+
+    from bots.cluster import ClusterNode
 
 logger = getLogger("application_manager")
-logger.setLevel(config.local_log_level)
+
+AppOperation = Literal["start", "pause", "reload"]
+OPERATION_DONE: dict[AppOperation, str] = {"start": "started", "pause": "paused", "reload": "reloaded"}
+
+
+class AppShutdownReport(TypedDict):
+    status: Literal["success", "error", "timeout", "cancelled"]
+    message: str
+    duration: float
+    # Phase name -> duration in seconds
+    phases: dict[str, float]
+
+
+class ShutdownReport(TypedDict):
+    duration: float
+    apps: dict[str, AppShutdownReport]
+
+
+class AppOperationResult(TypedDict):
+    app_id: str
+    operation: AppOperation
+    status: Literal["success", "error", "timeout"]
+    message: str
+    duration: float
 
 
 class AppManager:
@@ -21,7 +58,38 @@ class AppManager:
         self._modules: dict[str, ModuleType] = {}
         self.apps: dict[str, Application] = {}
 
-        self.server: FastAPI
+        logger.setLevel(config.local_log_level)
+
+        self.server: "FastAPI"
+        self.storage = Storage(
+            config.storage_file,
+            flush_interval=config.storage_flush_interval,
+            batch_size=config.storage_batch_size,
+            cache_size=config.storage_cache_size,
+            compaction_interval=config.storage_compaction_interval,
+        )
+        self.api_cache = ApiCache(maxsize=config.api_cache_size, ttl=config.api_cache_ttl)
+        self.media_cache = MediaCache(
+            config.media_cache_dir, config.media_cache_max_size, self.storage.namespace("bots.media")
+        )
+        # Runs the jobs of all apps
+        self.scheduler = JobScheduler()
+        self.trace_exporter = TraceExporter(
+            config.log_dir / "traces" / "traces.jsonl",
+            max_bytes=config.log_file_max_bytes,
+            interval=config.log_file_interval,
+            backups=config.log_file_backups,
+        )
+
+        # Live status of the apps for the dashboard
+        self.status = StatusMonitor(self)
+        # Shuts down idle apps until their next update
+        self.hibernator = Hibernator(self)
+        # Set in cluster mode, see ClusterNode
+        self.cluster: "ClusterNode | None" = None
+
+        self.broadcasts: dict[str, BroadcastJob] = {}
+        self.broadcast_listeners: list[Callable[[BroadcastProgress], Awaitable[None]]] = []
 
     def _load_module(self, module_path: str) -> tuple[str, ModuleType]:
         module_path = module_path.split(":", 1)[0]
@@ -35,6 +103,7 @@ class AppManager:
         else:
             logger.info(f"Reloading {module_path}")
             self._modules[module_path] = module = importlib.reload(self._modules[module_path])
+            invalidate_model_caches(module_path)
 
         return module_path, module
 
@@ -47,12 +116,53 @@ class AppManager:
         except AttributeError:
             raise ImportError(f"Cannot import name '{name}' from '{module}'", name=module_path, path=module.__file__)
 
-    def set_server(self, server: FastAPI) -> None:
+    def set_server(self, server: "FastAPI") -> None:
         self.server = server
 
     def app_namespace_prefix(self, app: Application) -> str:
         return f"{self.bot_endpoint_prefix}/{app.id}"
 
+    @property
+    def app_ids(self) -> set[str]:
+        """IDs of the loaded and the hibernated apps"""
+        return set(self.apps) | set(self.hibernator.apps)
+
+    # ==========
+    # BROADCASTS
+    # ==========
+
+    def start_broadcast(
+        self, app: Application, source: ChatIdSource, send: SendCallback, **kwargs: Any
+    ) -> BroadcastJob:
+        """Start a broadcast job for the app, see BroadcastJob for the arguments"""
+        kwargs.setdefault("on_progress", self._notify_broadcast_listeners)
+        job = BroadcastJob(app, source, send, **kwargs)
+        if (running := self.broadcasts.get(job.id)) and running.status == "running":
+            raise ValueError(f"Broadcast {job.id} is already running")
+        # Moves a resumed job to the end, jobs are ordered by their (last) start
+        self.broadcasts.pop(job.id, None)
+        self.broadcasts[job.id] = job
+        self._evict_broadcasts()
+        return job.start()
+
+    def _evict_broadcasts(self) -> None:
+        """Keep all running and the latest broadcast_history other broadcasts"""
+        done = [job_id for job_id, job in self.broadcasts.items() if job.status != "running"]
+        for job_id in done[: max(len(done) - config.broadcast_history, 0)]:
+            del self.broadcasts[job_id]
+
+    def _remove_broadcasts(self, app: Application) -> None:
+        """Forget the broadcasts of a destroyed app, they can still be resumed by their job id"""
+        for job_id in [job_id for job_id, job in self.broadcasts.items() if job.app is app]:
+            del self.broadcasts[job_id]
+
+    async def _notify_broadcast_listeners(self, progress: BroadcastProgress) -> None:
+        await gather(*[listener(progress) for listener in self.broadcast_listeners])
+
+    async def cancel_broadcasts(self, app: Application) -> None:
+        """Cancel all running broadcasts of an app, they can be resumed later"""
+        await gather(*[job.cancel() for job in self.broadcasts.values() if job.app is app])
+
     # =========
     # LIFECYCLE
     # =========
@@ -71,6 +181,7 @@ class AppManager:
             raise IndexError(f"Application with ID {app_id} not found.")
 
         self.apps[app_config.id] = app = self._get_application_class(app_config.module)(self, app_config)
+        self.status.notify()
         return app
 
     async def load_apps(self, app_ids: Iterable[str] = []) -> list[Application]:
@@ -95,6 +206,7 @@ class AppManager:
     async def start_app(self, app: Application) -> Application:
         """Start an app"""
         await app.start()
+        self.status.notify()
         return app
 
     async def start_apps(self, apps: Iterable[Application] = []) -> list[Application]:
@@ -104,39 +216,120 @@ class AppManager:
     async def pause_app(self, app: Application) -> Application:
         """Pause an app"""
         await app.pause()
+        self.status.notify()
         return app
 
     async def pause_apps(self, apps: Iterable[Application] = []) -> list[Application]:
         """Pause all or given apps"""
         return await gather(*[self.pause_app(app) for app in apps or self.apps.values()])
 
-    async def shutdown_app(self, app: Application) -> Application:
+    async def shutdown_app(self, app: Application, phases: dict[str, float] | None = None) -> Application:
         """Shutdown an app
 
         Includes filtering the web api requests. It's not possible to remove the
         router due to limitations of FastAPI, but at least we can filter them.
+
+        The duration of each phase is recorded in phases if given.
         """
+        from bots.utils.fastapi import remove_routes
+
+        phases = {} if phases is None else phases
         remove_routes(self.app_namespace_prefix(app), app.router, self.server)
-        await app.shutdown()
+
+        steps: list[tuple[str, Callable[[], Awaitable[Any]]]] = [
+            ("broadcasts", lambda: self.cancel_broadcasts(app)),
+            ("pause", app.pause),
+            ("shutdown", app.shutdown),
+        ]
+        for phase, step in steps:
+            started = time.monotonic()
+            try:
+                await step()
+            finally:
+                phases[phase] = time.monotonic() - started
         return app
 
-    async def shutdown_apps(self, apps: Iterable[Application] = []) -> list[Application]:
-        """Shutdown all or given apps"""
-        return await gather(*[self.shutdown_app(app) for app in apps or self.apps.values()])
+    async def shutdown_apps(
+        self, apps: Iterable[Application] = [], timeout: float | None = None, app_timeout: float | None = None
+    ) -> ShutdownReport:
+        """Shutdown all or given apps in parallel within a deadline
+
+        Every app has app_timeout seconds (default app_shutdown_timeout of
+        the config) and all apps together timeout seconds (default
+        shutdown_timeout) before they are cancelled. A stuck app therefore
+        can't delay the shutdown of the other apps or the process exit.
+        """
+        timeout = config.shutdown_timeout if timeout is None else timeout
+        app_timeout = config.app_shutdown_timeout if app_timeout is None else app_timeout
+        apps = list(apps or self.apps.values())
+
+        started = time.monotonic()
+        reports = {app.id: AppShutdownReport(status="cancelled", message="", duration=0, phases={}) for app in apps}
+        tasks = {asyncio.create_task(self._shutdown_app_within(app, app_timeout, reports[app.id])): app for app in apps}
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            await gather(*pending, return_exceptions=True)
+            for task in pending:
+                app = tasks[task]
+                reports[app.id]["message"] = f"Cancelled after the shutdown deadline of {timeout}s"
+                reports[app.id]["duration"] = time.monotonic() - started
+                logger.error(f"{app.id}: {reports[app.id]['message']}")
+
+        report = ShutdownReport(duration=time.monotonic() - started, apps=reports)
+        failed = [app_id for app_id, app_report in reports.items() if app_report["status"] != "success"]
+        logger.info(
+            f"Shut down {len(apps) - len(failed)}/{len(apps)} apps in {report['duration']:.2f}s"
+            + (f", failed: {', '.join(failed)}" if failed else "")
+        )
+        return report
+
+    async def _shutdown_app_within(self, app: Application, timeout: float, report: AppShutdownReport) -> None:
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(self.shutdown_app(app, report["phases"]), timeout)
+            report["status"] = "success"
+        except asyncio.TimeoutError:
+            report["status"] = "timeout"
+            report["message"] = f"Did not shut down within {timeout}s"
+            logger.error(f"{app.id}: {report['message']}")
+        except Exception as error:
+            report["status"] = "error"
+            report["message"] = str(error)
+            logger.exception(f"{app.id}: Shutdown failed")
+        finally:
+            report["duration"] = time.monotonic() - started
 
     async def destroy_app(self, app_id: str) -> str:
         """Destroy an app
 
-        Shutdown the app then completely delete it
+        Shutdown the app then completely delete it, even if the shutdown fails
         """
+        if app_id in self.hibernator.apps:
+            await self.hibernator.forget(app_id)
+            return app_id
         app = self.apps[app_id]
-        await self.shutdown_app(app)
+        await self.shutdown_apps([app])
         del self.apps[app.id]
+        self.scheduler.remove_namespace(app.id)
+        self._remove_broadcasts(app)
+        self.status.notify()
         return app_id
 
-    async def destroy_apps(self, app_ids: Iterable[str] = []) -> list[Application]:
-        """Destroy all or given apps"""
-        return await gather(*[self.destroy_app(app) for app in app_ids or self.apps.keys()])
+    async def destroy_apps(self, app_ids: Iterable[str] = [], timeout: float | None = None) -> ShutdownReport:
+        """Destroy all or given apps, see shutdown_apps()"""
+        app_ids = list(app_ids or self.app_ids)
+        for app_id in app_ids:
+            await self.hibernator.forget(app_id)
+        apps = [self.apps[app_id] for app_id in app_ids if app_id in self.apps]
+        report = await self.shutdown_apps(apps, timeout)
+        for app in apps:
+            del self.apps[app.id]
+            self.scheduler.remove_namespace(app.id)
+            self._remove_broadcasts(app)
+        self.status.notify()
+        return report
 
     async def _pure_reload_app(self, app_id: str) -> Application:
         """Destroy and load an app"""
@@ -152,6 +345,12 @@ class AppManager:
         if update_config:
             config.reload_app_config(app_id)
 
+        if app_id in self.hibernator.apps:
+            # Hibernated apps are running apps
+            await self.hibernator.forget(app_id)
+            app = await self.initialize_app(await self.load_app(app_id))
+            return await self.start_app(app)
+
         start_again = self.apps[app_id].running
         app = await self._pure_reload_app(app_id)
         await self.initialize_app(app)
@@ -162,7 +361,7 @@ class AppManager:
 
     async def reload_apps(self, app_ids: Iterable[str] = []) -> list[Application]:
         """Reload all or given apps"""
-        running = {app_id: self.apps[app_id].running for app_id in app_ids or self.apps.keys()}
+        running = {app_id: app_id not in self.apps or self.apps[app_id].running for app_id in app_ids or self.app_ids}
         if not app_ids:
             await self.destroy_apps()
             config.reload_config()
@@ -174,5 +373,92 @@ class AppManager:
         await gather(*[self.start_app(app) for app in apps if running.get(app.id, app.auto_start)])
         return apps
 
+    # ===============
+    # BULK OPERATIONS
+    # ===============
+
+    async def run_operation(
+        self, operation: AppOperation, app_ids: Iterable[str] = (), timeout: float | None = None
+    ) -> AsyncIterator[tuple[AppOperationResult, Application | None]]:
+        """Start, pause or reload all or given apps concurrently
+
+        Unlike start_apps() and co. the result of each app is yielded as soon
+        as it is done. Every app has its own timeout (defaults to
+        app_operation_timeout of the config) and a failing app doesn't affect
+        the others. The app is None if it doesn't exist (anymore). Closing
+        the iterator early waits for the remaining operations to finish.
+        """
+        timeout = config.app_operation_timeout if timeout is None else timeout
+        app_ids = list(app_ids)
+        if operation == "reload" and not app_ids:
+            # Like reload_apps(), also pick up added and removed apps
+            config.reload_config()
+            app_ids = list(dict.fromkeys([*self.app_ids, *(app.id for app in config.app_configs)]))
+        elif not app_ids:
+            app_ids = list(self.app_ids)
+
+        tasks = [asyncio.create_task(self._run_app_operation(operation, app_id, timeout)) for app_id in app_ids]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            # Started operations run to completion even if the consumer stops early (e.g. a
+            # disconnected client), cancelling them could leave apps half started or reloaded
+            await asyncio.shield(asyncio.gather(*tasks, return_exceptions=True))
+
+    async def _run_app_operation(
+        self, operation: AppOperation, app_id: str, timeout: float | None
+    ) -> tuple[AppOperationResult, Application | None]:
+        started = time.monotonic()
+
+        def result(status: Literal["success", "error", "timeout"], message: str) -> AppOperationResult:
+            return AppOperationResult(
+                app_id=app_id,
+                operation=operation,
+                status=status,
+                message=message,
+                duration=time.monotonic() - started,
+            )
+
+        app = self.apps.get(app_id)
+        hibernated = app_id in self.hibernator.apps
+        if not app and not hibernated and operation != "reload":
+            return result("error", f"App with ID {app_id} not found!"), None
+
+        try:
+            if hibernated and operation != "reload":
+                app = await asyncio.wait_for(self.hibernator.wake(app_id, start=operation == "start"), timeout)
+            elif operation == "start" and app:
+                await asyncio.wait_for(self.start_app(app), timeout)
+            elif operation == "pause" and app:
+                await asyncio.wait_for(self.pause_app(app), timeout)
+            else:
+                app = await asyncio.wait_for(self._reload_or_load_app(app_id), timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"{app_id}: {operation} timed out after {timeout}s")
+            return result("timeout", f"App {app_id} did not {operation} within {timeout}s"), self.apps.get(app_id)
+        except Exception as error:
+            logger.exception(f"{app_id}: {operation} failed")
+            return result("error", f"App {app_id} failed to {operation}: {error}"), self.apps.get(app_id)
+
+        if not app:
+            return result("success", f"App {app_id} removed"), None
+        return result("success", f"App {app_id} {OPERATION_DONE[operation]}"), app
+
+    async def _reload_or_load_app(self, app_id: str) -> Application | None:
+        """Reload a loaded app, load a new or destroy a removed app"""
+        configured = config.app_config(app_id) is not None
+        if app_id in self.app_ids:
+            if not configured:
+                await self.destroy_app(app_id)
+                return None
+            return await self.reload_app(app_id)
+
+        app = await self.initialize_app(await self.load_app(app_id))
+        if app.auto_start:
+            await self.start_app(app)
+        return app
+
 
-app_manager = AppManager()
+# Created on first use, see LazyObject
+app_manager: AppManager = LazyObject(AppManager)  # type: ignore[assignment]
@@ -0,0 +1,340 @@
+import bisect
+import itertools
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import IO, Any, Iterator, TypedDict
+
+from bots.config import config
+from bots.log import log_stream, serialise_record
+from bots.utils import json
+from bots.utils.misc import LazyObject
+
+LEVELS = logging.getLevelNamesMapping()
+
+
+class BlockIndex(TypedDict):
+    """Sparse index entry of a block of consecutive log entries"""
+
+    segment: int
+    offset: int
+    length: int
+    count: int
+    start: float
+    end: float
+    # Highest log level in the block
+    level: int
+    # Streams (app ids or "manager") with entries in the block
+    apps: list[str]
+
+
+class SearchPage(TypedDict):
+    entries: list[dict[str, Any]]
+    # Pass to search() to get the next (older) page, None if there is none
+    cursor: str | None
+
+
+class LogArchive:
+    """Append only on-disk archive of all log entries with a search index
+
+    Entries are written as JSON lines to segment files in blocks of
+    block_size entries. Every block gets an entry in the sparse index (its
+    segment, offset, time range, highest level and the apps it contains),
+    kept in memory and appended to the segment's .idx file. Per app posting
+    lists (block numbers) let app searches skip all blocks without entries
+    of the app. Only the blocks that can match a query are read from disk.
+
+    Segments are closed after segment_size bytes, the oldest are deleted
+    once all segments are larger than max_size bytes. Writes happen on the
+    log listener thread, searches on any thread.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        segment_size: int = 64 * 1024 * 1024,
+        max_size: int = 1024 * 1024 * 1024,
+        block_size: int = 256,
+        flush_interval: float = 1,
+    ) -> None:
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_size = max_size
+        self.block_size = block_size
+        self.flush_interval = flush_interval
+
+        self._lock = threading.Lock()
+        # Block number of self.blocks[0], blocks of deleted segments are dropped
+        self.first_block = 0
+        self.blocks: list[BlockIndex] = []
+        self.postings: dict[str, list[int]] = {}
+        # Highest end time of all blocks up to the block, allows stopping searches early
+        self._end_max: list[float] = []
+
+        # Not yet written block: (time, level, stream, line)
+        self._pending: list[tuple[float, int, str, bytes]] = []
+        self._pending_since = 0.0
+
+        self._segment = -1
+        self._segment_file: IO[bytes] | None = None
+        self._index_file: IO[bytes] | None = None
+        self._segment_sizes: dict[int, int] = {}
+
+    # =======
+    # WRITING
+    # =======
+
+    def _segment_path(self, segment: int, suffix: str = ".seg") -> Path:
+        return self.directory / f"{segment:08d}{suffix}"
+
+    def open(self) -> None:
+        """Load the index of the existing segments and start a new one"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            for index_path in sorted(self.directory.glob("*.idx")):
+                segment = int(index_path.stem)
+                if not self._segment_path(segment).exists():
+                    index_path.unlink()
+                    continue
+                for line in index_path.read_bytes().splitlines():
+                    try:
+                        self._add_block(json.loads(line))
+                    except ValueError:
+                        # Partially written entry of a crash, the block isn't referenced
+                        break
+                self._segment_sizes[segment] = self._segment_path(segment).stat().st_size
+                self._segment = segment
+            self._open_segment(self._segment + 1)
+            self._apply_retention()
+
+    def _open_segment(self, segment: int) -> None:
+        if self._segment_file and self._index_file:
+            self._segment_file.close()
+            self._index_file.close()
+        self._segment = segment
+        self._segment_file = self._segment_path(segment).open("ab")
+        self._index_file = self._segment_path(segment, ".idx").open("ab")
+        self._segment_sizes[segment] = 0
+
+    def _add_block(self, block: BlockIndex) -> None:
+        number = self.first_block + len(self.blocks)
+        self.blocks.append(block)
+        self._end_max.append(max(block["end"], self._end_max[-1] if self._end_max else block["end"]))
+        for app in block["apps"]:
+            self.postings.setdefault(app, []).append(number)
+
+    def append(self, created: float, level: int, stream: str, line: bytes) -> None:
+        with self._lock:
+            if not self._pending:
+                self._pending_since = time.monotonic()
+            self._pending.append((created, level, stream, line))
+            if len(self._pending) >= self.block_size or time.monotonic() - self._pending_since > self.flush_interval:
+                self._write_block()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._write_block()
+
+    def _write_block(self) -> None:
+        if not self._pending or not self._segment_file or not self._index_file:
+            return
+
+        data = b"".join(line for *_, line in self._pending)
+        block = BlockIndex(
+            segment=self._segment,
+            offset=self._segment_sizes[self._segment],
+            length=len(data),
+            count=len(self._pending),
+            start=min(created for created, *_ in self._pending),
+            end=max(created for created, *_ in self._pending),
+            level=max(level for _, level, *_ in self._pending),
+            apps=sorted({stream for *_, stream, _ in self._pending}),
+        )
+        self._segment_file.write(data)
+        self._segment_file.flush()
+        # The index entry is written last, so it only ever references complete blocks
+        self._index_file.write(json.dumpb(block) + b"\n")
+        self._index_file.flush()
+
+        self._segment_sizes[self._segment] += len(data)
+        self._pending = []
+        self._add_block(block)
+
+        if self._segment_sizes[self._segment] >= self.segment_size:
+            self._open_segment(self._segment + 1)
+            self._apply_retention()
+
+    def _apply_retention(self) -> None:
+        while sum(self._segment_sizes.values()) > self.max_size and len(self._segment_sizes) > 1:
+            oldest = min(self._segment_sizes)
+            del self._segment_sizes[oldest]
+            self._segment_path(oldest).unlink(missing_ok=True)
+            self._segment_path(oldest, ".idx").unlink(missing_ok=True)
+
+            dropped = 0
+            while dropped < len(self.blocks) and self.blocks[dropped]["segment"] == oldest:
+                dropped += 1
+            del self.blocks[:dropped]
+            del self._end_max[:dropped]
+            self.first_block += dropped
+            for app, numbers in list(self.postings.items()):
+                del numbers[: bisect.bisect_left(numbers, self.first_block)]
+                if not numbers:
+                    del self.postings[app]
+
+    def close(self) -> None:
+        with self._lock:
+            self._write_block()
+            if self._segment_file and self._index_file:
+                self._segment_file.close()
+                self._index_file.close()
+                self._segment_file = self._index_file = None
+
+    # =========
+    # SEARCHING
+    # =========
+
+    def _read_block(self, block: BlockIndex, files: dict[int, int]) -> bytes:
+        """Read a block, files caches the file descriptors of the segments during a search"""
+        try:
+            if (fd := files.get(block["segment"])) is None:
+                fd = files[block["segment"]] = os.open(self._segment_path(block["segment"]), os.O_RDONLY)
+            return os.pread(fd, block["length"], block["offset"])
+        except FileNotFoundError:
+            # Deleted by the retention in the meantime
+            return b""
+
+    @staticmethod
+    def _candidate_blocks(postings: list[int] | None, first_block: int, before: int) -> Iterator[int]:
+        """Numbers of the blocks that can contain entries of the app, newest first
+
+        postings are the block numbers of the app, None for all apps.
+        """
+        if postings is None:
+            yield from range(before - 1, first_block - 1, -1)
+            return
+        yield from reversed(postings[: bisect.bisect_left(postings, before)])
+
+    def search(
+        self,
+        start: float | None = None,
+        end: float | None = None,
+        app: str | None = None,
+        level: str | None = None,
+        text: str | None = None,
+        cursor: str | None = None,
+        limit: int = 100,
+    ) -> SearchPage:
+        """Find entries, newest first
+
+        start and end are unix timestamps, app an app id (or "manager"),
+        level the minimum level and text a case-insensitive substring of the
+        message. Use the returned cursor to get the next page.
+        """
+        start = float("-inf") if start is None else start
+        end = float("inf") if end is None else end
+        min_level = LEVELS[level.upper()] if level else 0
+        needle = text.lower() if text else None
+        # JSON escaped characters can't be searched in the raw line and bytes.lower() only
+        # lowercases ASCII, other needles are only compared to the decoded message
+        raw_needle = (
+            needle.encode()
+            if needle and needle.isascii() and needle.isprintable() and not set(needle) & {'"', "\\"}
+            else None
+        )
+
+        with self._lock:
+            pending_number = self.first_block + len(self.blocks)
+            pending = [line for *_, line in self._pending]
+            first_block = self.first_block
+            blocks = self.blocks[:]
+            end_max = self._end_max[:]
+            # The writer appends to and trims the postings
+            postings = self.postings.get(app, [])[:] if app is not None else None
+
+        if cursor:
+            block_number, position = map(int, cursor.split(":"))
+        else:
+            block_number, position = pending_number, len(pending)
+
+        def matches(line: bytes) -> dict[str, Any] | None:
+            if raw_needle and raw_needle not in line.lower():
+                return None
+            entry: dict[str, Any] = json.loads(line)
+            if (
+                not start <= entry["time"] <= end
+                or LEVELS.get(entry["level"], 0) < min_level
+                or (app and (entry["app"] or "manager") != app)
+                or (needle and needle not in entry["message"].lower())
+            ):
+                return None
+            return entry
+
+        entries: list[dict[str, Any]] = []
+        numbers: Iterator[int]
+        if block_number >= pending_number:
+            numbers = itertools.chain([pending_number], self._candidate_blocks(postings, first_block, pending_number))
+        else:
+            numbers = self._candidate_blocks(postings, first_block, block_number + 1)
+
+        files: dict[int, int] = {}
+        try:
+            for number in numbers:
+                if number == pending_number:
+                    lines = pending
+                else:
+                    if number < first_block:
+                        break
+                    block = blocks[number - first_block]
+                    if end_max[number - first_block] < start:
+                        # All older blocks ended before the start as well
+                        break
+                    if block["start"] > end or block["end"] < start or block["level"] < min_level:
+                        continue
+                    data = self._read_block(block, files)
+                    if raw_needle and raw_needle not in data.lower():
+                        continue
+                    lines = data.splitlines()
+
+                stop = position if number == block_number else len(lines)
+                for index in range(min(stop, len(lines)) - 1, -1, -1):
+                    if (entry := matches(lines[index])) is None:
+                        continue
+                    entries.append(entry)
+                    if len(entries) >= limit:
+                        return SearchPage(entries=entries, cursor=f"{number}:{index}")
+        finally:
+            for fd in files.values():
+                os.close(fd)
+
+        return SearchPage(entries=entries, cursor=None)
+
+
+class ArchiveHandler(logging.Handler):
+    """Write all records to a LogArchive, meant to run behind a QueueListener"""
+
+    def __init__(self, archive: LogArchive, level: int = logging.NOTSET) -> None:
+        super().__init__(level)
+        self.archive = archive
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            stream = log_stream(record)
+            self.archive.append(record.created, record.levelno, stream, serialise_record(record, stream))
+        except Exception:
+            self.handleError(record)
+
+    def close(self) -> None:
+        self.archive.close()
+        super().close()
+
+
+log_archive: LogArchive = LazyObject(  # type: ignore[assignment]
+    lambda: LogArchive(
+        config.log_dir / "archive",
+        segment_size=config.log_archive_segment_size,
+        max_size=config.log_archive_max_size,
+    )
+)
@@ -0,0 +1,282 @@
+import asyncio
+import time
+import uuid
+from logging import getLogger
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Iterable, Literal, TypedDict
+
+from telegram import Bot
+from telegram.error import BadRequest, ChatMigrated, Forbidden, NetworkError, RetryAfter
+
+if TYPE_CHECKING:
+    from bots.applications._base import Application
+
+logger = getLogger("broadcast")
+
+ChatId = int | str
+ChatIdSource = AsyncIterable[ChatId] | Iterable[ChatId] | Path
+SendCallback = Callable[[Bot, ChatId], Awaitable[Any]]
+BroadcastStatus = Literal["running", "finished", "cancelled", "failed"]
+
+
+class BroadcastProgress(TypedDict):
+    job_id: str
+    app_id: str
+    status: BroadcastStatus
+    total: int | None
+    processed: int
+    sent: int
+    failed: int
+    errors: dict[str, int]
+    rate: float
+    elapsed: float
+
+
+class RateLimiter:
+    """Spaces out acquisitions to at most rate per second"""
+
+    def __init__(self, rate: float) -> None:
+        self.interval = 1 / rate
+        self._next_slot = 0.0
+
+    async def acquire(self) -> None:
+        now = time.monotonic()
+        slot = max(self._next_slot, now)
+        self._next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def pause(self, seconds: float) -> None:
+        """Don't hand out any slots for the given time (e.g. after a flood wait)"""
+        self._next_slot = max(self._next_slot, time.monotonic() + seconds)
+
+
+async def _iterate_chat_ids(source: ChatIdSource, chunk_size: int = 1000) -> AsyncIterator[ChatId]:
+    if isinstance(source, Path):
+        # One chat id per line, read in chunks so huge files don't block the loop
+        with source.open() as file:
+            while lines := await asyncio.to_thread(file.readlines, chunk_size * 16):
+                for line in lines:
+                    if line := line.strip():
+                        yield int(line) if line.lstrip("-").isdigit() else line
+    elif isinstance(source, AsyncIterable):
+        async for chat_id in source:
+            yield chat_id
+    else:
+        for chat_id in source:
+            yield chat_id
+
+
+class BroadcastJob:
+    """Send a message to many chats under Telegram's rate limits
+
+    Chats are processed in order with at most concurrency messages in flight
+    and at most rate messages per second. Flood waits pause the whole job,
+    network errors are retried, chats that blocked the bot or don't exist are
+    counted as failed.
+
+    Progress is checkpointed to the app's storage every progress_interval
+    seconds. Starting a job with the same job_id and the same chat id source
+    resumes it after the last checkpoint.
+    """
+
+    max_retries = 3
+
+    def __init__(
+        self,
+        app: "Application",
+        source: ChatIdSource,
+        send: SendCallback,
+        job_id: str | None = None,
+        total: int | None = None,
+        concurrency: int = 8,
+        rate: float = 25,
+        progress_interval: float = 1,
+        on_progress: Callable[[BroadcastProgress], Awaitable[None]] | None = None,
+    ) -> None:
+        self.app = app
+        self.source = source
+        self.send = send
+        self.id = job_id or uuid.uuid4().hex[:12]
+        self.total = total
+        self.concurrency = concurrency
+        self.rate_limiter = RateLimiter(rate)
+        self.progress_interval = progress_interval
+        self.on_progress = on_progress
+
+        self.status: BroadcastStatus = "running"
+        self.offset = 0
+        self.sent = 0
+        self.failed = 0
+        self.errors: dict[str, int] = {}
+
+        # Processed chats after the offset: index -> None if sent, else the error name
+        self._completed: dict[int, str | None] = {}
+        # Counters of the chats before the offset, the only ones that are checkpointed
+        self._checkpoint_sent = 0
+        self._checkpoint_failed = 0
+        self._checkpoint_errors: dict[str, int] = {}
+        self._started = 0.0
+        self._processed_at_start = 0
+        self._task: asyncio.Task[None] | None = None
+
+    @property
+    def checkpoint_key(self) -> str:
+        return f"broadcast:{self.id}"
+
+    @property
+    def processed(self) -> int:
+        return self.offset + len(self._completed)
+
+    def progress(self) -> BroadcastProgress:
+        elapsed = time.monotonic() - self._started if self._started else 0
+        return BroadcastProgress(
+            job_id=self.id,
+            app_id=self.app.id,
+            status=self.status,
+            total=self.total,
+            processed=self.processed,
+            sent=self.sent,
+            failed=self.failed,
+            errors=self.errors,
+            rate=(self.processed - self._processed_at_start) / elapsed if elapsed else 0,
+            elapsed=elapsed,
+        )
+
+    # =========
+    # LIFECYCLE
+    # =========
+
+    def start(self) -> "BroadcastJob":
+        self._task = asyncio.create_task(self.run())
+        return self
+
+    async def cancel(self) -> None:
+        """Stop the job, it can be resumed later"""
+        if self._task and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def wait(self) -> BroadcastProgress:
+        if self._task:
+            await asyncio.gather(self._task, return_exceptions=True)
+        return self.progress()
+
+    async def run(self) -> None:
+        if checkpoint := await self.app.storage.get(self.checkpoint_key):
+            self.offset = checkpoint["offset"]
+            self.sent = self._checkpoint_sent = checkpoint["sent"]
+            self.failed = self._checkpoint_failed = checkpoint["failed"]
+            self.errors, self._checkpoint_errors = dict(checkpoint["errors"]), dict(checkpoint["errors"])
+            logger.info(f"{self.app.id}: Resuming broadcast {self.id} at {self.offset}")
+
+        self._started = time.monotonic()
+        self._processed_at_start = self.offset
+        reporter = asyncio.create_task(self._report_loop())
+        try:
+            await self._process()
+            self.status = "finished"
+        except asyncio.CancelledError:
+            self.status = "cancelled"
+            raise
+        except Exception as error:
+            self.status = "failed"
+            logger.error(f"{self.app.id}: Broadcast {self.id} failed: {error}")
+        finally:
+            reporter.cancel()
+            await self._report()
+            logger.info(f"{self.app.id}: Broadcast {self.id} {self.status}, {self.sent} sent, {self.failed} failed")
+
+    async def _process(self) -> None:
+        queue: asyncio.Queue[tuple[int, ChatId]] = asyncio.Queue(self.concurrency * 2)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.concurrency)]
+        try:
+            index = 0
+            async for chat_id in _iterate_chat_ids(self.source):
+                if index >= self.offset:
+                    await queue.put((index, chat_id))
+                index += 1
+            await queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    async def _worker(self, queue: asyncio.Queue[tuple[int, ChatId]]) -> None:
+        while True:
+            index, chat_id = await queue.get()
+            try:
+                self._complete(index, await self._send(chat_id))
+            finally:
+                queue.task_done()
+
+    async def _send(self, chat_id: ChatId) -> str | None:
+        """Send to the chat, returns the name of the error if it failed"""
+        error: Exception | None = None
+        for attempt in range(self.max_retries + 1):
+            await self.rate_limiter.acquire()
+            try:
+                await self.send(self.app.application.bot, chat_id)
+                self.sent += 1
+                return None
+            except RetryAfter as retry_after:
+                self.rate_limiter.pause(retry_after.retry_after)
+                error = retry_after
+            except ChatMigrated as migrated:
+                chat_id = migrated.new_chat_id
+                error = migrated
+            except (Forbidden, BadRequest) as not_retryable:
+                error = not_retryable
+                break
+            except NetworkError as network_error:
+                error = network_error
+                await asyncio.sleep(2**attempt)
+            except Exception as unexpected:
+                error = unexpected
+                break
+
+        self.failed += 1
+        error_name = type(error).__name__
+        self.errors[error_name] = self.errors.get(error_name, 0) + 1
+        logger.debug(f"{self.app.id}: Broadcast {self.id} to {chat_id} failed: {error}")
+        return error_name
+
+    def _complete(self, index: int, error: str | None) -> None:
+        # Only the contiguous prefix of processed chats can be checkpointed
+        self._completed[index] = error
+        while self.offset in self._completed:
+            if (error := self._completed.pop(self.offset)) is None:
+                self._checkpoint_sent += 1
+            else:
+                self._checkpoint_failed += 1
+                self._checkpoint_errors[error] = self._checkpoint_errors.get(error, 0) + 1
+            self.offset += 1
+
+    # ========
+    # PROGRESS
+    # ========
+
+    async def _report_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            await self._report()
+
+    async def _report(self) -> None:
+        if self.status == "finished":
+            self.app.storage.delete(self.checkpoint_key)
+        else:
+            self.app.storage.set(
+                self.checkpoint_key,
+                {
+                    "offset": self.offset,
+                    "sent": self._checkpoint_sent,
+                    "failed": self._checkpoint_failed,
+                    "errors": self._checkpoint_errors,
+                },
+            )
+
+        if self.on_progress:
+            try:
+                await self.on_progress(self.progress())
+            except Exception as error:
+                logger.error(f"{self.app.id}: Failed to report broadcast progress: {error}")
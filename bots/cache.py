@@ -0,0 +1,178 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, TypedDict
+
+from telegram import Bot, Chat, ChatMember, File, Update
+from telegram.ext import ContextTypes
+
+
+class CacheStats(TypedDict):
+    size: int
+    hits: int
+    misses: int
+    coalesced: int
+    evictions: int
+    invalidations: int
+
+
+class ApiCache:
+    """Size bounded LRU cache with per entry TTLs shared by all apps
+
+    fetch() deduplicates concurrent calls for the same key: while a lookup
+    is in flight, further callers wait for its result instead of sending the
+    same request to Telegram again.
+    """
+
+    def __init__(self, maxsize: int = 10_000, ttl: float = 300) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._in_flight: dict[Hashable, asyncio.Future[Any]] = {}
+
+        self.stats = CacheStats(size=0, hits=0, misses=0, coalesced=0, evictions=0, invalidations=0)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        if (entry := self._entries.get(key)) is None:
+            return default
+        expires, value = entry
+        if expires <= time.monotonic():
+            del self._entries[key]
+            return default
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None) -> None:
+        self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def invalidate(self, *keys: Hashable) -> None:
+        for key in keys:
+            if self._entries.pop(key, None) is not None:
+                self.stats["invalidations"] += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    async def fetch(self, key: Hashable, factory: Callable[[], Awaitable[Any]], ttl: float | None = None) -> Any:
+        """Get the cached value or create it with factory()"""
+        if (entry := self._entries.get(key)) is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[1]
+
+        if (future := self._in_flight.get(key)) is not None:
+            self.stats["coalesced"] += 1
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # The caller doing the lookup was cancelled, try it ourselves
+                return await self.fetch(key, factory, ttl)
+
+        self.stats["misses"] += 1
+        self._in_flight[key] = future = asyncio.get_running_loop().create_future()
+        try:
+            value = await factory()
+        except Exception as error:
+            future.set_exception(error)
+            # Mark the exception as retrieved in case nobody else was waiting
+            future.exception()
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        else:
+            self.set(key, value, ttl)
+            future.set_result(value)
+            return value
+        finally:
+            del self._in_flight[key]
+
+    def get_stats(self) -> CacheStats:
+        return self.stats | {"size": len(self._entries)}  # type: ignore[return-value]
+
+
+class CachedLookups:
+    """Cached idempotent Bot API lookups of a single bot
+
+    Entries are invalidated by invalidate_from_update() when an incoming
+    update indicates that the cached data has changed.
+    """
+
+    chat_ttl: float = 300
+    chat_member_ttl: float = 60
+    chat_administrators_ttl: float = 300
+    # Download links are valid for at least one hour
+    file_ttl: float = 3000
+
+    def __init__(self, cache: ApiCache, bot: Bot) -> None:
+        self.cache = cache
+        self.bot = bot
+        # Doesn't require the bot to be initialised unlike bot.id
+        self.bot_key = bot.token.split(":", 1)[0]
+
+    async def get_chat(self, chat_id: int | str) -> Chat:
+        return await self.cache.fetch(  # type: ignore[no-any-return]
+            (self.bot_key, "get_chat", chat_id), lambda: self.bot.get_chat(chat_id), self.chat_ttl
+        )
+
+    async def get_chat_member(self, chat_id: int | str, user_id: int) -> ChatMember:
+        return await self.cache.fetch(  # type: ignore[no-any-return]
+            (self.bot_key, "get_chat_member", chat_id, user_id),
+            lambda: self.bot.get_chat_member(chat_id, user_id),
+            self.chat_member_ttl,
+        )
+
+    async def get_chat_administrators(self, chat_id: int | str) -> tuple[ChatMember, ...]:
+        return await self.cache.fetch(  # type: ignore[no-any-return]
+            (self.bot_key, "get_chat_administrators", chat_id),
+            lambda: self.bot.get_chat_administrators(chat_id),
+            self.chat_administrators_ttl,
+        )
+
+    async def get_file(self, file_id: str) -> File:
+        return await self.cache.fetch(  # type: ignore[no-any-return]
+            (self.bot_key, "get_file", file_id), lambda: self.bot.get_file(file_id), self.file_ttl
+        )
+
+    def invalidate_chat(self, chat_id: int | str) -> None:
+        self.cache.invalidate((self.bot_key, "get_chat", chat_id))
+
+    def invalidate_chat_member(self, chat_id: int | str, user_id: int) -> None:
+        self.cache.invalidate(
+            (self.bot_key, "get_chat_member", chat_id, user_id),
+            (self.bot_key, "get_chat_administrators", chat_id),
+        )
+
+    async def invalidate_from_update(self, update: object, _: ContextTypes.DEFAULT_TYPE) -> None:
+        """Drop entries made stale by the update
+
+        Registered as handler on every app, see Application.initialize().
+        """
+        if not isinstance(update, Update):
+            return
+
+        for member_update in (update.chat_member, update.my_chat_member):
+            if member_update:
+                self.invalidate_chat_member(member_update.chat.id, member_update.new_chat_member.user.id)
+
+        if message := update.effective_message:
+            chat_id = message.chat_id
+            for user in message.new_chat_members or ():
+                self.invalidate_chat_member(chat_id, user.id)
+            if message.left_chat_member:
+                self.invalidate_chat_member(chat_id, message.left_chat_member.id)
+            if (
+                message.new_chat_title
+                or message.new_chat_photo
+                or message.delete_chat_photo
+                or message.pinned_message
+                or message.migrate_to_chat_id
+            ):
+                self.invalidate_chat(chat_id)
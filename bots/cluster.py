@@ -0,0 +1,513 @@
+import asyncio
+import hashlib
+import importlib
+import os
+import socket
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, AsyncIterator, Awaitable, Callable, Iterable, TypedDict, TypeVar
+
+import aiohttp
+
+from bots.config import ClusterConfig, config
+from bots.utils import json, merge_async_iterators
+
+if TYPE_CHECKING:
+    from bots.applications import Application
+    from bots.applications.manager import AppManager, AppOperation, AppOperationResult
+
+logger = getLogger("cluster")
+
+T = TypeVar("T")
+
+# Set on requests between nodes, the receiving node only acts on its own apps
+FORWARDED_HEADER = "X-Bot-Manager-Node"
+
+
+class NodeInfo(TypedDict):
+    id: str
+    url: str
+    started: float
+    expires: float
+
+
+class Lease(TypedDict):
+    app_id: str
+    node_id: str
+    acquired: float
+    expires: float
+
+
+class LeaseStore:
+    """Shared state of the cluster: the live nodes and which node owns which app
+
+    Implementations must make acquire() atomic across all nodes. Leases and
+    node registrations expire after their ttl unless renewed.
+    """
+
+    async def open(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    async def heartbeat(self, node: NodeInfo) -> None:
+        """Register or renew a node"""
+        raise NotImplementedError
+
+    async def leave(self, node_id: str) -> None:
+        """Remove a node and release all its leases"""
+        raise NotImplementedError
+
+    async def nodes(self) -> list[NodeInfo]:
+        """All nodes that are alive"""
+        raise NotImplementedError
+
+    async def acquire(self, app_ids: Iterable[str], node_id: str, ttl: float) -> set[str]:
+        """Acquire or renew the leases of the apps, returns the apps the node owns afterwards
+
+        A lease can only be acquired if it's free, expired or already owned
+        by the node.
+        """
+        raise NotImplementedError
+
+    async def release(self, app_ids: Iterable[str], node_id: str) -> None:
+        raise NotImplementedError
+
+    async def leases(self) -> dict[str, Lease]:
+        """All not expired leases by app id"""
+        raise NotImplementedError
+
+
+class SQLiteLeaseStore(LeaseStore):
+    """Lease store in a SQLite database, for nodes on the same host or a shared file system
+
+    SQLite's file locking makes acquire() atomic across processes. All
+    database access happens on a dedicated thread.
+    """
+
+    def __init__(self, path: Path | str = "cluster.sqlite3") -> None:
+        self.path = Path(path)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="lease-store")
+        self._connection: sqlite3.Connection | None = None
+
+    async def _run(self, func: Callable[..., T], *args: Any) -> T:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _connect(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Autocommit mode, transactions are started explicitly
+        self._connection = connection = sqlite3.connect(
+            self.path, timeout=10, isolation_level=None, check_same_thread=False
+        )
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS nodes (id TEXT PRIMARY KEY, url TEXT NOT NULL, started REAL, expires REAL)"
+        )
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS leases ("
+            " app_id TEXT PRIMARY KEY,"
+            " node_id TEXT NOT NULL,"
+            " acquired REAL NOT NULL,"
+            " expires REAL NOT NULL"
+            ")"
+        )
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if not self._connection:
+            raise RuntimeError("Lease store is not open")
+        return self._connection
+
+    async def open(self) -> None:
+        if not self._connection:
+            await self._run(self._connect)
+
+    async def close(self) -> None:
+        if self._connection:
+            await self._run(self._connection.close)
+            self._connection = None
+        self._executor.shutdown(wait=True)
+
+    def _heartbeat(self, node: NodeInfo) -> None:
+        self.connection.execute(
+            "INSERT OR REPLACE INTO nodes (id, url, started, expires) VALUES (:id, :url, :started, :expires)", node
+        )
+
+    async def heartbeat(self, node: NodeInfo) -> None:
+        await self._run(self._heartbeat, node)
+
+    def _leave(self, node_id: str) -> None:
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.connection.execute("DELETE FROM leases WHERE node_id = ?", (node_id,))
+            self.connection.execute("DELETE FROM nodes WHERE id = ?", (node_id,))
+
+    async def leave(self, node_id: str) -> None:
+        await self._run(self._leave, node_id)
+
+    def _nodes(self) -> list[NodeInfo]:
+        rows = self.connection.execute(
+            "SELECT id, url, started, expires FROM nodes WHERE expires > ? ORDER BY id", (time.time(),)
+        )
+        return [NodeInfo(id=id, url=url, started=started, expires=expires) for id, url, started, expires in rows]
+
+    async def nodes(self) -> list[NodeInfo]:
+        return await self._run(self._nodes)
+
+    def _acquire(self, app_ids: list[str], node_id: str, ttl: float) -> set[str]:
+        now = time.time()
+        with self.connection:
+            # Takes the write lock right away, so no other node can acquire in between
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.connection.executemany(
+                "INSERT INTO leases (app_id, node_id, acquired, expires) VALUES (?, ?, ?, ?) ON CONFLICT (app_id) DO"
+                " UPDATE SET  acquired = CASE WHEN leases.node_id = excluded.node_id THEN leases.acquired ELSE"
+                " excluded.acquired END,  node_id = excluded.node_id,  expires = excluded.expires WHERE leases.node_id"
+                " = excluded.node_id OR leases.expires <= ?",
+                [(app_id, node_id, now, now + ttl, now) for app_id in app_ids],
+            )
+            rows = self.connection.execute("SELECT app_id FROM leases WHERE node_id = ?", (node_id,))
+            return {app_id for app_id, in rows} & set(app_ids)
+
+    async def acquire(self, app_ids: Iterable[str], node_id: str, ttl: float) -> set[str]:
+        return await self._run(self._acquire, list(app_ids), node_id, ttl)
+
+    def _release(self, app_ids: list[str], node_id: str) -> None:
+        self.connection.executemany(
+            "DELETE FROM leases WHERE app_id = ? AND node_id = ?", [(app_id, node_id) for app_id in app_ids]
+        )
+
+    async def release(self, app_ids: Iterable[str], node_id: str) -> None:
+        await self._run(self._release, list(app_ids), node_id)
+
+    def _leases(self) -> dict[str, Lease]:
+        rows = self.connection.execute(
+            "SELECT app_id, node_id, acquired, expires FROM leases WHERE expires > ?", (time.time(),)
+        )
+        return {
+            app_id: Lease(app_id=app_id, node_id=node_id, acquired=acquired, expires=expires)
+            for app_id, node_id, acquired, expires in rows
+        }
+
+    async def leases(self) -> dict[str, Lease]:
+        return await self._run(self._leases)
+
+
+def owner(app_id: str, node_ids: Iterable[str]) -> str | None:
+    """The node that should own the app (rendezvous hashing)
+
+    Every node computes the same owner from the same set of nodes. When a
+    node joins or leaves, only the apps it wins or loses change owner.
+    """
+
+    def score(node_id: str) -> bytes:
+        return hashlib.blake2b(f"{node_id}/{app_id}".encode(), digest_size=8).digest()
+
+    node_ids = list(node_ids)
+    return max(node_ids, key=score) if node_ids else None
+
+
+class ClusterStatus(TypedDict):
+    node: str
+    nodes: list[NodeInfo]
+    leases: dict[str, Lease]
+
+
+class ClusterNode:
+    """This manager as a node of a cluster of managers sharing one config
+
+    Every heartbeat_interval seconds the node renews its registration in the
+    lease store and decides which apps it should own (see owner()):
+        - apps it should own are acquired and started, as soon as their
+          lease is free (or expired after their node died)
+        - apps another live node should own (e.g. a node joined) are shut
+          down and their lease released, so the other node can take over
+        - apps whose lease it lost are shut down immediately
+
+    The registration and the leases of the owned apps are renewed by their
+    own loop (see renew()), so slow takeovers and handovers can't delay them
+    until the leases expire. Taking over or shutting down apps is bounded by
+    operation_timeout, well under lease_ttl.
+
+    Operations on apps owned by other nodes are forwarded to them via their
+    REST API, see run_operation().
+    """
+
+    def __init__(
+        self,
+        manager: "AppManager",
+        store: LeaseStore,
+        node_id: str,
+        url: str,
+        lease_ttl: float = 15,
+        heartbeat_interval: float = 5,
+    ) -> None:
+        self.manager = manager
+        self.store = store
+        self.id = node_id
+        self.url = url.rstrip("/")
+        self.lease_ttl = lease_ttl
+        self.heartbeat_interval = heartbeat_interval
+
+        self.started = time.time()
+        self.owned: set[str] = set()
+        # Held while rebalancing the apps, see tick()
+        self._lock = asyncio.Lock()
+        # Held while changing leases, only for the short lease store calls
+        self._lease_lock = asyncio.Lock()
+        self._tasks: list[asyncio.Task[None]] = []
+        self._session: aiohttp.ClientSession | None = None
+
+    @classmethod
+    def from_config(cls, manager: "AppManager", cluster: ClusterConfig) -> "ClusterNode":
+        module_path, _, name = cluster.lease_store.partition(":")
+        store_class: type[LeaseStore] = getattr(importlib.import_module(module_path), name)
+        host = socket.gethostname()
+        return cls(
+            manager,
+            store_class(**cluster.lease_store_args),
+            node_id=os.environ.get("BOT_MANAGER_NODE_ID") or cluster.node_id or f"{host}:{config.port}",
+            url=os.environ.get("BOT_MANAGER_NODE_URL") or cluster.url or f"http://{host}:{config.port}",
+            lease_ttl=cluster.lease_ttl,
+            heartbeat_interval=cluster.heartbeat_interval,
+        )
+
+    @property
+    def operation_timeout(self) -> float:
+        """Seconds taking over or shutting down apps may take"""
+        return min(config.app_operation_timeout, self.lease_ttl / 2)
+
+    # =========
+    # LIFECYCLE
+    # =========
+
+    async def start(self) -> None:
+        await self.store.open()
+        self._session = aiohttp.ClientSession(headers={FORWARDED_HEADER: self.id})
+        await self.tick()
+        self._tasks = [
+            asyncio.create_task(self._loop(self.renew, "Renewing the leases")),
+            asyncio.create_task(self._loop(self.tick, "Heartbeat")),
+        ]
+        logger.info(f"Node {self.id} joined the cluster")
+
+    async def stop(self) -> None:
+        """Shut down all apps of the node and hand them over to the other nodes"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        async with self._lock:
+            await self._shutdown(self.owned | self.manager.app_ids)
+            await self.manager.storage.flush()
+            await self.store.leave(self.id)
+            self.owned.clear()
+        await self.store.close()
+        if self._session:
+            await self._session.close()
+        logger.info(f"Node {self.id} left the cluster")
+
+    async def _loop(self, step: Callable[[], Awaitable[Any]], name: str) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await step()
+            except Exception:
+                logger.exception(f"Node {self.id}: {name} failed")
+
+    @property
+    def info(self) -> NodeInfo:
+        return NodeInfo(id=self.id, url=self.url, started=self.started, expires=time.time() + self.lease_ttl)
+
+    async def renew(self) -> None:
+        """Renew the registration and the leases of the owned apps"""
+        async with self._lease_lock:
+            await self.store.heartbeat(self.info)
+            if not self.owned:
+                return
+            held = await self.store.acquire(self.owned, self.id, self.lease_ttl)
+        # Shut down by the next tick()
+        if lost := self.owned - held:
+            logger.warning(f"Node {self.id}: Could not renew the leases of {', '.join(sorted(lost))}")
+
+    async def tick(self) -> None:
+        """Renew the registration and leases, hand over and take over apps"""
+        async with self._lock:
+            async with self._lease_lock:
+                await self.store.heartbeat(self.info)
+            node_ids = [node["id"] for node in await self.store.nodes()]
+            configured = [app.id for app in config.app_configs]
+            wanted = [app_id for app_id in configured if owner(app_id, node_ids) == self.id]
+
+            # Hand over first, so the new owners can acquire the leases on their next heartbeat
+            if handover := (self.owned | self.manager.app_ids) - set(wanted):
+                logger.info(f"Node {self.id}: Handing over {', '.join(sorted(handover))}")
+                # The leases are still renewed while the apps shut down
+                await self._shutdown(handover)
+                # The new owner reads the app's storage right away
+                await self.manager.storage.flush()
+                async with self._lease_lock:
+                    await self.store.release(handover, self.id)
+                    self.owned -= handover
+
+            async with self._lease_lock:
+                held = await self.store.acquire(wanted, self.id, self.lease_ttl)
+                lost = (self.owned - held) & self.manager.app_ids
+                acquired = held - self.owned
+                # Renewed from now on, even while the apps are taken over
+                self.owned = held
+            if lost:
+                # Another node took over (e.g. we couldn't renew in time), never run a bot twice
+                logger.warning(f"Node {self.id}: Lost the leases of {', '.join(sorted(lost))}")
+                await self._shutdown(lost)
+
+            if acquired:
+                logger.info(f"Node {self.id}: Taking over {', '.join(sorted(acquired))}")
+                results = await asyncio.gather(*[self._take_over(app_id) for app_id in sorted(acquired)])
+                # Released to be retried on the next heartbeat
+                if failed := {app_id for app_id, success in zip(sorted(acquired), results) if not success}:
+                    async with self._lease_lock:
+                        await self.store.release(failed, self.id)
+                        self.owned -= failed
+
+    async def _shutdown(self, app_ids: set[str]) -> None:
+        # Apps are destroyed even if they are cancelled after the timeout
+        if loaded := [app_id for app_id in app_ids if app_id in self.manager.app_ids]:
+            await self.manager.destroy_apps(loaded, self.operation_timeout)
+
+    async def _take_over(self, app_id: str) -> bool:
+        # The previous owner may have written to the shared storage in the meantime
+        self.manager.storage.forget(app_id)
+        try:
+            await asyncio.wait_for(self._start(app_id), self.operation_timeout)
+        except Exception:
+            logger.exception(f"Node {self.id}: Taking over {app_id} failed")
+            if app_id in self.manager.apps:
+                await self.manager.destroy_apps([app_id], self.operation_timeout)
+            return False
+        return True
+
+    async def _start(self, app_id: str) -> None:
+        app = await self.manager.initialize_app(await self.manager.load_app(app_id))
+        if app.auto_start:
+            await self.manager.start_app(app)
+
+    async def status(self) -> ClusterStatus:
+        return ClusterStatus(node=self.id, nodes=await self.store.nodes(), leases=await self.store.leases())
+
+    # ==========
+    # OPERATIONS
+    # ==========
+
+    async def run_operation(
+        self,
+        operation: "AppOperation",
+        app_ids: Iterable[str] = (),
+        timeout: float | None = None,
+        forwarded: bool = False,
+        local_lock: asyncio.Lock | None = None,
+    ) -> AsyncIterator[tuple["AppOperationResult", "Application | None"]]:
+        """Like AppManager.run_operation() but for the apps of all nodes
+
+        Apps of other nodes are forwarded to their owner, without app_ids the
+        operation is forwarded to all nodes. Results of other nodes come
+        without app. Forwarded operations only act on local apps.
+
+        local_lock is held while the local apps are processed, not while
+        waiting for other nodes (which may wait for our lock themselves).
+        """
+        app_ids = list(app_ids)
+        nodes = {node["id"]: node for node in await self.store.nodes()}
+        streams: list[AsyncIterator[tuple["AppOperationResult", "Application | None"]]] = []
+        errors: list["AppOperationResult"] = []
+
+        if app_ids:
+            local = [app_id for app_id in app_ids if app_id in self.manager.app_ids]
+            remote: dict[str, list[str]] = {}
+            leases = await self.store.leases()
+            for app_id in app_ids:
+                if app_id in local:
+                    continue
+                lease = leases.get(app_id)
+                if not forwarded and lease and lease["node_id"] != self.id and lease["node_id"] in nodes:
+                    remote.setdefault(lease["node_id"], []).append(app_id)
+                else:
+                    errors.append(self._result(app_id, operation, "error", f"App {app_id} runs on no node"))
+        else:
+            local = list(self.manager.app_ids)
+            remote = {} if forwarded else {node_id: [] for node_id in nodes if node_id != self.id}
+            if operation == "reload":
+                # Added apps are taken over by their owner on its next heartbeat
+                config.reload_config()
+
+        if local:
+            streams.append(self._locked(self.manager.run_operation(operation, local, timeout), local_lock))
+        for node_id, node_app_ids in remote.items():
+            streams.append(self._forward(nodes[node_id], operation, node_app_ids, timeout))
+
+        for error in errors:
+            yield error, None
+        async for item in merge_async_iterators(*streams):
+            yield item
+
+    @staticmethod
+    async def _locked(stream: AsyncIterator[T], lock: asyncio.Lock | None) -> AsyncIterator[T]:
+        if lock is None:
+            async for item in stream:
+                yield item
+            return
+        async with lock:
+            async for item in stream:
+                yield item
+
+    @staticmethod
+    def _result(app_id: str, operation: "AppOperation", status: Any, message: str) -> "AppOperationResult":
+        return {"app_id": app_id, "operation": operation, "status": status, "message": message, "duration": 0}
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if not self._session:
+            raise RuntimeError("Cluster node is not started")
+        return self._session
+
+    async def _forward(
+        self, node: NodeInfo, operation: "AppOperation", app_ids: list[str], timeout: float | None
+    ) -> AsyncIterator[tuple["AppOperationResult", "Application | None"]]:
+        app_timeout = config.app_operation_timeout if timeout is None else timeout
+        try:
+            async with self.session.post(
+                f"{node['url']}/api/apps/{operation}",
+                data=json.dumpb({"app_ids": app_ids, "timeout": timeout}),
+                headers={"Content-Type": "application/json"},
+                timeout=aiohttp.ClientTimeout(connect=10, sock_read=app_timeout + 10),
+            ) as response:
+                response.raise_for_status()
+                # One JSON line per app
+                async for line in response.content:
+                    if line.strip():
+                        yield json.loads(line), None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            logger.error(f"Node {self.id}: Forwarding {operation} to {node['id']} failed: {error!r}")
+            for app_id in app_ids or [node["id"]]:
+                yield self._result(app_id, operation, "error", f"Node {node['id']} failed: {error!r}"), None
+
+    async def remote_apps_info(self) -> list[Any]:
+        """Info of the apps of all other nodes, see GET /api/apps"""
+        nodes = [node for node in await self.store.nodes() if node["id"] != self.id]
+
+        async def fetch(node: NodeInfo) -> list[Any]:
+            try:
+                async with self.session.get(
+                    f"{node['url']}/api/apps", timeout=aiohttp.ClientTimeout(total=10)
+                ) as response:
+                    response.raise_for_status()
+                    return json.loads(await response.read())  # type: ignore[no-any-return]
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                logger.warning(f"Node {self.id}: Getting the apps of {node['id']} failed: {error!r}")
+                return []
+
+        return [info for infos in await asyncio.gather(*map(fetch, nodes)) for info in infos]
@@ -1,20 +1,79 @@
 import logging
 from pathlib import Path
-from typing import Any
+from typing import Any, Literal
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, FieldValidationInfo, field_validator
+
+from bots.utils.misc import LazyObject
 
 CONFIG_FILE = Path("config.json")
 
 
+class PollingConfig(BaseModel):
+    timeout: int = 10
+    poll_interval: float = 0.0
+    bootstrap_retries: int = -1
+    drop_pending_updates: bool | None = None
+    # None: derived from the handlers registered by the app
+    allowed_updates: list[str] | None = None
+
+
+class UpdateQueueConfig(BaseModel):
+    # Max. number of updates waiting to be processed, None for no limit
+    max_size: int | None = Field(default=None, ge=1)
+    # When full, "wait" stops fetching new updates, "drop" drops them
+    overflow: Literal["wait", "drop"] = "wait"
+    # Process commands and callback queries before other updates
+    prioritise: bool = True
+    # Share of max_size only usable by prioritised updates
+    priority_reserve: float = 0.1
+    # Drop updates older than this many seconds
+    max_age: float | None = None
+    # Answer messages and callback queries dropped because of max_age
+    max_age_reply: str | None = None
+
+
 class ApplicationConfig(BaseModel):
     id: str
     module: str
     telegram_token: str
     auto_start: bool = False
+    persistence: bool = False
+    # Number of updates (of different chats) processed at the same time
+    concurrent_updates: int = 1
+    polling: PollingConfig = PollingConfig()
+    update_queue: UpdateQueueConfig = UpdateQueueConfig()
+    # Share of updates traced, None for the global trace_sample_rate
+    trace_sample_rate: float | None = None
+    # Seconds without updates until the app is hibernated, None for the global
+    # hibernate_after, 0 to never hibernate it
+    hibernate_after: float | None = None
     arguments: dict[str, Any] = {}
 
 
+class ClusterConfig(BaseModel):
+    # Share the apps of the config between all managers with the same lease store
+    enabled: bool = False
+    # "module:Class" of the LeaseStore and its arguments
+    lease_store: str = "bots.cluster:SQLiteLeaseStore"
+    lease_store_args: dict[str, Any] = {"path": "cluster.sqlite3"}
+    # Seconds until the apps of a node that stopped sending heartbeats are taken over
+    lease_ttl: float = 15
+    heartbeat_interval: float = 5
+    # Defaults to "<hostname>:<port>" / "http://<hostname>:<port>", overridden by
+    # the BOT_MANAGER_NODE_ID and BOT_MANAGER_NODE_URL environment variables
+    node_id: str | None = None
+    url: str | None = None
+
+    @field_validator("heartbeat_interval")
+    @classmethod
+    def check_heartbeat_interval(cls, value: float, info: FieldValidationInfo) -> float:
+        # A few heartbeats may fail in a row without losing the leases
+        if "lease_ttl" in info.data and value > info.data["lease_ttl"] / 3:
+            raise ValueError("heartbeat_interval must be at most a third of lease_ttl")
+        return value
+
+
 class Config(BaseModel):
     app_configs: list[ApplicationConfig]
 
@@ -24,6 +83,62 @@ class Config(BaseModel):
     local_log_level: str = "INFO"
     web_log_level: str = "INFO"
 
+    # Logs are written as JSON lines to one file per app, rotated by size and age
+    log_dir: Path = Path("logs")
+    log_file_max_bytes: int = 10 * 1024 * 1024
+    log_file_interval: float = 86400
+    log_file_backups: int = 14
+    # Searchable archive of all logs in log_dir/archive, oldest segments are deleted beyond the max size
+    log_archive_segment_size: int = 64 * 1024 * 1024
+    log_archive_max_size: int = 1024 * 1024 * 1024
+    log_search_chunk_size: int = 50
+
+    # Share of updates traced, traces are written to log_dir/traces/traces.jsonl in OTLP JSON
+    trace_sample_rate: float = 0.01
+    # Number of recent traces per app kept for the dashboard
+    trace_history: int = 200
+
+    socket_serializer: Literal["default", "msgpack"] = "default"
+    socket_compression: bool = True
+    socket_compression_threshold: int = 1024
+    socket_log_batch_size: int = 100
+    # Min. seconds between live status updates of the apps sent to the dashboard
+    status_interval: float = 1.0
+
+    storage_file: Path = Path("storage.sqlite3")
+    storage_flush_interval: float = 1.0
+    storage_batch_size: int = 500
+    storage_cache_size: int = 10_000
+    storage_compaction_interval: float = 3600
+
+    # Number of finished, cancelled or failed broadcasts kept for the dashboard
+    broadcast_history: int = 100
+
+    api_cache_size: int = 10_000
+    api_cache_ttl: float = 300
+
+    # Downloaded media shared by all apps, least recently used files are deleted beyond the max size
+    media_cache_dir: Path = Path("media")
+    media_cache_max_size: int = 1024 * 1024 * 1024
+
+    # Seconds a single app may take to start, pause or reload in bulk operations
+    app_operation_timeout: float = 60
+
+    # Seconds all apps together / a single app may take to shut down before being cancelled
+    shutdown_timeout: float = 30
+    app_shutdown_timeout: float = 15
+    # Seconds a pausing app waits for already received updates to be processed
+    drain_timeout: float = 5
+
+    # Seconds without updates until a running app is shut down until its next update,
+    # None to never hibernate apps (apps can override it)
+    hibernate_after: float | None = None
+    hibernation_check_interval: float = 30
+    # Long polling timeout of the requests checking hibernated apps for updates
+    hibernation_poll_timeout: int = 50
+
+    cluster: ClusterConfig = ClusterConfig()
+
     uvicorn_args: dict[str, Any] = {}
 
     def _log_level_int(self, level: str) -> int:
@@ -55,16 +170,21 @@ class Config(BaseModel):
         return False
 
     def reload_app_config(self, app_id: str) -> ApplicationConfig:
-        new_app_config = Config.model_validate_json(CONFIG_FILE.read_text()).app_config(app_id)
+        new_app_config = load_config().app_config(app_id)
         if not new_app_config:
             raise ValueError(f"No app config with the ID {app_id} found")
         config.set_app_config(new_app_config)
         return new_app_config
 
     def reload_config(self) -> None:
-        new_config = Config.model_validate_json(CONFIG_FILE.read_text())
+        new_config = load_config()
         for field, value in new_config:
             setattr(self, field, value)
 
 
-config = Config.parse_file(CONFIG_FILE)
+def load_config() -> Config:
+    return Config.model_validate_json(CONFIG_FILE.read_text())
+
+
+# Loaded on first use, so importing bots doesn't require a config file
+config: Config = LazyObject(load_config)  # type: ignore[assignment]
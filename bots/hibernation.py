@@ -0,0 +1,279 @@
+import asyncio
+import time
+from logging import getLogger
+from typing import TYPE_CHECKING, Any, TypedDict
+
+import aiohttp
+
+from bots.config import config
+
+if TYPE_CHECKING:
+    from bots.applications._base import Application
+    from bots.applications.manager import AppManager
+
+logger = getLogger("hibernation")
+
+BOT_API_URL = "https://api.telegram.org/bot{token}/{method}"
+
+
+class BotApiError(Exception):
+    def __init__(self, message: str, retry_after: float | None = None) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class HibernationStats(TypedDict):
+    hibernated: int
+    hibernations: int
+    wakeups: int
+    wake_failures: int
+    # Seconds from the update arriving to the app running again
+    wake_latency_avg: float
+    wake_latency_max: float
+    wake_latency_last: float | None
+
+
+class HibernatedApp:
+    """What is left of a hibernated app, enough to notice its next update"""
+
+    __slots__ = ("id", "telegram_token", "offset", "allowed_updates", "bot", "type", "since", "task", "wake_failures")
+
+    def __init__(
+        self,
+        id: str,
+        telegram_token: str,
+        offset: int | None,
+        allowed_updates: list[str],
+        bot: dict[str, Any],
+        type: str,
+    ) -> None:
+        self.id = id
+        self.telegram_token = telegram_token
+        # First update id not processed by the app yet
+        self.offset = offset
+        self.allowed_updates = allowed_updates
+        # For the dashboard, see bots.api.app_info()
+        self.bot = bot
+        self.type = type
+        self.since = time.time()
+        self.task: asyncio.Task[None] | None = None
+        # Failed wake ups in a row
+        self.wake_failures = 0
+
+
+class Hibernator:
+    """Shut down idle apps and bring them back on their next update
+
+    A running app without updates for hibernate_after seconds (per app or
+    global, see the config) is destroyed like any other app, so its
+    on_shutdown() and the storage persist its state. Only a HibernatedApp
+    stub stays in memory.
+
+    All hibernated apps share one HTTP session that long polls getUpdates
+    for each of them. The offset confirms the updates the app has already
+    processed but never the new ones, so the update waking the app up is
+    still pending and received by the app itself once it's started again.
+
+    Apps with scheduled jobs, running broadcasts or updates in progress are
+    never hibernated.
+    """
+
+    # Weight of the latest wake up latency in the moving average
+    latency_smoothing = 0.1
+
+    def __init__(self, manager: "AppManager") -> None:
+        self.manager = manager
+        self.apps: dict[str, HibernatedApp] = {}
+        self._waking: dict[str, asyncio.Task["Application"]] = {}
+        self._task: asyncio.Task[None] | None = None
+        self._session: aiohttp.ClientSession | None = None
+
+        self.hibernations = 0
+        self.wakeups = 0
+        self.wake_failures = 0
+        self.wake_latency_avg = 0.0
+        self.wake_latency_max = 0.0
+        self.wake_latency_last: float | None = None
+        # App id -> seconds its last wake up took
+        self.wake_latencies: dict[str, float] = {}
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._check_loop())
+
+    async def stop(self) -> None:
+        """Stop hibernating apps and forget the hibernated ones"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        for app_id in list(self.apps):
+            await self.forget(app_id)
+        if self._session:
+            await self._session.close()
+            self._session = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if not self._session:
+            # Each hibernated app keeps a long poll open, so no connection limit
+            self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0))
+        return self._session
+
+    # ===========
+    # HIBERNATING
+    # ===========
+
+    @staticmethod
+    def hibernate_after(app: "Application") -> float | None:
+        """Seconds without updates until the app is hibernated, None for never"""
+        seconds = config.hibernate_after if app.config.hibernate_after is None else app.config.hibernate_after
+        return seconds or None
+
+    def idle(self, app: "Application", now: float) -> bool:
+        if not app.running or (seconds := self.hibernate_after(app)) is None:
+            return False
+        if app.job_scheduler.jobs:
+            return False
+        if any(job.app is app and job.status == "running" for job in self.manager.broadcasts.values()):
+            return False
+        processor = app.update_processor
+        if processor.queued or processor.running:
+            return False
+        last_active = max(processor.last_update_time or 0, app.started_at or 0)
+        return now - last_active >= seconds
+
+    async def _check_loop(self) -> None:
+        while True:
+            await asyncio.sleep(config.hibernation_check_interval)
+            now = time.time()
+            for app in [app for app in self.manager.apps.values() if self.idle(app, now)]:
+                try:
+                    await self.hibernate(app)
+                except Exception:
+                    logger.exception(f"{app.id}: Hibernating failed")
+
+    async def hibernate(self, app: "Application") -> HibernatedApp:
+        """Destroy the app and wait for its next update"""
+        bot = await app.get_bot()
+        await self.manager.destroy_app(app.id)
+        # Updates fetched before the shutdown were processed while the app drained them
+        last_update_id = app.update_processor.last_update_id
+
+        stub = HibernatedApp(
+            app.id,
+            app.config.telegram_token,
+            None if last_update_id is None else last_update_id + 1,
+            app.allowed_updates(),
+            bot.to_dict() | {"link": bot.link},
+            app.__class__.__name__,
+        )
+
+        self.apps[stub.id] = stub
+        stub.task = asyncio.create_task(self._watch(stub))
+        self.hibernations += 1
+        self.manager.status.notify()
+        logger.info(f"{stub.id}: Hibernated")
+        return stub
+
+    async def forget(self, app_id: str) -> None:
+        """Stop waiting for updates of a hibernated app without waking it up"""
+        if (stub := self.apps.pop(app_id, None)) and stub.task:
+            stub.task.cancel()
+            await asyncio.gather(stub.task, return_exceptions=True)
+
+    # =======
+    # WAKE UP
+    # =======
+
+    async def _get_updates(self, stub: HibernatedApp, timeout: int) -> list[Any]:
+        data: dict[str, Any] = {"timeout": timeout, "limit": 1, "allowed_updates": stub.allowed_updates}
+        if stub.offset is not None:
+            data["offset"] = stub.offset
+        async with self.session.post(
+            BOT_API_URL.format(token=stub.telegram_token, method="getUpdates"),
+            json=data,
+            timeout=aiohttp.ClientTimeout(total=timeout + 10),
+        ) as response:
+            result = await response.json()
+        if not result.get("ok"):
+            raise BotApiError(
+                result.get("description", "Unknown error"), result.get("parameters", {}).get("retry_after")
+            )
+        return result["result"]  # type: ignore[no-any-return]
+
+    async def _watch(self, stub: HibernatedApp, delay: float = 0) -> None:
+        await asyncio.sleep(delay)
+        backoff = 1.0
+        while True:
+            try:
+                updates = await self._get_updates(stub, config.hibernation_poll_timeout)
+            except (aiohttp.ClientError, asyncio.TimeoutError, BotApiError) as error:
+                logger.warning(f"{stub.id}: Checking for updates failed: {error}")
+                await asyncio.sleep(getattr(error, "retry_after", None) or backoff)
+                backoff = min(backoff * 2, 60)
+                continue
+
+            if updates:
+                try:
+                    await self.wake(stub.id, detected=time.monotonic())
+                except Exception:
+                    pass  # Logged by _wake()
+                return
+            backoff = 1.0
+
+    async def wake(self, app_id: str, start: bool = True, detected: float | None = None) -> "Application":
+        """Load, initialise and (if start) start a hibernated app again
+
+        Concurrent calls wait for the same wake up. detected is the
+        time.monotonic() the app's update arrived, for the latency metrics.
+        If it fails the app stays hibernated and its next update retries the
+        wake up after an increasing delay.
+        """
+        if app_id not in self._waking:
+            if not (stub := self.apps.pop(app_id, None)):
+                raise KeyError(f"App {app_id} is not hibernated")
+            if stub.task and stub.task is not asyncio.current_task():
+                stub.task.cancel()
+            task = asyncio.create_task(self._wake(stub, start, time.monotonic() if detected is None else detected))
+            self._waking[app_id] = task
+            task.add_done_callback(lambda _: self._waking.pop(app_id, None))
+        return await asyncio.shield(self._waking[app_id])
+
+    async def _wake(self, stub: HibernatedApp, start: bool, detected: float) -> "Application":
+        app_id = stub.id
+        try:
+            app = await self.manager.initialize_app(await self.manager.load_app(app_id))
+            if start:
+                # The update that woke the app up is still pending
+                app.config.polling = app.config.polling.model_copy(update={"drop_pending_updates": False})
+                await self.manager.start_app(app)
+        except Exception:
+            self.wake_failures += 1
+            logger.exception(f"{app_id}: Waking up failed")
+            if app_id in self.manager.apps:
+                await self.manager.destroy_app(app_id)
+            if app_id not in self.manager.apps:
+                # Keep it hibernated and try again with the next update check
+                stub.wake_failures += 1
+                self.apps[app_id] = stub
+                stub.task = asyncio.create_task(self._watch(stub, delay=min(2**stub.wake_failures, 300)))
+                self.manager.status.notify()
+            raise
+
+        latency = time.monotonic() - detected
+        self.wakeups += 1
+        self.wake_latency_avg += (latency - self.wake_latency_avg) * self.latency_smoothing
+        self.wake_latency_max = max(self.wake_latency_max, latency)
+        self.wake_latency_last = self.wake_latencies[app_id] = latency
+        logger.info(f"{app_id}: Woke up in {latency:.3f}s")
+        return app
+
+    def get_stats(self) -> HibernationStats:
+        return HibernationStats(
+            hibernated=len(self.apps),
+            hibernations=self.hibernations,
+            wakeups=self.wakeups,
+            wake_failures=self.wake_failures,
+            wake_latency_avg=self.wake_latency_avg,
+            wake_latency_max=self.wake_latency_max,
+            wake_latency_last=self.wake_latency_last,
+        )
@@ -1,12 +1,24 @@
+import asyncio
 import functools
+import gzip
 import logging
+import os
+import re
+import shutil
 import time
 from asyncio import Queue
-from typing import Any, Callable, TypedDict
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import QueueHandler, QueueListener
+from pathlib import Path
+from queue import SimpleQueue
+from typing import IO, Any, Callable, TypedDict
 
 from bots.config import config
+from bots.utils import json
 from bots.utils.misc import get_arg_value
 
+LOG_FORMAT = "%(asctime)s [%(levelname)s] %(name)s: %(message)s"
+
 
 class LogEntry(TypedDict):
     text: str
@@ -17,12 +29,22 @@ class LogEntry(TypedDict):
 runtime_logs: list[LogEntry] = []
 
 logger = logging.getLogger("bot_manager")
-logger.setLevel(config.local_log_level)
+
+
+# Names of the loggers of apps, their logs are written to their own file
+app_loggers: set[str] = set()
 
 
 class EndpointFilter(logging.Filter):
+    excluded = ("/list", "/log")
+
     def filter(self, record: logging.LogRecord) -> bool:
-        return record.getMessage().find("/list") == -1 and record.getMessage().find("/log") == -1
+        # uvicorn's access logs have the path as third argument, no need to format the message
+        if isinstance(record.args, tuple) and len(record.args) >= 3:
+            text = str(record.args[2])
+        else:
+            text = record.getMessage()
+        return not any(endpoint in text for endpoint in self.excluded)
 
 
 # Filter out /endpoint
@@ -33,23 +55,239 @@ class SocketLogHandler(logging.Handler):
     def __init__(self, level: int = logging.NOTSET) -> None:
         super().__init__(level)
 
+        # Lowest level any client is subscribed to, None to not queue anything
+        self.min_level: int | None = None
         self.queue = Queue[dict[str, Any]]()
+        try:
+            self.loop: asyncio.AbstractEventLoop | None = asyncio.get_running_loop()
+        except RuntimeError:
+            self.loop = None
 
     def emit(self, record: logging.LogRecord) -> None:
+        if self.min_level is None or record.levelno < self.min_level:
+            return
         status = (
             "error"
             if record.levelno >= logging.ERROR
             else ("warning" if record.levelno >= logging.WARNING else "success")
         )
-        self.queue.put_nowait(
-            {
-                "status": status,
-                "message": self.format(record),
-                "data": {
-                    "timestamp": int(record.created),
-                },
-            }
+        item = {
+            "status": status,
+            "message": self.format(record),
+            "data": {
+                "timestamp": int(record.created),
+                "level": record.levelno,
+            },
+        }
+        # Emitted on the log listener thread, the queue belongs to the event loop
+        if self.loop and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, item)
+        else:
+            self.queue.put_nowait(item)
+
+
+def log_stream(record: logging.LogRecord) -> str:
+    """The app id the record belongs to, "manager" for all other records
+
+    Records of child loggers ("<app id>.<name>") belong to the app as well.
+    App ids can contain dots, so the longest matching app id wins.
+    """
+    name = record.name
+    while name not in app_loggers:
+        if "." not in name:
+            return "manager"
+        name = name.rsplit(".", 1)[0]
+    return name
+
+
+def serialise_record(record: logging.LogRecord, stream: str) -> bytes:
+    """The record as JSON line"""
+    entry = {
+        "time": record.created,
+        "level": record.levelname,
+        "app": stream if stream != "manager" else None,
+        "logger": record.name,
+        "message": record.getMessage(),
+    }
+    if record.exc_text:
+        entry["exception"] = record.exc_text
+    return json.dumpb(entry) + b"\n"
+
+
+class RotatingFile:
+    """Append only file rotated by size and time
+
+    Rotated files are renamed to <name>.<timestamp in ns>.jsonl and compressed
+    in the background, only the newest backups are kept.
+    """
+
+    def __init__(self, path: Path, max_bytes: int, interval: float, backups: int, compressor: ThreadPoolExecutor):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.backups = backups
+        self.compressor = compressor
+
+        self.file: IO[bytes] | None = None
+        self.size = 0
+        self.rollover_at = 0.0
+
+    def _open(self) -> IO[bytes]:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        file = self.path.open("ab")
+        self.size = file.tell()
+        # Align to the interval, e.g. rotate at midnight (UTC) for one day
+        created = self.path.stat().st_mtime if self.size else time.time()
+        self.rollover_at = (created // self.interval + 1) * self.interval
+        return file
+
+    def write(self, line: bytes) -> None:
+        if self.file is None:
+            self.file = self._open()
+        elif self.size + len(line) > self.max_bytes or time.time() >= self.rollover_at:
+            self.rotate()
+            self.file = self._open()
+
+        self.file.write(line)
+        self.file.flush()
+        self.size += len(line)
+
+    def rotate(self) -> None:
+        if self.file:
+            self.file.close()
+            self.file = None
+        if not self.path.exists() or not self.path.stat().st_size:
+            return
+
+        rotated = self.path.with_name(f"{self.path.stem}.{time.time_ns()}{self.path.suffix}")
+        os.replace(self.path, rotated)
+        self.compressor.submit(self._compress, rotated)
+
+    def _compress(self, path: Path) -> None:
+        with path.open("rb") as source, gzip.open(path.with_name(path.name + ".gz"), "wb") as target:
+            shutil.copyfileobj(source, target)
+        path.unlink()
+
+        # Only this file's backups, "<stem>.*" would also match e.g. "<stem>.other.jsonl.gz"
+        pattern = re.compile(rf"{re.escape(self.path.stem)}\.(\d+){re.escape(self.path.suffix)}\.gz")
+        archives = sorted(
+            (int(match[1]), archive)
+            for archive in self.path.parent.glob(f"{self.path.stem}.*{self.path.suffix}.gz")
+            if (match := pattern.fullmatch(archive.name))
         )
+        for _, old in archives[: -self.backups or None] if self.backups else ():
+            old.unlink()
+
+    def close(self) -> None:
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+class JsonLinesHandler(logging.Handler):
+    """Write records as JSON lines, one file per app plus one for the rest
+
+    Meant to run behind a QueueListener, so file IO and rotation never
+    happen on the event loop.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        max_bytes: int = 10 * 1024 * 1024,
+        interval: float = 86400,
+        backups: int = 14,
+        level: int = logging.NOTSET,
+    ) -> None:
+        super().__init__(level)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.backups = backups
+
+        self.files: dict[str, RotatingFile] = {}
+        self.compressor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="log-compressor")
+
+    def _file(self, name: str) -> RotatingFile:
+        if (file := self.files.get(name)) is None:
+            filename = re.sub(r"[^\w.-]", "_", name) + ".jsonl"
+            path = self.directory / filename
+            self.files[name] = file = RotatingFile(path, self.max_bytes, self.interval, self.backups, self.compressor)
+        return file
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            stream = log_stream(record)
+            self._file(stream).write(serialise_record(record, stream))
+        except Exception:
+            self.handleError(record)
+
+    def close(self) -> None:
+        for file in self.files.values():
+            file.close()
+        self.compressor.shutdown(wait=True)
+        super().close()
+
+
+class PreparingQueueHandler(QueueHandler):
+    """Queue handler that leaves formatting to the listener
+
+    Only the message itself is rendered on the calling thread (its
+    arguments might change after the call), the exception is rendered
+    separately so structured handlers can keep it apart from the message.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+
+        record = logging.makeLogRecord(record.__dict__)
+        record.message = record.msg = message
+        record.args = None
+        record.exc_info = None
+        return record
+
+
+class ClosingQueueListener(QueueListener):
+    """QueueListener that closes its handlers once stopped"""
+
+    def stop(self) -> None:
+        super().stop()
+        for handler in self.handlers:
+            handler.close()
+
+
+def setup_logging(*handlers: logging.Handler) -> QueueListener:
+    """Send all logs through a queue to a background thread
+
+    Records are filtered (log levels, filters) on the logging thread, but
+    formatted and written by the listener thread. So logging never blocks
+    the event loop. uvicorn's loggers are routed through the same queue.
+
+    Returns the started listener, stop it on shutdown to flush the queue and
+    close the handlers.
+    """
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter(LOG_FORMAT))
+    files = JsonLinesHandler(
+        config.log_dir,
+        max_bytes=config.log_file_max_bytes,
+        interval=config.log_file_interval,
+        backups=config.log_file_backups,
+    )
+
+    queue_handler = PreparingQueueHandler(SimpleQueue())
+    listener = ClosingQueueListener(queue_handler.queue, console, files, *handlers, respect_handler_level=True)
+
+    logging.basicConfig(level=config.global_log_level_int, handlers=[queue_handler])
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        uvicorn_logger = logging.getLogger(name)
+        uvicorn_logger.handlers = [queue_handler]
+        uvicorn_logger.propagate = False
+
+    listener.start()
+    return listener
 
 
 def log(arg_names: list[str] = [], ignore_incoming: bool = False) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
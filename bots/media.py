@@ -0,0 +1,306 @@
+import asyncio
+import hashlib
+import os
+from collections import OrderedDict
+from logging import getLogger
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Hashable, TypedDict
+
+from telegram import Animation, Audio, Document, Message, PhotoSize, Sticker, Video, VideoNote, Voice
+from telegram.error import BadRequest
+
+from bots.cache import CachedLookups
+from bots.storage import KeyValueStore
+
+logger = getLogger("media")
+
+Media = Animation | Audio | Document | PhotoSize | Sticker | Video | VideoNote | Voice
+
+# Kind of a media object, the same as the attribute of Message it is sent as
+KINDS: dict[type[Media], str] = {
+    Animation: "animation",
+    Audio: "audio",
+    Document: "document",
+    PhotoSize: "photo",
+    Sticker: "sticker",
+    Video: "video",
+    VideoNote: "video_note",
+    Voice: "voice",
+}
+
+
+class MediaStats(TypedDict):
+    files: int
+    size: int
+    max_size: int
+    evictions: int
+    download_hits: int
+    download_misses: int
+    upload_hits: int
+    upload_misses: int
+    hit_rate: float
+    # Bytes not downloaded from / uploaded to Telegram thanks to the cache
+    bytes_saved: int
+
+
+class MediaCache:
+    """Media shared by all apps, content addressed by the sha256 of the bytes
+
+    Downloaded files are kept on disk in directory/<hash[:2]>/<hash>, the
+    least recently used are deleted once they exceed max_size bytes. Files
+    are identified by their file_unique_id, which is the same for all bots,
+    so a file downloaded by one bot is a hit for the others as well.
+
+    file_ids are only valid for the bot that got them. For every bot the
+    file_id of uploaded (and downloaded) content is remembered, so sending
+    the same content again doesn't upload it again.
+
+    The file_unique_id and file_id mappings are kept in storage.
+    """
+
+    def __init__(self, directory: Path, max_size: int, storage: KeyValueStore) -> None:
+        self.directory = directory
+        self.max_size = max_size
+        self.storage = storage
+
+        # Size of the files on disk by hash, least recently used first
+        self._files: OrderedDict[str, int] = OrderedDict()
+        self.size = 0
+        self._in_flight: dict[Hashable, asyncio.Future[Any]] = {}
+
+        self.stats = MediaStats(
+            files=0,
+            size=0,
+            max_size=max_size,
+            evictions=0,
+            download_hits=0,
+            download_misses=0,
+            upload_hits=0,
+            upload_misses=0,
+            hit_rate=0,
+            bytes_saved=0,
+        )
+
+    def _path(self, hash: str) -> Path:
+        return self.directory / hash[:2] / hash
+
+    def open(self) -> None:
+        """Index the files on disk, the oldest modification time is the least recently used"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        files = []
+        for path in self.directory.glob("??/*"):
+            if path.name.endswith(".tmp"):
+                # Left over of a crash during a write
+                path.unlink(missing_ok=True)
+                continue
+            stat = path.stat()
+            files.append((stat.st_mtime, path.name, stat.st_size))
+        for _, hash, size in sorted(files):
+            self._files[hash] = size
+            self.size += size
+        self._evict()
+
+    # =====
+    # FILES
+    # =====
+
+    async def read(self, hash: str) -> bytes | None:
+        if hash not in self._files:
+            return None
+        self._files.move_to_end(hash)
+        try:
+            return await asyncio.to_thread(self._read, self._path(hash))
+        except FileNotFoundError:
+            self._forget(hash)
+            return None
+
+    @staticmethod
+    def _read(path: Path) -> bytes:
+        data = path.read_bytes()
+        # Keeps the LRU order across restarts
+        os.utime(path)
+        return data
+
+    async def write(self, data: bytes) -> str:
+        """Add content to the cache, returns its hash"""
+        hash = await asyncio.to_thread(self._write, data)
+        if hash not in self._files:
+            self.size += len(data)
+        self._files[hash] = len(data)
+        self._files.move_to_end(hash)
+        self._evict()
+        return hash
+
+    def _write(self, data: bytes) -> str:
+        hash = hashlib.sha256(data).hexdigest()
+        path = self._path(hash)
+        if path.exists():
+            os.utime(path)
+            return hash
+        path.parent.mkdir(exist_ok=True)
+        # Written next to the target, so readers never see a partial file
+        temp_path = path.with_name(f"{hash}.{os.getpid()}.tmp")
+        temp_path.write_bytes(data)
+        temp_path.replace(path)
+        return hash
+
+    def _forget(self, hash: str) -> None:
+        self.size -= self._files.pop(hash, 0)
+
+    def _evict(self) -> None:
+        # The newest file is kept even if it's larger than max_size on its own
+        while self.size > self.max_size and len(self._files) > 1:
+            hash, _ = next(iter(self._files.items()))
+            self._forget(hash)
+            self._path(hash).unlink(missing_ok=True)
+            self.stats["evictions"] += 1
+
+    async def _coalesced(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """Run factory() once for concurrent calls with the same key"""
+        if (future := self._in_flight.get(key)) is not None:
+            return await asyncio.shield(future)
+
+        self._in_flight[key] = future = asyncio.get_running_loop().create_future()
+        try:
+            result = await factory()
+        except BaseException as error:
+            if isinstance(error, Exception):
+                future.set_exception(error)
+                # Mark the exception as retrieved in case nobody else was waiting
+                future.exception()
+            else:
+                future.cancel()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._in_flight[key]
+
+    # =========
+    # DOWNLOADS
+    # =========
+
+    async def download(self, lookups: CachedLookups, media: Media) -> bytes:
+        """The content of the media, downloaded with the bot of lookups if not cached"""
+        hash = await self.storage.get(f"unique:{media.file_unique_id}")
+        if hash and (data := await self.read(hash)) is not None:
+            self.stats["download_hits"] += 1
+            self.stats["bytes_saved"] += len(data)
+            await self._remember_file_id(lookups.bot_key, KINDS[type(media)], hash, media.file_id)
+            return data
+
+        async def fetch() -> bytes:
+            self.stats["download_misses"] += 1
+            file = await lookups.get_file(media.file_id)
+            data = bytes(await file.download_as_bytearray())
+            hash = await self.write(data)
+            self.storage.set(f"unique:{media.file_unique_id}", hash)
+            # The bot can send the content with the same file_id
+            await self._remember_file_id(lookups.bot_key, KINDS[type(media)], hash, media.file_id)
+            return data
+
+        key = ("download", media.file_unique_id)
+        if key in self._in_flight:
+            # Downloaded by another task right now
+            shared: bytes = await self._coalesced(key, fetch)
+            self.stats["download_hits"] += 1
+            self.stats["bytes_saved"] += len(shared)
+            return shared
+        return await self._coalesced(key, fetch)  # type: ignore[no-any-return]
+
+    # =======
+    # UPLOADS
+    # =======
+
+    async def _remember_file_id(self, bot_key: str, kind: str, hash: str, file_id: str) -> None:
+        key = f"file:{bot_key}:{kind}:{hash}"
+        if await self.storage.get(key) != file_id:
+            self.storage.set(key, file_id)
+
+    async def send(
+        self,
+        bot_key: str,
+        content: bytes | Path,
+        send: Callable[[bytes | str], Awaitable[Message]],
+        kind: str,
+    ) -> Message:
+        """Send content with send(file), file is the bot's file_id of the content if known
+
+        kind is the type the content is sent as ("photo", "document", ...),
+        file_ids of one kind can't be used for another.
+        """
+        data = content if isinstance(content, bytes) else await asyncio.to_thread(content.read_bytes)
+        hash = await asyncio.to_thread(lambda: hashlib.sha256(data).hexdigest())
+        key = f"file:{bot_key}:{kind}:{hash}"
+
+        if (file_id := await self.storage.get(key)) is None and (future := self._in_flight.get(key)) is not None:
+            # The same content is uploaded right now, e.g. by a broadcast
+            file_id = await asyncio.shield(future)
+
+        if file_id is not None:
+            try:
+                message = await send(file_id)
+            except BadRequest as error:
+                # E.g. the file was deleted on Telegram's side
+                logger.warning(f"Cached file_id of {hash} not usable anymore: {error}")
+                self.storage.delete(key)
+            else:
+                self.stats["upload_hits"] += 1
+                self.stats["bytes_saved"] += len(data)
+                return message
+
+        # Others sending the same content meanwhile wait for the file_id of this upload,
+        # they upload themselves if it fails (None)
+        future = None
+        if key not in self._in_flight:
+            self._in_flight[key] = future = asyncio.get_running_loop().create_future()
+        self.stats["upload_misses"] += 1
+        file_id = None
+        try:
+            message = await send(data)
+            if (file_id := sent_file(message, kind)) is not None:
+                self.storage.set(key, file_id)
+            return message
+        finally:
+            if future:
+                del self._in_flight[key]
+                future.set_result(file_id)
+
+    def get_stats(self) -> MediaStats:
+        hits = self.stats["download_hits"] + self.stats["upload_hits"]
+        total = hits + self.stats["download_misses"] + self.stats["upload_misses"]
+        return self.stats | {  # type: ignore[return-value]
+            "files": len(self._files),
+            "size": self.size,
+            "hit_rate": hits / total if total else 0,
+        }
+
+
+def sent_file(message: Message, kind: str) -> str | None:
+    """The file_id of the media of the message"""
+    media = getattr(message, kind, None)
+    if isinstance(media, (tuple, list)):
+        # Photos come in multiple sizes, the largest is the original
+        media = media[-1] if media else None
+    return getattr(media, "file_id", None)
+
+
+class BotMedia:
+    """The MediaCache for a single bot
+
+    data = await self.media.download(message.document)
+    await self.media.send(data, lambda file: bot.send_photo(chat_id, file), "photo")
+    """
+
+    def __init__(self, cache: MediaCache, lookups: CachedLookups) -> None:
+        self.cache = cache
+        self.lookups = lookups
+
+    async def download(self, media: Media) -> bytes:
+        return await self.cache.download(self.lookups, media)
+
+    async def send(
+        self, content: bytes | Path, send: Callable[[bytes | str], Awaitable[Message]], kind: str
+    ) -> Message:
+        return await self.cache.send(self.lookups.bot_key, content, send, kind)
@@ -0,0 +1,337 @@
+import asyncio
+import datetime
+import heapq
+import itertools
+import time
+import uuid
+import weakref
+from logging import getLogger
+from typing import Any, Callable, Coroutine, TypedDict
+
+import pytz
+from apscheduler.triggers.base import BaseTrigger
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.date import DateTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+from telegram.ext import Application, ExtBot, JobQueue
+
+logger = getLogger("scheduler")
+
+TRIGGERS: dict[str, type[BaseTrigger]] = {
+    "date": DateTrigger,
+    "interval": IntervalTrigger,
+    "cron": CronTrigger,
+}
+
+
+class JobStats(TypedDict):
+    jobs: int
+    running: int
+    runs: int
+    missed: int
+    skipped: int
+    lag_avg: float
+    lag_max: float
+
+
+class ScheduledJob:
+    """A job of a SchedulerNamespace
+
+    Mimics the parts of apscheduler.job.Job that PTB's Job and JobQueue use,
+    so telegram.ext.Job works unchanged on top of it.
+    """
+
+    def __init__(
+        self,
+        namespace: "SchedulerNamespace",
+        func: Callable[..., Coroutine[Any, Any, Any]],
+        trigger: BaseTrigger,
+        args: tuple[Any, ...] = (),
+        kwargs: dict[str, Any] | None = None,
+        id: str | None = None,
+        name: str | None = None,
+        misfire_grace_time: float | None = 1,
+        coalesce: bool = True,
+        max_instances: int = 1,
+    ) -> None:
+        self.namespace = namespace
+        self.func = func
+        self.trigger = trigger
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.id = id or uuid.uuid4().hex
+        self.name = name or getattr(func, "__name__", self.id)
+        self.misfire_grace_time = misfire_grace_time
+        self.coalesce = coalesce
+        self.max_instances = max_instances
+
+        self.next_run_time: datetime.datetime | None = None
+        self.instances = 0
+        # Bumped whenever the job is rescheduled, older heap entries are ignored
+        self.version = 0
+
+    def remove(self) -> None:
+        self.namespace.remove_job(self.id)
+
+    def pause(self) -> "ScheduledJob":
+        self.namespace.reschedule(self, None)
+        return self
+
+    def resume(self) -> "ScheduledJob":
+        now = datetime.datetime.now(self.namespace.timezone)
+        self.namespace.reschedule(self, self.trigger.get_next_fire_time(None, now))
+        return self
+
+    def __repr__(self) -> str:
+        return f"<ScheduledJob {self.namespace.id}:{self.name} next={self.next_run_time}>"
+
+
+class JobScheduler:
+    """Single timer driven scheduler for the jobs of all apps
+
+    All scheduled runs are kept in one heap ordered by their run time. Only
+    one timer is armed at any time (for the earliest run), so the overhead
+    doesn't grow with the number of apps. Adding, rescheduling and
+    running a job are O(log n).
+
+    Apps use it through their SchedulerNamespace (see namespace()), which is
+    plugged into their PTB job queue via SharedJobQueue.
+    """
+
+    def __init__(self) -> None:
+        self.namespaces: dict[str, SchedulerNamespace] = {}
+        self._heap: list[tuple[float, int, int, ScheduledJob]] = []
+        self._sequence = itertools.count()
+        self._timer: asyncio.TimerHandle | None = None
+        self._timer_at = float("inf")
+
+    def namespace(self, id: str) -> "SchedulerNamespace":
+        """A new job namespace for an app, replacing the previous one with the same id"""
+        if previous := self.namespaces.get(id):
+            previous.clear()
+        self.namespaces[id] = namespace = SchedulerNamespace(self, id)
+        return namespace
+
+    def remove_namespace(self, id: str) -> None:
+        if namespace := self.namespaces.pop(id, None):
+            namespace.clear()
+
+    def stats(self) -> dict[str, JobStats]:
+        return {id: namespace.stats() for id, namespace in self.namespaces.items()}
+
+    def push(self, job: ScheduledJob) -> None:
+        if job.next_run_time is None:
+            return
+        run_at = job.next_run_time.timestamp()
+        heapq.heappush(self._heap, (run_at, next(self._sequence), job.version, job))
+        if run_at < self._timer_at:
+            self._arm()
+
+    def _arm(self) -> None:
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        self._timer_at = float("inf")
+
+        # Drop stale entries so they don't keep waking us up
+        while self._heap and self._heap[0][2] != self._heap[0][3].version:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return
+
+        self._timer_at = self._heap[0][0]
+        self._timer = asyncio.get_running_loop().call_later(max(0, self._timer_at - time.time()), self._process)
+
+    def _process(self) -> None:
+        self._timer = None
+        self._timer_at = float("inf")
+        now = time.time()
+        while self._heap and self._heap[0][0] <= now:
+            run_at, _, version, job = heapq.heappop(self._heap)
+            if version == job.version:
+                job.namespace.run(job, run_at, now)
+        self._arm()
+
+
+class SchedulerNamespace:
+    """The jobs of a single app in the shared JobScheduler
+
+    Provides the subset of the APScheduler scheduler interface used by PTB's
+    JobQueue. Jobs only run while the namespace is started.
+    """
+
+    # Weight of the latest lag in the moving average
+    lag_smoothing = 0.1
+
+    def __init__(self, scheduler: JobScheduler, id: str) -> None:
+        self.scheduler = scheduler
+        self.id = id
+        self.timezone: datetime.tzinfo = pytz.utc
+        self.running = False
+
+        self.jobs: dict[str, ScheduledJob] = {}
+        self._tasks: set[asyncio.Task[Any]] = set()
+
+        self.runs = 0
+        self.missed = 0
+        self.skipped = 0
+        self.lag_avg = 0.0
+        self.lag_max = 0.0
+
+    # =========
+    # LIFECYCLE
+    # =========
+
+    def configure(self, timezone: datetime.tzinfo | None = None, **_: Any) -> None:
+        if timezone:
+            self.timezone = timezone
+
+    def start(self) -> None:
+        self.running = True
+        now = datetime.datetime.now(self.timezone)
+        for job in self.jobs.values():
+            if job.next_run_time is not None and job.next_run_time < now:
+                # Missed while stopped, continue with the next regular run
+                job.next_run_time = job.trigger.get_next_fire_time(None, now)
+            # Paused jobs (without next run time) aren't pushed
+            self.reschedule(job, job.next_run_time)
+
+    async def shutdown(self, wait: bool = True) -> None:
+        self.running = False
+        for job in self.jobs.values():
+            job.version += 1
+        if wait:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def clear(self) -> None:
+        self.running = False
+        for job in list(self.jobs.values()):
+            self.remove_job(job.id)
+
+    # ====
+    # JOBS
+    # ====
+
+    def add_job(
+        self,
+        func: Callable[..., Coroutine[Any, Any, Any]],
+        trigger: str | BaseTrigger | None = None,
+        args: tuple[Any, ...] = (),
+        kwargs: dict[str, Any] | None = None,
+        id: str | None = None,
+        name: str | None = None,
+        misfire_grace_time: float | None = 1,
+        coalesce: bool = True,
+        max_instances: int = 1,
+        next_run_time: datetime.datetime | None = None,
+        **trigger_args: Any,
+    ) -> ScheduledJob:
+        """Add a job, trigger and trigger_args are the same as for APScheduler"""
+        if not isinstance(trigger, BaseTrigger):
+            trigger_args.setdefault("timezone", self.timezone)
+            trigger = TRIGGERS[trigger or "date"](**trigger_args)
+
+        job = ScheduledJob(self, func, trigger, args, kwargs, id, name, misfire_grace_time, coalesce, max_instances)
+        if id and id in self.jobs:
+            self.remove_job(id)
+        self.jobs[job.id] = job
+        job.next_run_time = next_run_time or trigger.get_next_fire_time(None, datetime.datetime.now(self.timezone))
+        if job.next_run_time is None:
+            del self.jobs[job.id]
+        elif self.running:
+            self.scheduler.push(job)
+        return job
+
+    def get_jobs(self) -> list[ScheduledJob]:
+        return sorted(
+            self.jobs.values(),
+            key=lambda job: job.next_run_time.timestamp() if job.next_run_time else float("inf"),
+        )
+
+    def get_job(self, id: str) -> ScheduledJob | None:
+        return self.jobs.get(id)
+
+    def remove_job(self, id: str) -> None:
+        if job := self.jobs.pop(id, None):
+            job.version += 1
+            job.next_run_time = None
+
+    def reschedule(self, job: ScheduledJob, next_run_time: datetime.datetime | None) -> None:
+        job.version += 1
+        job.next_run_time = next_run_time
+        if self.running:
+            self.scheduler.push(job)
+
+    def run(self, job: ScheduledJob, run_at: float, now: float) -> None:
+        """Run a due job and schedule its next run, called by the JobScheduler"""
+        lag = now - run_at
+        if job.misfire_grace_time is not None and lag > job.misfire_grace_time:
+            self.missed += 1
+            logger.warning(f"{self.id}: Run of {job.name} missed by {lag:.3f}s")
+        elif job.instances >= job.max_instances:
+            self.skipped += 1
+            logger.warning(f"{self.id}: Run of {job.name} skipped, already running")
+        else:
+            self.runs += 1
+            self.lag_avg += (lag - self.lag_avg) * self.lag_smoothing
+            self.lag_max = max(self.lag_max, lag)
+            self._spawn(job)
+
+        previous = job.next_run_time
+        current = datetime.datetime.now(self.timezone)
+        next_run_time = job.trigger.get_next_fire_time(previous, current if job.coalesce else previous)
+        if next_run_time is None:
+            self.remove_job(job.id)
+        else:
+            self.reschedule(job, next_run_time)
+
+    def _spawn(self, job: ScheduledJob) -> None:
+        job.instances += 1
+        task = asyncio.create_task(job.func(*job.args, **job.kwargs))
+        self._tasks.add(task)
+
+        def done(task: asyncio.Task[Any]) -> None:
+            job.instances -= 1
+            self._tasks.discard(task)
+            if not task.cancelled() and (error := task.exception()):
+                logger.error(f"{self.id}: Job {job.name} failed: {error}", exc_info=error)
+
+        task.add_done_callback(done)
+
+    def stats(self) -> JobStats:
+        return JobStats(
+            jobs=len(self.jobs),
+            running=len(self._tasks),
+            runs=self.runs,
+            missed=self.missed,
+            skipped=self.skipped,
+            lag_avg=self.lag_avg,
+            lag_max=self.lag_max,
+        )
+
+
+class SharedJobQueue(JobQueue):  # type: ignore[type-arg]
+    """PTB job queue running its jobs on the shared JobScheduler
+
+    Has the same API as JobQueue (run_once(), run_repeating(), ...), but
+    doesn't start an APScheduler instance per app.
+    """
+
+    def __init__(self, namespace: SchedulerNamespace) -> None:
+        self._application = None
+        self.namespace = namespace
+        # JobQueue's methods schedule their jobs via self.scheduler.add_job()
+        self.scheduler = namespace
+
+    def set_application(self, application: Application[Any, Any, Any, Any, Any, Any]) -> None:
+        # JobQueue's version also sets its own APScheduler executor, which we don't have
+        self._application = weakref.ref(application)
+        if isinstance(application.bot, ExtBot) and application.bot.defaults:
+            self.namespace.configure(timezone=application.bot.defaults.tzinfo or pytz.utc)
+
+    async def start(self) -> None:
+        if not self.namespace.running:
+            self.namespace.start()
+
+    async def stop(self, wait: bool = True) -> None:
+        await self.namespace.shutdown(wait)
@@ -1,6 +1,23 @@
 export default class AppManager {
   constructor() {
     this.apps = [];
+    this.statuses = {};
+  }
+
+  formatStatus(status) {
+    if (!status) {
+      return "";
+    }
+    const lastSeen = status.last_seen ? new Date(status.last_seen * 1000).toLocaleTimeString() : "never";
+    return `${status.update_rate}/s, ${status.error_rate} err/s, ${status.queue_depth} queued, last ${lastSeen}`;
+  }
+
+  updateStatus(status) {
+    this.statuses[status.id] = status;
+    const cell = document.querySelector(`tr[data-app-id="${status.id}"] .app-status`);
+    if (cell) {
+      cell.textContent = this.formatStatus(status);
+    }
   }
 
   updateApps(newApps) {
@@ -39,12 +56,18 @@ export default class AppManager {
 
       const tr = document.createElement("tr");
       tr.innerHTML = `
-        <td class="align-middle col-id">${app.id}</td>
+        <td class="align-middle col-id">
+          ${app.id}
+          ${app.node ? `<br /><small class="text-muted" title="Node">${app.node}</small>` : ""}
+        </td>
         <td class="align-middle col-telegram">
           <a href="${app.bot.link}" target="_blank">@${app.bot.username}</a>
         </td>
         <td class="align-middle col-telegram-token">${app.telegram_token}</td>
-        <td class="align-middle col-started">${app.running ? "✅" : "❌"}</td>
+        <td class="align-middle col-started">
+          ${app.hibernated ? '<span title="Hibernated, wakes up on the next update">💤</span>' : app.running ? "✅" : "❌"}
+          <br /><small class="text-muted text-nowrap app-status">${this.formatStatus(this.statuses[app.id])}</small>
+        </td>
         <td class="align-middle col-actions">
           <div class="d-flex g-3">
             <button
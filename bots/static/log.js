@@ -6,11 +6,8 @@ serverLogsShown.addEventListener("change", () => {
   logHistory.scrollTop = logHistory.scrollHeight;
 });
 
-// Add log to log history
-export function displayLogEntry(namespace, event, status, message) {
-  var isScrolledToBottom = logHistory.scrollHeight - logHistory.clientHeight <= logHistory.scrollTop + 1;
-
-  // Create a new log entry element
+// Create a log entry element
+function createLogEntry(namespace, event, status, message) {
   const logEntry = document.createElement("div");
   logEntry.classList.add("log-entry");
 
@@ -28,9 +25,71 @@ export function displayLogEntry(namespace, event, status, message) {
   // Set the log entry content
   logEntry.textContent = `[${namespace}/${event}] Status: ${status.toUpperCase()}, Message: ${message}`;
   logEntry.classList.add("log-ns-" + namespace.substring(1));
+  return logEntry;
+}
+
+// Append log entry elements to the log history
+function appendLogEntries(entries) {
+  var isScrolledToBottom = logHistory.scrollHeight - logHistory.clientHeight <= logHistory.scrollTop + 1;
 
-  logHistory.appendChild(logEntry);
+  logHistory.append(...entries);
   if (isScrolledToBottom) {
     logHistory.scrollTop = logHistory.scrollHeight;
   }
 }
+
+// Add log to log history
+export function displayLogEntry(namespace, event, status, message) {
+  appendLogEntries([createLogEntry(namespace, event, status, message)]);
+}
+
+// Add a batch of logs ({status, message}) to the log history at once
+export function displayLogEntries(namespace, event, logs) {
+  appendLogEntries(logs.map((log) => createLogEntry(namespace, event, log.status, log.message)));
+}
+
+// Log archive search, results are streamed in chunks by the "log_search" event
+const logSearchForm = document.getElementById("log-search-form");
+const logSearchEntries = document.getElementById("log-search-entries");
+const logSearchMore = document.getElementById("log-search-more");
+let logSearchQuery = null;
+
+function timestamp(value) {
+  return value ? new Date(value).getTime() / 1000 : null;
+}
+
+function searchLogs(cursor) {
+  logSearchMore.classList.add("d-none");
+  window.serverSocket.emit("log_search", { ...logSearchQuery, cursor: cursor, limit: 200 });
+}
+
+logSearchForm.addEventListener("submit", (event) => {
+  event.preventDefault();
+  const form = new FormData(logSearchForm);
+  logSearchQuery = {
+    app: form.get("app") || null,
+    level: form.get("level") || null,
+    text: form.get("text") || null,
+    start: timestamp(form.get("start")),
+    end: timestamp(form.get("end")),
+  };
+  logSearchEntries.replaceChildren();
+  searchLogs(null);
+});
+
+export function displayLogSearch(response) {
+  const { entries, cursor, done } = response.data;
+  logSearchEntries.append(
+    ...entries.map((entry) => {
+      const line = document.createElement("div");
+      line.classList.add("log-entry", "log-" + entry.level.toLowerCase());
+      const time = new Date(entry.time * 1000).toLocaleString();
+      line.textContent = `${time} ${entry.level} [${entry.app || "manager"}] ${entry.message}`;
+      return line;
+    }),
+  );
+  if (done && cursor) {
+    logSearchMore.onclick = () => searchLogs(cursor);
+    logSearchMore.classList.remove("d-none");
+  }
+}
@@ -1,5 +1,5 @@
 import AppManager from "./appManager.js";
-import { displayLogEntry } from "./log.js";
+import { displayLogEntries, displayLogEntry, displayLogSearch } from "./log.js";
 
 // Usage example:
 const appManager = new AppManager();
@@ -9,6 +9,27 @@ window.serverSocket = serverSocket;
 const apiSocket = io(`ws://${window.location.host}/api`, { path: "/ws/socket.io" });
 window.apiSocket = apiSocket;
 
+// Subscriptions, the server forgets them on reconnect. With ?app=<id> only that app's events are received
+const onlyApp = new URLSearchParams(window.location.search).get("app");
+const serverLogLevel = document.getElementById("serverLogLevel");
+
+apiSocket.on("connect", () => {
+  if (onlyApp) {
+    apiSocket.emit("unsubscribe", { topics: ["apps"] });
+    apiSocket.emit("subscribe", { topics: [`app:${onlyApp}`, `status:${onlyApp}`] });
+  } else {
+    apiSocket.emit("subscribe", { topics: ["status"] });
+  }
+});
+
+serverSocket.on("connect", () => {
+  serverSocket.emit("subscribe", { topics: [`log:${serverLogLevel.value}`] });
+});
+
+serverLogLevel.addEventListener("change", () => {
+  serverSocket.emit("subscribe", { topics: [`log:${serverLogLevel.value}`] });
+});
+
 // On any API endpoint message
 apiSocket.onAny((eventName, response) => {
   if (response.message !== null && response.message !== undefined) {
@@ -31,6 +52,104 @@ serverSocket.onAny((eventName, response) => {
   }
 });
 
+// Logs sent in bulk by the server
+serverSocket.on("log_batch", (response) => {
+  displayLogEntries("/server", "log", response.data);
+});
+
+// Streamed results of a log search
+serverSocket.on("log_search", (response) => {
+  if (response.status === "success") {
+    displayLogSearch(response);
+  }
+});
+
+// Live status, only changed apps are sent
+const fleetStatus = document.getElementById("fleet-status");
+
+apiSocket.on("status", (response) => {
+  const fleet = response.data.fleet;
+  fleetStatus.textContent =
+    `${fleet.running}/${fleet.apps} running` +
+    (fleet.hibernated ? `, ${fleet.hibernated} hibernated` : "") +
+    `, ${fleet.update_rate} updates/s, ${fleet.error_rate} errors/s, ${fleet.queue_depth} queued`;
+  response.data.apps.forEach((status) => appManager.updateStatus(status));
+});
+
+apiSocket.on("app_status", (response) => {
+  appManager.updateStatus(response.data);
+});
+
+function tableCell(text) {
+  const td = document.createElement("td");
+  td.className = "align-middle";
+  td.textContent = text;
+  return td;
+}
+
+// Broadcast progress
+const broadcasts = document.getElementById("broadcasts");
+const broadcastsTable = document.getElementById("broadcasts-tbody");
+
+apiSocket.on("broadcast_progress", (response) => {
+  const job = response.data;
+  const progress = job.total ? `${job.processed} / ${job.total}` : job.processed;
+  const errors = Object.entries(job.errors)
+    .map(([name, count]) => `${name}: ${count}`)
+    .join(", ");
+
+  const tr = document.createElement("tr");
+  tr.setAttribute("data-job-id", job.job_id);
+  // Job ids and error messages come from apps and Telegram, never parse them as HTML
+  for (const text of [job.job_id, job.app_id, job.status, progress, job.sent, job.failed, `${job.rate.toFixed(1)}/s`]) {
+    tr.appendChild(tableCell(text));
+  }
+  tr.children[5].title = errors;
+
+  const button = document.createElement("button");
+  button.className = "btn text-nowrap btn-warning";
+  button.disabled = job.status !== "running";
+  button.innerHTML = '<i class="bi bi-x"></i> Cancel';
+  button.addEventListener("click", () => apiSocket.emit("broadcast_cancel", { jobId: job.job_id }));
+  tr.appendChild(tableCell("")).appendChild(button);
+
+  const existingRow = broadcastsTable.querySelector(`tr[data-job-id="${CSS.escape(job.job_id)}"]`);
+  if (existingRow) {
+    broadcastsTable.replaceChild(tr, existingRow);
+  } else {
+    broadcastsTable.appendChild(tr);
+  }
+  broadcasts.classList.remove("d-none");
+});
+
+// Slowest recent traces per app
+const tracesTable = document.getElementById("traces-tbody");
+document.getElementById("traces-refresh").addEventListener("click", () => apiSocket.emit("traces"));
+
+apiSocket.on("traces", (response) => {
+  tracesTable.replaceChildren();
+  for (const [appId, traces] of Object.entries(response.data.traces)) {
+    for (const trace of traces) {
+      const spans = trace.spans
+        .map((span) => {
+          const error = span.error ? ` (${span.error})` : "";
+          return `${"  ".repeat(span.depth)}${span.name}: +${span.offset.toFixed(1)}ms ${span.duration.toFixed(1)}ms${error}`;
+        })
+        .join("\n");
+
+      const tr = document.createElement("tr");
+      const started = new Date(trace.start * 1000).toLocaleString();
+      for (const text of [appId, trace.update, started, `${trace.duration.toFixed(1)}ms`]) {
+        tr.appendChild(tableCell(text));
+      }
+      const details = tr.appendChild(tableCell("")).appendChild(document.createElement("details"));
+      details.appendChild(document.createElement("summary")).textContent = `${trace.spans.length} spans`;
+      details.appendChild(document.createElement("pre")).textContent = spans;
+      tracesTable.appendChild(tr);
+    }
+  }
+});
+
 // Post error to modal
 export function postErrorIn(element, message, type) {
   element.innerHTML = [
@@ -0,0 +1,167 @@
+import asyncio
+import time
+from typing import TYPE_CHECKING, AsyncIterator, TypedDict
+
+from bots.utils.misc import async_throttled_iterator
+
+if TYPE_CHECKING:
+    from bots.applications._base import Application
+    from bots.applications.manager import AppManager
+
+
+class AppLiveStatus(TypedDict):
+    id: str
+    running: bool
+    hibernated: bool
+    # Per second since the previous status
+    update_rate: float
+    error_rate: float
+    # Updates received but not processed yet
+    queue_depth: int
+    # Unix time of the latest update, None if there was none since the start
+    last_seen: float | None
+
+
+class FleetStatus(TypedDict):
+    time: float
+    apps: int
+    running: int
+    hibernated: int
+    update_rate: float
+    error_rate: float
+    queue_depth: int
+    last_seen: float | None
+
+
+class StatusUpdate(TypedDict):
+    fleet: FleetStatus
+    # Only the apps whose status changed since the previous update
+    apps: list[AppLiveStatus]
+    # IDs of apps that don't exist anymore
+    removed: list[str]
+
+
+class StatusMonitor:
+    """Live status of the apps of this manager, computed from their counters
+
+    Processors set activity when they take or finish an update, lifecycle
+    changes call notify(). stream() coalesces these signals with
+    async_throttled_iterator() and computes a new status at most every
+    interval seconds, so its cost only depends on the number of apps, not on
+    the number of updates. Nothing is computed while all apps are idle.
+
+    Rates are averages since the previous status. After a status with
+    activity another one follows, so rates fall back to 0 when the apps go
+    idle.
+    """
+
+    def __init__(self, manager: "AppManager") -> None:
+        self.manager = manager
+        self.activity = asyncio.Event()
+
+        # App id -> (app instance, processed updates, errors) at the previous status
+        self._counters: dict[str, tuple["Application", int, int]] = {}
+        self._sampled = time.monotonic()
+        self._active = False
+
+        self.apps: dict[str, AppLiveStatus] = {}
+        self.fleet = FleetStatus(
+            time=time.time(),
+            apps=0,
+            running=0,
+            hibernated=0,
+            update_rate=0,
+            error_rate=0,
+            queue_depth=0,
+            last_seen=None,
+        )
+
+    def notify(self) -> None:
+        """Something other than the updates changed, e.g. an app was started"""
+        self.activity.set()
+
+    async def _changes(self) -> AsyncIterator[None]:
+        while True:
+            await self.activity.wait()
+            self.activity.clear()
+            yield None
+
+    async def stream(self, interval: float) -> AsyncIterator[StatusUpdate]:
+        """Status updates at most every interval seconds, only after changes
+
+        There must only be one consumer, status updates only contain what
+        changed since the previous one.
+        """
+        async for _ in async_throttled_iterator(self._changes(), interval):
+            update = self.sample(interval)
+            if self._active:
+                self.activity.set()
+            yield update
+
+    def _app_status(self, app: "Application", elapsed: float) -> AppLiveStatus:
+        processor = app.update_processor
+        errors = app.errors
+
+        previous_app, processed, previous_errors = self._counters.get(app.id, (app, 0, 0))
+        if previous_app is not app:
+            # Reloaded, the counters start from 0 again
+            processed = previous_errors = 0
+        self._counters[app.id] = (app, processor.processed, errors)
+
+        return AppLiveStatus(
+            id=app.id,
+            running=app.running,
+            hibernated=False,
+            update_rate=round((processor.processed - processed) / elapsed, 2),
+            error_rate=round((errors - previous_errors) / elapsed, 2),
+            queue_depth=app.queue_depth,
+            last_seen=processor.last_update_time,
+        )
+
+    def sample(self, interval: float) -> StatusUpdate:
+        """Compute the current status from the counters of the apps"""
+        now = time.monotonic()
+        elapsed = now - self._sampled
+        if not self._active:
+            # Updates after an idle period arrived within the last interval at most
+            elapsed = min(elapsed, interval)
+        elapsed = max(elapsed, 1e-3)
+        self._sampled = now
+
+        statuses = {app_id: self._app_status(app, elapsed) for app_id, app in self.manager.apps.items()}
+        for app_id in self.manager.hibernator.apps:
+            self._counters.pop(app_id, None)
+            previous = self.apps.get(app_id)
+            statuses[app_id] = AppLiveStatus(
+                id=app_id,
+                running=False,
+                hibernated=True,
+                update_rate=0,
+                error_rate=0,
+                queue_depth=0,
+                last_seen=previous["last_seen"] if previous else None,
+            )
+
+        removed = [app_id for app_id in self.apps if app_id not in statuses]
+        for app_id in removed:
+            self._counters.pop(app_id, None)
+        changed = [status for app_id, status in statuses.items() if self.apps.get(app_id) != status]
+        self.apps = statuses
+
+        values = statuses.values()
+        self.fleet = FleetStatus(
+            time=time.time(),
+            apps=len(statuses),
+            running=sum(status["running"] for status in values),
+            hibernated=sum(status["hibernated"] for status in values),
+            update_rate=round(sum(status["update_rate"] for status in values), 2),
+            error_rate=round(sum(status["error_rate"] for status in values), 2),
+            queue_depth=sum(status["queue_depth"] for status in values),
+            last_seen=max((seen for status in values if (seen := status["last_seen"])), default=None),
+        )
+        self._active = any(status["update_rate"] or status["error_rate"] or status["queue_depth"] for status in values)
+        return StatusUpdate(fleet=self.fleet, apps=changed, removed=removed)
+
+    def current(self) -> StatusUpdate:
+        """The latest status of all apps"""
+        return StatusUpdate(fleet=self.fleet, apps=list(self.apps.values()), removed=[])
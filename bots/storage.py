@@ -0,0 +1,351 @@
+import asyncio
+import pickle
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+from pathlib import Path
+from typing import Any, Callable, TypeVar
+
+from telegram.ext import BasePersistence, PersistenceInput
+from telegram.ext._utils.types import CDCData, ConversationDict, ConversationKey
+
+logger = getLogger("storage")
+
+T = TypeVar("T")
+
+# (namespace, key) -> (pickled value or None if deleted, expiry timestamp or None)
+Entry = tuple[bytes | None, float | None]
+
+
+class Storage:
+    """Persistent key value storage shared by all apps
+
+    Backed by a single SQLite database in WAL mode. All database access
+    happens on one dedicated thread, so the event loop is never blocked.
+
+    Writes are buffered and flushed in one transaction every flush_interval
+    seconds (or as soon as batch_size writes are pending). Reads are served
+    from the pending writes and an LRU cache before touching the database.
+    Expired entries are removed and the WAL is checkpointed in the
+    background every compaction_interval seconds.
+
+    Apps don't use this directly but get their own isolated KeyValueStore
+    via namespace().
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        flush_interval: float = 1.0,
+        batch_size: int = 500,
+        cache_size: int = 10_000,
+        compaction_interval: float = 3600,
+    ) -> None:
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self.compaction_interval = compaction_interval
+
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="storage")
+        self._connection: sqlite3.Connection | None = None
+        self._open_lock = asyncio.Lock()
+        self._flush_lock = asyncio.Lock()
+        self._flush_requested = asyncio.Event()
+        self._tasks: list[asyncio.Task[None]] = []
+
+        self._pending: dict[tuple[str, str], Entry] = {}
+        self._cache: OrderedDict[tuple[str, str], Entry] = OrderedDict()
+        # Incremented on every write, reads only cache their result if nothing was written meanwhile
+        self._writes = 0
+
+    # ========
+    # DATABASE
+    # ========
+
+    async def _run(self, func: Callable[..., T], *args: Any) -> T:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _connect(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS kv ("
+            " namespace TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " value BLOB NOT NULL,"
+            " expires REAL,"
+            " PRIMARY KEY (namespace, key)"
+            ") WITHOUT ROWID"
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS kv_expires ON kv (expires) WHERE expires IS NOT NULL")
+        connection.commit()
+
+    def _select(self, namespace: str, key: str) -> Entry:
+        assert self._connection
+        row = self._connection.execute(
+            "SELECT value, expires FROM kv WHERE namespace = ? AND key = ?", (namespace, key)
+        ).fetchone()
+        return (row[0], row[1]) if row else (None, None)
+
+    def _select_prefix(self, namespace: str, prefix: str) -> list[tuple[str, bytes]]:
+        assert self._connection
+        return self._connection.execute(
+            "SELECT key, value FROM kv"
+            " WHERE namespace = ? AND key >= ? AND key < ? AND (expires IS NULL OR expires > ?)",
+            (namespace, prefix, prefix + "\U0010ffff", time.time()),
+        ).fetchall()
+
+    def _write(self, entries: dict[tuple[str, str], Entry]) -> None:
+        assert self._connection
+        with self._connection:
+            self._connection.executemany(
+                "DELETE FROM kv WHERE namespace = ? AND key = ?",
+                [key for key, (value, _) in entries.items() if value is None],
+            )
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO kv (namespace, key, value, expires) VALUES (?, ?, ?, ?)",
+                [(*key, value, expires) for key, (value, expires) in entries.items() if value is not None],
+            )
+
+    def _compact(self) -> int:
+        assert self._connection
+        with self._connection:
+            removed = self._connection.execute(
+                "DELETE FROM kv WHERE expires IS NOT NULL AND expires <= ?", (time.time(),)
+            ).rowcount
+        self._connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self._connection.execute("PRAGMA optimize")
+        return removed
+
+    def _close(self) -> None:
+        if self._connection:
+            self._connection.close()
+            self._connection = None
+
+    # =========
+    # LIFECYCLE
+    # =========
+
+    async def open(self) -> None:
+        """Open the database and start the background tasks, no-op if already open"""
+        async with self._open_lock:
+            if self._connection:
+                return
+            await self._run(self._connect)
+            self._tasks = [
+                asyncio.create_task(self._flush_loop()),
+                asyncio.create_task(self._compaction_loop()),
+            ]
+            logger.info(f"Opened {self.path}")
+
+    async def close(self) -> None:
+        """Flush pending writes and close the database"""
+        if not self._connection:
+            if not self._pending:
+                return
+            # Written before the database was ever used, connect without the background tasks
+            async with self._open_lock:
+                if not self._connection:
+                    await self._run(self._connect)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        await self.flush()
+        await self._run(self._close)
+        self._cache.clear()
+        logger.info(f"Closed {self.path}")
+
+    async def _flush_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            try:
+                await self.flush()
+            except Exception as error:
+                logger.error(f"Failed to flush storage: {error}")
+
+    async def _compaction_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.compaction_interval)
+            try:
+                removed = await self._run(self._compact)
+                logger.info(f"Compacted storage, removed {removed} expired entries")
+            except Exception as error:
+                logger.error(f"Failed to compact storage: {error}")
+
+    async def flush(self) -> None:
+        """Write all pending changes to the database"""
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            await self.open()
+            entries, self._pending = self._pending, {}
+            try:
+                await self._run(self._write, entries)
+            except Exception:
+                # Keep newer pending writes, retry the rest on the next flush
+                self._pending = entries | self._pending
+                raise
+
+    # ==========
+    # KEY VALUES
+    # ==========
+
+    def _cache_put(self, key: tuple[str, str], entry: Entry) -> None:
+        self._cache[key] = entry
+        self._cache.move_to_end(key)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def forget(self, namespace: str) -> None:
+        """Drop the cached entries of the namespace, e.g. after another process wrote to it"""
+        for key in [key for key in self._cache if key[0] == namespace and key not in self._pending]:
+            del self._cache[key]
+
+    async def get(self, namespace: str, key: str, default: Any = None) -> Any:
+        full_key = (namespace, key)
+        entry = self._pending.get(full_key)
+        if entry is None and (entry := self._cache.get(full_key)) is not None:
+            self._cache.move_to_end(full_key)
+        if entry is None:
+            await self.open()
+            writes = self._writes
+            entry = await self._run(self._select, namespace, key)
+            if self._writes == writes:
+                self._cache_put(full_key, entry)
+            elif (newer := self._pending.get(full_key) or self._cache.get(full_key)) is not None:
+                # Written during the read, the selected row may be outdated
+                entry = newer
+
+        value, expires = entry
+        if value is None or (expires is not None and expires <= time.time()):
+            return default
+        return pickle.loads(value)
+
+    def set(self, namespace: str, key: str, value: Any, ttl: float | None = None) -> None:
+        self._put((namespace, key), (pickle.dumps(value), time.time() + ttl if ttl is not None else None))
+
+    def delete(self, namespace: str, key: str) -> None:
+        self._put((namespace, key), (None, None))
+
+    def _put(self, key: tuple[str, str], entry: Entry) -> None:
+        self._writes += 1
+        self._pending[key] = entry
+        self._cache_put(key, entry)
+        if len(self._pending) >= self.batch_size:
+            self._flush_requested.set()
+
+    async def items(self, namespace: str, prefix: str = "") -> dict[str, Any]:
+        """All not expired entries of the namespace whose key starts with prefix"""
+        await self.flush()
+        await self.open()
+        return {key: pickle.loads(value) for key, value in await self._run(self._select_prefix, namespace, prefix)}
+
+    def namespace(self, namespace: str) -> "KeyValueStore":
+        return KeyValueStore(self, namespace)
+
+
+class KeyValueStore:
+    """Key value store of a single app
+
+    Values can be any picklable object. Writes are buffered, see Storage.
+    """
+
+    def __init__(self, storage: Storage, namespace: str) -> None:
+        self.storage = storage
+        self.namespace = namespace
+
+    async def get(self, key: str, default: Any = None) -> Any:
+        return await self.storage.get(self.namespace, key, default)
+
+    def set(self, key: str, value: Any, ttl: float | None = None) -> None:
+        """Set a value, optionally expiring after ttl seconds"""
+        self.storage.set(self.namespace, key, value, ttl)
+
+    def delete(self, key: str) -> None:
+        self.storage.delete(self.namespace, key)
+
+    async def items(self, prefix: str = "") -> dict[str, Any]:
+        return await self.storage.items(self.namespace, prefix)
+
+    async def flush(self) -> None:
+        await self.storage.flush()
+
+
+class KeyValuePersistence(BasePersistence[dict[Any, Any], dict[Any, Any], dict[Any, Any]]):
+    """python-telegram-bot persistence backed by a KeyValueStore
+
+    Enable it for an app by setting "persistence": true in its app config.
+    """
+
+    def __init__(
+        self, store: KeyValueStore, store_data: PersistenceInput | None = None, update_interval: float = 60
+    ) -> None:
+        super().__init__(store_data=store_data, update_interval=update_interval)
+        self.store = store
+
+    async def _get_mapping(self, kind: str) -> dict[int, dict[Any, Any]]:
+        return {int(key.rsplit(":", 1)[1]): value for key, value in (await self.store.items(f"ptb:{kind}:")).items()}
+
+    async def get_user_data(self) -> dict[int, dict[Any, Any]]:
+        return await self._get_mapping("user_data")
+
+    async def get_chat_data(self) -> dict[int, dict[Any, Any]]:
+        return await self._get_mapping("chat_data")
+
+    async def get_bot_data(self) -> dict[Any, Any]:
+        return await self.store.get("ptb:bot_data", {})  # type: ignore[no-any-return]
+
+    async def get_callback_data(self) -> CDCData | None:
+        return await self.store.get("ptb:callback_data")  # type: ignore[no-any-return]
+
+    async def get_conversations(self, name: str) -> ConversationDict:
+        return await self.store.get(f"ptb:conversations:{name}", {})  # type: ignore[no-any-return]
+
+    async def update_conversation(self, name: str, key: ConversationKey, new_state: object | None) -> None:
+        conversations = await self.get_conversations(name)
+        if new_state is None:
+            conversations.pop(key, None)
+        else:
+            conversations[key] = new_state
+        self.store.set(f"ptb:conversations:{name}", conversations)
+
+    async def update_user_data(self, user_id: int, data: dict[Any, Any]) -> None:
+        self.store.set(f"ptb:user_data:{user_id}", data)
+
+    async def update_chat_data(self, chat_id: int, data: dict[Any, Any]) -> None:
+        self.store.set(f"ptb:chat_data:{chat_id}", data)
+
+    async def update_bot_data(self, data: dict[Any, Any]) -> None:
+        self.store.set("ptb:bot_data", data)
+
+    async def update_callback_data(self, data: CDCData) -> None:
+        self.store.set("ptb:callback_data", data)
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self.store.delete(f"ptb:chat_data:{chat_id}")
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self.store.delete(f"ptb:user_data:{user_id}")
+
+    async def refresh_user_data(self, user_id: int, user_data: dict[Any, Any]) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict[Any, Any]) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict[Any, Any]) -> None:
+        pass
+
+    async def flush(self) -> None:
+        await self.store.flush()
@@ -0,0 +1,353 @@
+import asyncio
+import collections
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, TypedDict
+
+from telegram import Update
+from telegram.ext import Application, BaseHandler
+from telegram.request import HTTPXRequest
+from telegram.request._requestdata import RequestData
+
+from bots.log import RotatingFile
+from bots.utils import json
+
+# OpenTelemetry span kinds
+KIND_INTERNAL = 1
+KIND_CLIENT = 3
+
+# OpenTelemetry status codes
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+# Innermost span of the current task, None if the update isn't traced
+current_span: ContextVar["Span | None"] = ContextVar("current_span", default=None)
+
+
+class SpanSummary(TypedDict):
+    name: str
+    depth: int
+    # Milliseconds since the start of the trace
+    offset: float
+    duration: float
+    error: str | None
+
+
+class TraceSummary(TypedDict):
+    trace_id: str
+    update: str
+    start: float
+    # Milliseconds
+    duration: float
+    spans: list[SpanSummary]
+
+
+class Span:
+    """A timed operation of a traced update, times are unix nanoseconds"""
+
+    __slots__ = ("trace", "span_id", "parent", "name", "kind", "start", "end", "attributes", "error")
+
+    def __init__(
+        self,
+        trace: "Trace",
+        name: str,
+        parent: "Span | None" = None,
+        kind: int = KIND_INTERNAL,
+        start: int | None = None,
+    ) -> None:
+        self.trace = trace
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent = parent
+        self.name = name
+        self.kind = kind
+        self.start = start or time.time_ns()
+        self.end: int | None = None
+        self.attributes: dict[str, str | int | float | bool] = {}
+        self.error: str | None = None
+
+    @property
+    def duration(self) -> float:
+        """Milliseconds, up to now if not finished"""
+        return ((self.end or time.time_ns()) - self.start) / 1e6
+
+    @property
+    def depth(self) -> int:
+        depth, parent = 0, self.parent
+        while parent:
+            depth, parent = depth + 1, parent.parent
+        return depth
+
+    def child(self, name: str, kind: int = KIND_INTERNAL, start: int | None = None) -> "Span":
+        return Span(self.trace, name, self, kind, start)
+
+    def finish(self, end: int | None = None) -> None:
+        if self.end is not None:
+            return
+        self.end = end or time.time_ns()
+        self.trace.spans.append(self)
+        if self.parent is None:
+            self.trace.tracer.record(self.trace)
+
+    def to_otlp(self) -> dict[str, Any]:
+        span: dict[str, Any] = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start),
+            "endTimeUnixNano": str(self.end),
+            "attributes": [{"key": key, "value": otlp_value(value)} for key, value in self.attributes.items()],
+            "status": {"code": STATUS_ERROR, "message": self.error} if self.error else {"code": STATUS_OK},
+        }
+        if self.parent:
+            span["parentSpanId"] = self.parent.span_id
+        return span
+
+
+def otlp_value(value: str | int | float | bool) -> dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        # 64 bit integers are strings in OTLP JSON
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": value}
+
+
+class Trace:
+    """The spans of a single update"""
+
+    __slots__ = ("tracer", "trace_id", "root", "spans")
+
+    def __init__(self, tracer: "Tracer", name: str, start: int) -> None:
+        self.tracer = tracer
+        self.trace_id = os.urandom(16).hex()
+        self.spans: list[Span] = []
+        self.root = Span(self, name, start=start)
+
+    def summary(self) -> TraceSummary:
+        spans: list[SpanSummary] = []
+        for span in sorted(self.spans, key=lambda span: (span.start, span.depth)):
+            spans.append(
+                SpanSummary(
+                    name=span.name,
+                    depth=span.depth,
+                    offset=(span.start - self.root.start) / 1e6,
+                    duration=span.duration,
+                    error=span.error,
+                )
+            )
+        return TraceSummary(
+            trace_id=self.trace_id,
+            update=self.root.name,
+            start=self.root.start / 1e9,
+            duration=self.root.duration,
+            spans=spans,
+        )
+
+
+class span:
+    """Trace the block as child of the current span, does nothing if the update isn't traced
+
+    with span("download", size=len(data)):
+        ...
+    """
+
+    __slots__ = ("name", "kind", "attributes", "span", "token")
+
+    def __init__(self, name: str, kind: int = KIND_INTERNAL, **attributes: str | int | float | bool) -> None:
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes
+        self.span: Span | None = None
+
+    def __enter__(self) -> Span | None:
+        if (parent := current_span.get()) is None:
+            return None
+        self.span = parent.child(self.name, self.kind)
+        self.span.attributes.update(self.attributes)
+        self.token = current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, error_type: type[BaseException] | None, error: BaseException | None, _: Any) -> None:
+        if self.span is None:
+            return
+        current_span.reset(self.token)
+        if error_type is asyncio.CancelledError:
+            self.span.error = "Cancelled"
+        elif error is not None:
+            self.span.error = f"{error_type.__name__ if error_type else 'Error'}: {error}"
+        self.span.finish()
+
+
+class TraceExporter:
+    """Write finished traces as OTLP JSON lines (one ExportTraceServiceRequest per line)
+
+    The format is the one of the OpenTelemetry collector's file exporter, so
+    the files can be imported with its otlpjsonfile receiver. Serialising and
+    writing happen on a background thread.
+    """
+
+    def __init__(self, path: Path, max_bytes: int, interval: float, backups: int) -> None:
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="trace-exporter")
+        self.file = RotatingFile(path, max_bytes, interval, backups, self.writer)
+
+    def export(self, service: str, trace: Trace) -> None:
+        self.writer.submit(self._write, service, trace)
+
+    def _write(self, service: str, trace: Trace) -> None:
+        request = {
+            "resourceSpans": [
+                {
+                    "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service}}]},
+                    "scopeSpans": [
+                        {"scope": {"name": "bot_manager"}, "spans": [span.to_otlp() for span in trace.spans]}
+                    ],
+                }
+            ]
+        }
+        self.file.write(json.dumpb(request) + b"\n")
+
+    def close(self) -> None:
+        self.writer.submit(self.file.close)
+        self.writer.shutdown(wait=True)
+
+
+class Tracer:
+    """Samples the updates of an app and keeps its recent traces
+
+    A sampled update gets a trace with the spans:
+        - update: from receiving the update to the end of its processing
+        - received: waiting in the update queue until admitted by the update processor
+        - queued: waiting for its turn (chat order, concurrency)
+        - dispatch: PTB's process_update(), with a "filter" span per checked
+          handler and a "handler" span for the handlers that handled it
+        - bot_api: every Bot API request made while processing the update
+    """
+
+    def __init__(self, service: str, sample_rate: float, exporter: TraceExporter | None, history: int = 200) -> None:
+        self.service = service
+        self.sample_rate = sample_rate
+        self.exporter = exporter
+        self.recent: collections.deque[TraceSummary] = collections.deque(maxlen=history)
+
+    def start_trace(self, update: object, received: int | None) -> Span | None:
+        """The root span of the update if it is sampled, received is the unix ns it was received at"""
+        if not self.sample_rate or random.random() >= self.sample_rate:
+            return None
+
+        name = "update"
+        if isinstance(update, Update):
+            update_type = next((key for key in update.to_dict() if key != "update_id"), "unknown")
+            name = f"update {update_type}"
+
+        now = time.time_ns()
+        root = Trace(self, name, received or now).root
+        if isinstance(update, Update):
+            root.attributes["telegram.update_id"] = update.update_id
+            if update.effective_chat:
+                root.attributes["telegram.chat_id"] = update.effective_chat.id
+        root.child("received", start=root.start).finish(now)
+        return root
+
+    def record(self, trace: Trace) -> None:
+        self.recent.append(trace.summary())
+        if self.exporter:
+            self.exporter.export(self.service, trace)
+
+    def slowest(self, limit: int = 10) -> list[TraceSummary]:
+        return sorted(self.recent, key=lambda trace: trace["duration"], reverse=True)[:limit]
+
+    def instrument(self, application: Application[Any, Any, Any, Any, Any, Any]) -> None:
+        """Trace the filters and handlers of all handlers registered so far"""
+        for handlers in application.handlers.values():
+            for handler in handlers:
+                traced = traced_handler_class(type(handler))
+                if type(handler) is not traced:
+                    handler.__class__ = traced
+
+
+def _handler_name(handler: BaseHandler[Any, Any]) -> str:
+    callback = getattr(handler, "callback", None)
+    return getattr(callback, "__qualname__", None) or type(handler).__name__
+
+
+_traced_classes: dict[type[BaseHandler[Any, Any]], type[BaseHandler[Any, Any]]] = {}
+
+
+def traced_handler_class(cls: type[BaseHandler[Any, Any]]) -> type[BaseHandler[Any, Any]]:
+    """Subclass of a handler class that adds filter and handler spans to traced updates
+
+    Instances of the class can be switched to it (same slots), isinstance()
+    checks on them keep working.
+    """
+    if cls in _traced_classes.values():
+        return cls
+    if (traced := _traced_classes.get(cls)) is not None:
+        return traced
+
+    class TracedHandler(cls):  # type: ignore[valid-type,misc]
+        __slots__ = ()
+
+        def check_update(self, update: object) -> Any:
+            if current_span.get() is None:
+                return super().check_update(update)
+            with span(f"filter {_handler_name(self)}"):
+                return super().check_update(update)
+
+        async def handle_update(self, *args: Any, **kwargs: Any) -> Any:
+            with span(f"handler {_handler_name(self)}"):
+                return await super().handle_update(*args, **kwargs)
+
+    TracedHandler.__module__ = cls.__module__
+    TracedHandler.__name__ = cls.__name__
+    TracedHandler.__qualname__ = cls.__qualname__
+    _traced_classes[cls] = TracedHandler
+    return TracedHandler
+
+
+class TracingRequest(HTTPXRequest):
+    """Adds a bot_api span for every request made while processing a traced update"""
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: RequestData | None = None,
+        *args: Any,
+        **kwargs: Any,
+    ) -> tuple[int, bytes]:
+        if current_span.get() is None:
+            return await super().do_request(url, method, request_data, *args, **kwargs)
+        # The url contains the token, only the method name is recorded
+        with span(f"bot_api {url.rsplit('/', 1)[-1]}", KIND_CLIENT) as current:
+            code, payload = await super().do_request(url, method, request_data, *args, **kwargs)
+            if current:
+                current.attributes["http.status_code"] = code
+            return code, payload
+
+
+class TimedUpdateQueue(asyncio.Queue[object]):
+    """Update queue that remembers when the update taken last was put in
+
+    PTB hands updates to the update processor right after taking them from
+    the queue, so there last_put_time is the receive time of the update.
+    """
+
+    def _init(self, maxsize: int) -> None:
+        super()._init(maxsize)
+        self._put_times: collections.deque[int] = collections.deque()
+        self.last_put_time: int | None = None
+
+    def _put(self, item: object) -> None:
+        super()._put(item)
+        self._put_times.append(time.time_ns())
+
+    def _get(self) -> object:
+        self.last_put_time = self._put_times.popleft()
+        return super()._get()
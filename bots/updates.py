@@ -0,0 +1,389 @@
+import asyncio
+import heapq
+import itertools
+import time
+from logging import getLogger
+from typing import Any, Awaitable, Coroutine, Hashable, Literal, TypedDict
+
+from telegram import MessageEntity, Update
+from telegram.ext import Application, BaseUpdateProcessor
+
+from bots.tracing import Span, TimedUpdateQueue, Tracer, current_span, span
+
+logger = getLogger("updates")
+
+OverflowPolicy = Literal["wait", "drop"]
+
+# Lower is processed first
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+
+
+class UpdateProcessorStats(TypedDict):
+    concurrency: int
+    processed: int
+    running: int
+    queued: int
+    max_queued: int
+    wait_time_avg: float
+    wait_time_max: float
+    shed: dict[str, int]
+    backpressure_time: float
+    last_update_id: int | None
+    last_update_time: float | None
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Process updates of different chats concurrently
+
+    Updates of the same chat (or the same user for updates without chat)
+    are processed strictly in the order they were received. At most
+    concurrency updates are processed at the same time.
+
+    Updates waiting for their turn don't count towards the concurrency, so
+    a flood of updates in one chat doesn't block the other chats.
+
+    Admission control:
+        - At most max_size updates wait to be processed. When full, the
+          "wait" overflow policy stops taking updates from the update queue
+          (and so eventually stops polling), "drop" sheds new updates.
+        - With prioritise, commands and callback queries get a free slot
+          before other updates and priority_reserve of max_size is kept
+          free for them.
+        - Updates older than max_age seconds are shed, optionally answered
+          with max_age_reply.
+
+    With a tracer, sampled updates get a trace (see Tracer), update_queue is
+    used to know when they were received. activity is set whenever an update
+    is taken or done (see StatusMonitor).
+    """
+
+    __slots__ = (
+        "concurrency",
+        "max_size",
+        "overflow",
+        "prioritise",
+        "priority_reserve",
+        "max_age",
+        "max_age_reply",
+        "tracer",
+        "update_queue",
+        "activity",
+        "_chat_tails",
+        "_slot_waiters",
+        "_sequence",
+        "_space",
+        "_tasks",
+        "processed",
+        "running",
+        "queued",
+        "max_queued",
+        "wait_time_avg",
+        "wait_time_max",
+        "shed",
+        "backpressure_time",
+        "last_update_id",
+        "last_update_time",
+    )
+
+    # Weight of the latest wait time in the moving average
+    wait_time_smoothing = 0.1
+
+    def __init__(
+        self,
+        concurrency: int = 1,
+        max_size: int | None = None,
+        overflow: OverflowPolicy = "wait",
+        prioritise: bool = True,
+        priority_reserve: float = 0.1,
+        max_age: float | None = None,
+        max_age_reply: str | None = None,
+        tracer: Tracer | None = None,
+        update_queue: TimedUpdateQueue | None = None,
+        activity: asyncio.Event | None = None,
+    ) -> None:
+        # PTB awaits admission of each update before fetching the next one,
+        # the actual processing happens in our own tasks
+        super().__init__(max_concurrent_updates=1)
+        if max_size is not None and max_size < 1:
+            # Nothing would ever be admitted
+            raise ValueError("max_size must be at least 1")
+        self.concurrency = concurrency
+        self.max_size = max_size
+        self.overflow = overflow
+        self.prioritise = prioritise
+        self.priority_reserve = priority_reserve
+        self.max_age = max_age
+        self.max_age_reply = max_age_reply
+        self.tracer = tracer
+        self.update_queue = update_queue
+        self.activity = activity
+
+        self._chat_tails: dict[Hashable, asyncio.Future[None]] = {}
+        self._slot_waiters: list[tuple[int, int, asyncio.Future[None]]] = []
+        self._sequence = itertools.count()
+        self._space = asyncio.Event()
+        self._tasks: set[asyncio.Task[None]] = set()
+
+        self.processed = 0
+        self.running = 0
+        self.queued = 0
+        self.max_queued = 0
+        self.wait_time_avg = 0.0
+        self.wait_time_max = 0.0
+        self.shed: dict[str, int] = {}
+        self.backpressure_time = 0.0
+        # Of the latest update taken from the update queue, including shed ones
+        self.last_update_id: int | None = None
+        self.last_update_time: float | None = None
+
+    @staticmethod
+    def ordering_key(update: object) -> Hashable | None:
+        """Updates with the same key are processed in order, None for no ordering"""
+        if isinstance(update, Update):
+            if update.effective_chat:
+                return ("chat", update.effective_chat.id)
+            if update.effective_user:
+                return ("user", update.effective_user.id)
+        return None
+
+    @staticmethod
+    def priority(update: object) -> int:
+        """Commands and callback queries are interactive and get processed first"""
+        if isinstance(update, Update):
+            if update.callback_query or update.inline_query:
+                return PRIORITY_HIGH
+            if (message := update.message) and message.entities:
+                entity = message.entities[0]
+                if entity.type == MessageEntity.BOT_COMMAND and entity.offset == 0:
+                    return PRIORITY_HIGH
+        return PRIORITY_NORMAL
+
+    @staticmethod
+    def age(update: object, received: float) -> float:
+        """Seconds since the update was sent, received is its time.time() of admission"""
+        now = time.time()
+        if isinstance(update, Update) and not update.callback_query and (message := update.effective_message):
+            return now - (message.edit_date or message.date).timestamp()
+        return now - received
+
+    def capacity(self, priority: int) -> int | None:
+        if self.max_size is None:
+            return None
+        if priority == PRIORITY_HIGH:
+            return self.max_size
+        return max(1, int(self.max_size * (1 - self.priority_reserve)))
+
+    # =========
+    # ADMISSION
+    # =========
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        received = time.time()
+        self.last_update_time = received
+        if self.activity:
+            self.activity.set()
+        if isinstance(update, Update):
+            self.last_update_id = max(update.update_id, self.last_update_id or 0)
+        priority = self.priority(update) if self.prioritise else PRIORITY_NORMAL
+
+        if self.max_age is not None and self.age(update, received) > self.max_age:
+            self._shed(update, coroutine, "expired")
+            return
+
+        limit = self.capacity(priority)
+        if limit is not None and self.queued >= limit:
+            if self.overflow == "drop":
+                self._shed(update, coroutine, "overflow")
+                return
+            # Blocking here stops PTB from taking further updates off its queue
+            started = time.monotonic()
+            try:
+                while self.queued >= limit:
+                    self._space.clear()
+                    await self._space.wait()
+            except asyncio.CancelledError:
+                self._close(coroutine)
+                raise
+            finally:
+                self.backpressure_time += time.monotonic() - started
+
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+
+        trace = None
+        if self.tracer:
+            trace = self.tracer.start_trace(update, self.update_queue.last_put_time if self.update_queue else None)
+
+        # Chain ourselves behind the previous update of the same chat
+        predecessor = done = None
+        if (key := self.ordering_key(update)) is not None:
+            predecessor = self._chat_tails.get(key)
+            self._chat_tails[key] = done = asyncio.get_running_loop().create_future()
+
+        self._spawn(self._process(update, coroutine, priority, received, key, predecessor, done, trace))
+
+    async def _process(
+        self,
+        update: object,
+        coroutine: Awaitable[Any],
+        priority: int,
+        received: float,
+        key: Hashable | None,
+        predecessor: asyncio.Future[None] | None,
+        done: asyncio.Future[None] | None,
+        trace: Span | None,
+    ) -> None:
+        # Runs in its own task, so this only affects this update
+        current_span.set(trace)
+        waiting = True
+        try:
+            with span("queued"):
+                if predecessor:
+                    await asyncio.shield(predecessor)
+                await self._acquire_slot(priority)
+            try:
+                waiting = False
+                self._dequeue()
+                self._record_wait(time.time() - received)
+
+                if self.max_age is not None and self.age(update, received) > self.max_age:
+                    self._shed(update, coroutine, "expired")
+                    if trace:
+                        trace.attributes["shed"] = "expired"
+                else:
+                    try:
+                        with span("dispatch"):
+                            await coroutine
+                    finally:
+                        self.processed += 1
+                        if self.activity:
+                            self.activity.set()
+            finally:
+                self._release_slot()
+        finally:
+            if trace:
+                trace.finish()
+            if waiting:
+                # Cancelled before processing started
+                self._dequeue()
+                self._close(coroutine)
+            if done:
+                done.set_result(None)
+                if self._chat_tails.get(key) is done:
+                    del self._chat_tails[key]
+
+    def _dequeue(self) -> None:
+        self.queued -= 1
+        self._space.set()
+
+    async def _acquire_slot(self, priority: int) -> None:
+        if self.running < self.concurrency and not self._slot_waiters:
+            self.running += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._slot_waiters, (priority, next(self._sequence), future))
+        try:
+            # The releasing update hands its slot over by resolving the future
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release_slot()
+            raise
+
+    def _release_slot(self) -> None:
+        while self._slot_waiters:
+            *_, future = heapq.heappop(self._slot_waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.running -= 1
+
+    # ========
+    # SHEDDING
+    # ========
+
+    def _shed(self, update: object, coroutine: Awaitable[Any], reason: str) -> None:
+        self._close(coroutine)
+        self.shed[reason] = self.shed.get(reason, 0) + 1
+        logger.debug(f"Shed update ({reason}): {update}")
+
+        if reason == "expired" and self.max_age_reply and isinstance(update, Update):
+            self._spawn(self._reply(update, self.max_age_reply))
+
+    @staticmethod
+    async def _reply(update: Update, text: str) -> None:
+        if update.callback_query:
+            await update.callback_query.answer(text)
+        elif update.message:
+            await update.message.reply_text(text)
+
+    @staticmethod
+    def _close(coroutine: Awaitable[Any]) -> None:
+        if asyncio.iscoroutine(coroutine):
+            coroutine.close()
+
+    # =====
+    # TASKS
+    # =====
+
+    def _spawn(self, coroutine: Coroutine[Any, Any, None]) -> None:
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._task_done)
+
+    def _task_done(self, task: asyncio.Task[None]) -> None:
+        self._tasks.discard(task)
+        if not task.cancelled() and (error := task.exception()):
+            logger.error(f"Processing update failed: {error}", exc_info=error)
+
+    async def join(self) -> None:
+        """Wait until all admitted updates have been processed"""
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _record_wait(self, wait_time: float) -> None:
+        self.wait_time_avg += (wait_time - self.wait_time_avg) * self.wait_time_smoothing
+        self.wait_time_max = max(self.wait_time_max, wait_time)
+
+    def stats(self) -> UpdateProcessorStats:
+        return UpdateProcessorStats(
+            concurrency=self.concurrency,
+            processed=self.processed,
+            running=self.running,
+            queued=self.queued,
+            max_queued=self.max_queued,
+            wait_time_avg=self.wait_time_avg,
+            wait_time_max=self.wait_time_max,
+            shed=dict(self.shed),
+            backpressure_time=self.backpressure_time,
+            last_update_id=self.last_update_id,
+            last_update_time=self.last_update_time,
+        )
+
+    async def initialize(self) -> None:
+        pass
+
+    async def cancel(self) -> None:
+        """Cancel all admitted updates"""
+        for task in self._tasks:
+            task.cancel()
+        await self.join()
+
+    async def shutdown(self) -> None:
+        await self.cancel()
+
+
+class CountingApplication(Application[Any, Any, Any, Any, Any, Any]):
+    """PTB application counting the errors of its handlers and jobs"""
+
+    __slots__ = ("errors",)
+
+    def __init__(self, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.errors = 0
+
+    async def process_error(self, *args: Any, **kwargs: Any) -> bool:
+        self.errors += 1
+        return await super().process_error(*args, **kwargs)
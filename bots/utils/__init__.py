@@ -1,14 +1,43 @@
-from .fastapi import Namespace
-from .misc import async_throttled_iterator, get_arg_value, safe_error, stabelise_string
-from .pydantic import JsonSerialisableData, serialise, serialise_model
+from typing import TYPE_CHECKING, Any
+
+from . import json
+from .markdown import MarkdownV2, escape_markdown
+from .misc import async_throttled_iterator, get_arg_value, merge_async_iterators, safe_error, stabelise_string
+from .pydantic import (
+    JsonSerialisableData,
+    invalidate_model_caches,
+    model_schema,
+    per_model_cache,
+    serialise,
+    serialise_model,
+)
+
+if TYPE_CHECKING:
+    from .fastapi import Namespace
 
 __all__ = [
     "Namespace",
+    "MarkdownV2",
+    "escape_markdown",
     "async_throttled_iterator",
     "get_arg_value",
+    "merge_async_iterators",
     "safe_error",
     "stabelise_string",
     "JsonSerialisableData",
     "serialise",
     "serialise_model",
+    "invalidate_model_caches",
+    "model_schema",
+    "per_model_cache",
+    "json",
 ]
+
+
+def __getattr__(name: str) -> Any:
+    # Imports FastAPI and socketio, only needed by the server
+    if name == "Namespace":
+        from .fastapi import Namespace
+
+        return Namespace
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,20 +1,83 @@
-from typing import Any
+import logging
+from typing import Any, Iterable
 
 from fastapi import APIRouter, FastAPI
 from socketio import AsyncNamespace
 
-from bots.log import logger
+logger = logging.getLogger("bot_manager")
 
 
 class Namespace(AsyncNamespace):
+    """Socket.IO namespace with topic subscriptions
+
+    Clients subscribe to topics with the "subscribe" and "unsubscribe"
+    events ({"topics": [...]}), each topic is a Socket.IO room. New clients
+    are subscribed to default_topics. Events emitted with topics only go to
+    the subscribers of these topics and are skipped entirely if there are
+    none.
+    """
+
+    default_topics: tuple[str, ...] = ()
+
     def __init__(self, namespace: str | None = None) -> None:
         super().__init__(namespace or getattr(self, "namespace"))
+        self.subscribers: dict[str, set[str]] = {}
+        self.subscriptions: dict[str, set[str]] = {}
 
     async def on_connect(self, sid: str, environ: dict[str, str]) -> None:
         logger.info(f"{self.namespace} client connected: {sid}")
+        await self.subscribe(sid, self.default_topics)
 
     async def on_disconnect(self, sid: str) -> None:
         logger.info(f"{self.namespace} client disconnected: {sid}")
+        await self.unsubscribe(sid, self.subscriptions.get(sid, ()))
+        self.subscriptions.pop(sid, None)
+
+    # =============
+    # SUBSCRIPTIONS
+    # =============
+
+    def valid_topic(self, topic: str) -> bool:
+        return True
+
+    async def subscribe(self, sid: str, topics: Iterable[str]) -> None:
+        for topic in topics:
+            self.subscribers.setdefault(topic, set()).add(sid)
+            self.subscriptions.setdefault(sid, set()).add(topic)
+            await self.enter_room(sid, topic)
+
+    async def unsubscribe(self, sid: str, topics: Iterable[str]) -> None:
+        for topic in list(topics):
+            if (sids := self.subscribers.get(topic)) is not None:
+                sids.discard(sid)
+                if not sids:
+                    del self.subscribers[topic]
+            self.subscriptions.get(sid, set()).discard(topic)
+            await self.leave_room(sid, topic)
+
+    def has_subscribers(self, topics: Iterable[str]) -> bool:
+        return any(topic in self.subscribers for topic in topics)
+
+    def has_receivers(self, sid: str | None, topics: Iterable[str] | None) -> bool:
+        """Whether emit_default() with sid and topics reaches anyone
+
+        Check it before building expensive payloads. sid only counts while
+        the client is connected.
+        """
+        if topics is None:
+            return True
+        return (sid is not None and sid in self.subscriptions) or self.has_subscribers(topics)
+
+    async def on_subscribe(self, sid: str, data: dict[str, Any]) -> None:
+        topics = data.get("topics") or []
+        if invalid := [topic for topic in topics if not self.valid_topic(topic)]:
+            return await self.emit_error("subscribe", f"Unknown topics: {', '.join(invalid)}", sid=sid)
+        await self.subscribe(sid, topics)
+        await self.emit_success("subscribe", None, {"topics": sorted(self.subscriptions.get(sid, ()))}, sid=sid)
+
+    async def on_unsubscribe(self, sid: str, data: dict[str, Any]) -> None:
+        await self.unsubscribe(sid, data.get("topics") or [])
+        await self.emit_success("unsubscribe", None, {"topics": sorted(self.subscriptions.get(sid, ()))}, sid=sid)
 
     async def trigger_event(self, event: str, *args: Any) -> Any:
         logger.info(f"Request received for {event} with args: {args[0]}")
@@ -24,10 +87,23 @@ class Namespace(AsyncNamespace):
         self,
         event: str,
         status: str,
-        message: str,
+        message: str | None,
         data: list[Any] | dict[str, Any] | None = None,
         sid: str | None = None,
+        topics: Iterable[str] | None = None,
     ) -> None:
+        """Emit to sid and the subscribers of topics, to everyone if neither is given
+
+        With topics, sid is skipped if the client disconnected in the meantime.
+        """
+        room: str | list[str] | None = sid
+        if topics is not None:
+            room = [topic for topic in topics if topic in self.subscribers]
+            if sid and sid in self.subscriptions:
+                room.append(sid)
+            if not room:
+                return
+
         await self.emit(
             event,
             {
@@ -35,35 +111,38 @@ class Namespace(AsyncNamespace):
                 "message": message if message else "An error occurred" if status == "error" else None,
                 "data": data,
             },
-            room=sid,
+            room=room,
         )
 
     async def emit_success(
         self,
         event: str,
-        message: str,
+        message: str | None,
         data: list[Any] | dict[str, Any] | None = None,
         sid: str | None = None,
+        topics: Iterable[str] | None = None,
     ) -> None:
-        await self.emit_default(event, "success", message, data, sid)
+        await self.emit_default(event, "success", message, data, sid, topics)
 
     async def emit_error(
         self,
         event: str,
-        message: str,
+        message: str | None,
         data: list[Any] | dict[str, Any] | None = None,
         sid: str | None = None,
+        topics: Iterable[str] | None = None,
     ) -> None:
-        await self.emit_default(event, "error", message, data, sid)
+        await self.emit_default(event, "error", message, data, sid, topics)
 
     async def emit_warning(
         self,
         event: str,
-        message: str,
+        message: str | None,
         data: list[Any] | dict[str, Any] | None = None,
         sid: str | None = None,
+        topics: Iterable[str] | None = None,
     ) -> None:
-        await self.emit_default(event, "warning", message, data, sid)
+        await self.emit_default(event, "warning", message, data, sid, topics)
 
 
 def remove_routes(prefix: str, router: APIRouter, app: FastAPI) -> None:
@@ -0,0 +1,38 @@
+from typing import Any
+
+import orjson
+from pydantic_core import PydanticUndefined, to_jsonable_python
+
+
+def _default(obj: Any) -> Any:
+    if obj is PydanticUndefined:
+        return None
+    return to_jsonable_python(obj)
+
+
+def dumpb(obj: Any, *, indent: bool = False, sort_keys: bool = False, non_str_keys: bool = True) -> bytes:
+    """Serialise obj to JSON bytes using orjson
+
+    Unknown types (paths, models, etc.) are converted via pydantic. Non
+    string dict keys are converted to strings, unless non_str_keys is False
+    and they raise a TypeError instead.
+    """
+    options = orjson.OPT_NON_STR_KEYS if non_str_keys else 0
+    if indent:
+        options |= orjson.OPT_INDENT_2
+    if sort_keys:
+        options |= orjson.OPT_SORT_KEYS
+    return orjson.dumps(obj, default=_default, option=options)
+
+
+def dumps(obj: Any, *, indent: bool = False, sort_keys: bool = False, **_: Any) -> str:
+    """Serialise obj to a JSON string
+
+    Extra keyword arguments (like "separators" passed by socketio) are
+    ignored, so this module can be used as a drop in "json" replacement.
+    """
+    return dumpb(obj, indent=indent, sort_keys=sort_keys).decode()
+
+
+def loads(data: str | bytes, **_: Any) -> Any:
+    return orjson.loads(data)
@@ -0,0 +1,153 @@
+from typing import TYPE_CHECKING, Any, Iterator
+
+if TYPE_CHECKING:
+    from telegram import Bot, Message
+
+# telegram.constants.MessageLimit.MAX_TEXT_LENGTH, not imported to keep bots.utils light
+MAX_TEXT_LENGTH = 4096
+
+# Characters escaped per entity type, see stabelise_string()
+ESCAPE_CHARS = {
+    "": r"\[]()~>#+-=|{}.!",
+    "all": r"\_*[]()~`>#+-=|{}.!",
+    "pre": r"\`",
+    "code": r"\`",
+    "text_link": r"\)",
+}
+
+ESCAPE_TABLES = {
+    entity_type: str.maketrans({char: "\\" + char for char in chars}) for entity_type, chars in ESCAPE_CHARS.items()
+}
+
+
+def escape_markdown(text: str, entity_type: str = "") -> str:
+    """Escape text for MarkdownV2, entity_type "all" escapes all markup"""
+    return text.translate(ESCAPE_TABLES.get(entity_type, ESCAPE_TABLES[""]))
+
+
+class MarkdownV2:
+    """Build a MarkdownV2 message, escaping each part with a precomputed table
+
+    message = MarkdownV2().bold("Status").text(f": {status}\\n").pre(log, "python")
+    await message.send(bot, chat_id)
+
+    Parts are kept as (opening markup, escaped text, closing markup) and only
+    joined once by build(). split() breaks long messages into chunks of at
+    most MAX_TEXT_LENGTH characters, preferably at line breaks.
+    Entities split across chunks are closed and reopened, so code blocks stay
+    code blocks in every chunk. The length of the markup counts as well, so
+    the chunks may be shorter than necessary but are never too long.
+    """
+
+    __slots__ = ("_parts",)
+
+    def __init__(self) -> None:
+        # (opening markup, escaped text, closing markup, splittable)
+        self._parts: list[tuple[str, str, str, bool]] = []
+
+    def _add(self, prefix: str, text: str, suffix: str, entity_type: str = "all") -> "MarkdownV2":
+        self._parts.append((prefix, text.translate(ESCAPE_TABLES[entity_type]), suffix, True))
+        return self
+
+    def text(self, text: str) -> "MarkdownV2":
+        return self._add("", text, "")
+
+    def bold(self, text: str) -> "MarkdownV2":
+        return self._add("*", text, "*")
+
+    def italic(self, text: str) -> "MarkdownV2":
+        # The trailing \r separates the closing _ from an adjacent __ (underline)
+        return self._add("_", text, "_\r")
+
+    def underline(self, text: str) -> "MarkdownV2":
+        return self._add("__", text, "__")
+
+    def strikethrough(self, text: str) -> "MarkdownV2":
+        return self._add("~", text, "~")
+
+    def spoiler(self, text: str) -> "MarkdownV2":
+        return self._add("||", text, "||")
+
+    def code(self, text: str) -> "MarkdownV2":
+        return self._add("`", text, "`", "code")
+
+    def pre(self, text: str, language: str = "") -> "MarkdownV2":
+        return self._add(f"```{language}\n", text, "\n```", "pre")
+
+    def link(self, text: str, url: str) -> "MarkdownV2":
+        return self._add("[", text, f"]({escape_markdown(url, 'text_link')})")
+
+    def mention(self, text: str, user_id: int) -> "MarkdownV2":
+        return self.link(text, f"tg://user?id={user_id}")
+
+    def raw(self, markdown: str) -> "MarkdownV2":
+        """Add already formatted MarkdownV2, it is never split"""
+        self._parts.append(("", markdown, "", False))
+        return self
+
+    def build(self) -> str:
+        return "".join(part for prefix, text, suffix, _ in self._parts for part in (prefix, text, suffix))
+
+    def __str__(self) -> str:
+        return self.build()
+
+    def __len__(self) -> int:
+        return sum(len(prefix) + len(text) + len(suffix) for prefix, text, suffix, _ in self._parts)
+
+    def split(self, limit: int = MAX_TEXT_LENGTH) -> list[str]:
+        return list(self._split(limit))
+
+    def _split(self, limit: int) -> Iterator[str]:
+        chunk: list[str] = []
+        size = 0
+        for prefix, text, suffix, splittable in self._parts:
+            markup = len(prefix) + len(suffix)
+            if chunk and size + markup + len(text) > limit:
+                # Parts that have to be split anyway fill up the chunk, unless it's almost full
+                if markup + len(text) <= limit or not splittable or limit - size - markup < limit // 8:
+                    yield "".join(chunk)
+                    chunk, size = [], 0
+
+            while size + markup + len(text) > limit:
+                if not splittable:
+                    raise ValueError(f"Raw markdown of {len(text)} characters doesn't fit into a message")
+                end, start = _split_point(text, limit - size - markup)
+                if end <= 0:
+                    raise ValueError(f"Message limit of {limit} characters is too small")
+                chunk += (prefix, text[:end], suffix)
+                yield "".join(chunk)
+                chunk, size = [], 0
+                text = text[start:]
+
+            chunk += (prefix, text, suffix)
+            size += markup + len(text)
+
+        if chunk:
+            yield "".join(chunk)
+
+    async def send(self, bot: "Bot", chat_id: int | str, **kwargs: Any) -> list["Message"]:
+        """Send the message, split into as many messages as necessary"""
+        return [await bot.send_message(chat_id, chunk, parse_mode="MarkdownV2", **kwargs) for chunk in self.split()]
+
+
+def _split_point(text: str, room: int) -> tuple[int, int]:
+    """Where to end the escaped text to fit into room and where to continue
+
+    Prefers line breaks, then spaces (both are dropped), never splits an
+    escape sequence.
+    """
+    for separator in ("\n", " "):
+        # Not too early, the chunk should still be reasonably filled
+        if (index := text.rfind(separator, room // 2, room + 1)) > 0:
+            end, start = index, index + 1
+            break
+    else:
+        end = start = room
+
+    # An odd number of backslashes before the end means the last one escapes the next character
+    backslashes = 0
+    while backslashes < end and text[end - backslashes - 1] == "\\":
+        backslashes += 1
+    if backslashes % 2:
+        end = start = end - 1
+    return end, start
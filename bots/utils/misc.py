@@ -2,8 +2,9 @@ import asyncio
 import functools
 import inspect
 import logging
-import re
-from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Callable, TypeVar
+from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Generic, TypeVar
+
+from .markdown import escape_markdown
 
 logger = logging.getLogger("bot_manager")
 
@@ -25,6 +26,38 @@ def get_arg_value(arg_name: str, func: Callable[..., Any], args: Any, kwargs: di
 T = TypeVar("T")
 
 
+class LazyObject(Generic[T]):
+    """Proxy creating the object with factory() on first attribute access
+
+    For module level objects that would otherwise do work (e.g. read the
+    config) on import:
+
+        app_manager: AppManager = LazyObject(AppManager)  # type: ignore[assignment]
+    """
+
+    __slots__ = ("_factory", "_object")
+
+    def __init__(self, factory: Callable[[], T]) -> None:
+        object.__setattr__(self, "_factory", factory)
+        object.__setattr__(self, "_object", None)
+
+    def _get(self) -> T:
+        if self._object is None:
+            object.__setattr__(self, "_object", self._factory())
+        return self._object  # type: ignore[return-value]
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._get(), name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self._get(), name, value)
+
+    def __repr__(self) -> str:
+        if self._object is None:
+            return f"<LazyObject {self._factory!r}>"
+        return repr(self._object)
+
+
 async def async_throttled_iterator(async_iterator: AsyncIterable[T], delay: float | int) -> AsyncIterator[T | None]:
     last_item: T | None = None
     item_available = asyncio.Event()
@@ -60,18 +93,36 @@ async def async_throttled_iterator(async_iterator: AsyncIterable[T], delay: floa
         await cleanup(consume_task)
 
 
+async def merge_async_iterators(*async_iterators: AsyncIterator[T]) -> AsyncIterator[T]:
+    """Yield the items of all iterators as soon as they are available"""
+    queue: asyncio.Queue[tuple[int, T | None]] = asyncio.Queue()
+
+    async def consume(index: int, async_iterator: AsyncIterator[T]) -> None:
+        try:
+            async for item in async_iterator:
+                await queue.put((index, item))
+        finally:
+            await queue.put((-1, None))
+
+    tasks = [asyncio.create_task(consume(index, iterator)) for index, iterator in enumerate(async_iterators)]
+    try:
+        remaining = len(tasks)
+        while remaining:
+            index, item = await queue.get()
+            if index == -1:
+                remaining -= 1
+            else:
+                yield item  # type: ignore[misc]
+        # Raise errors of the iterators
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
 def stabelise_string(text: str, entity_type: str = "") -> str:
     """Helper function to escape telegram markup symbols."""
-    if entity_type in ["pre", "code"]:
-        escape_chars = r"\`"
-    elif entity_type == "text_link":
-        escape_chars = r"\)"
-    elif entity_type == "all":
-        escape_chars = r"\_*[]()~`>#+-=|{}.!"
-    else:
-        escape_chars = r"\[]()~>#+-=|{}.!"
-
-    return re.sub(f"([{re.escape(escape_chars)}])", r"\\\1", text)
+    return escape_markdown(text, entity_type)
 
 
 def safe_error(func: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
@@ -1,8 +1,11 @@
-from typing import TYPE_CHECKING, Any, Optional, Union
+import functools
+from typing import TYPE_CHECKING, Any, Callable, Optional, TypeVar, Union
 
 from pydantic import BaseModel
 from pydantic_core import PydanticUndefined, to_jsonable_python
 
+from bots.utils import json
+
 if TYPE_CHECKING:
     from pydantic.typing import AbstractSetIntStr, MappingIntStrAny
 
@@ -10,6 +13,45 @@ JsonSerialisableData = Union[
     str, int, float, bool, None, dict[str, "JsonSerialisableData"], list["JsonSerialisableData"]
 ]
 
+T = TypeVar("T")
+
+_model_caches: list[dict[type[BaseModel], Any]] = []
+
+
+def per_model_cache(func: Callable[[type[BaseModel]], T]) -> Callable[[type[BaseModel]], T]:
+    """Cache the result of func per model class
+
+    The caches are dropped by invalidate_model_caches(), which the app manager
+    calls whenever it reloads an app module.
+    """
+    cache: dict[type[BaseModel], T] = {}
+    _model_caches.append(cache)
+
+    @functools.wraps(func)
+    def wrapper(model: type[BaseModel]) -> T:
+        try:
+            return cache[model]
+        except KeyError:
+            cache[model] = result = func(model)
+            return result
+
+    return wrapper
+
+
+def invalidate_model_caches(module_name: str | None = None) -> None:
+    """Drop cached data of all models or only of those defined in module_name"""
+    for cache in _model_caches:
+        if module_name is None:
+            cache.clear()
+            continue
+        for model in [model for model in cache if model.__module__ == module_name]:
+            del cache[model]
+
+
+@per_model_cache
+def model_schema(model: type[BaseModel]) -> dict[str, Any]:
+    return model.model_json_schema()
+
 
 def serialise_model(
     obj: BaseModel,
@@ -21,7 +63,8 @@ def serialise_model(
     exclude_defaults: bool = False,
     exclude_none: bool = False,
 ) -> JsonSerialisableData:
-    data = obj.model_dump(
+    return obj.model_dump(
+        mode="json",
         include=include,
         exclude=exclude,
         by_alias=by_alias,
@@ -29,15 +72,28 @@ def serialise_model(
         exclude_defaults=exclude_defaults,
         exclude_none=exclude_none,
     )
-    return serialise(data=data)
 
 
-def serialise(data: Any) -> JsonSerialisableData:  # type: ignore[return]
+def serialise(data: Any) -> JsonSerialisableData:
+    """Convert data into plain JSON compatible python objects
+
+    A round trip through orjson is considerably faster than walking the data
+    in python. Data orjson can't round trip unchanged (non string dict keys,
+    integers beyond 64 bit) is walked in python instead. Unknown types are
+    converted via pydantic.
+    """
+    try:
+        return json.loads(json.dumpb(data, non_str_keys=False))  # type: ignore[no-any-return]
+    except TypeError:
+        return _serialise(data)
+
+
+def _serialise(data: Any) -> JsonSerialisableData:  # type: ignore[return]
     match data:
         case dict():
-            return {item: serialise(value) for item, value in data.items()}
+            return {item: _serialise(value) for item, value in data.items()}
         case list():
-            return [serialise(item) for item in data]
+            return [_serialise(item) for item in data]
         case str() | int() | float() | bool() | None:
             return data
         case x if x is PydanticUndefined:
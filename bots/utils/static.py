@@ -0,0 +1,182 @@
+import asyncio
+import gzip
+import hashlib
+import mimetypes
+import posixpath
+import re
+from importlib.resources.abc import Traversable
+from typing import Iterator
+
+import brotli
+from fastapi import HTTPException, Request, Response
+
+COMPRESSIBLE_SUFFIXES = {".css", ".html", ".js", ".json", ".map", ".scss", ".svg", ".txt"}
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+# Relative specifiers of static and dynamic imports / re-exports in JavaScript modules
+IMPORT_PATTERN = re.compile(rb"""((?:\bfrom|\bimport)\s*\(?\s*)(["'])(\.\.?/[^"'?#]+)(\2)""")
+
+
+class Asset:
+    """In memory file with precomputed compressed variants"""
+
+    def __init__(self, body: bytes, media_type: str, compress: bool) -> None:
+        self.media_type = media_type
+        self.hash = hashlib.sha256(body).hexdigest()[:16]
+        self.bodies: dict[str, bytes] = {"identity": body}
+
+        if compress:
+            for encoding, compressed in (
+                ("br", brotli.compress(body, quality=9)),
+                ("gzip", gzip.compress(body, compresslevel=9, mtime=0)),
+            ):
+                if len(compressed) < len(body):
+                    self.bodies[encoding] = compressed
+
+    def etag(self, encoding: str) -> str:
+        return f'"{self.hash}"' if encoding == "identity" else f'"{self.hash}-{encoding}"'
+
+    def choose_encoding(self, accept_encoding: str) -> str:
+        accepted = set()
+        for part in accept_encoding.split(","):
+            encoding, _, params = part.strip().partition(";")
+            if params.strip().replace(" ", "") not in ("q=0", "q=0.0"):
+                accepted.add(encoding.strip().lower())
+
+        for encoding in ("br", "gzip"):
+            if encoding in self.bodies and (encoding in accepted or "*" in accepted):
+                return encoding
+        return "identity"
+
+    def not_modified(self, if_none_match: str, encoding: str) -> bool:
+        if if_none_match.strip() == "*":
+            return True
+        return self.etag(encoding) in {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+
+    def response(self, request: Request, immutable: bool = False) -> Response:
+        """Response for the request
+
+        Uses the best encoding accepted by the client and answers with 304 if
+        the client already has the current version.
+        """
+        encoding = self.choose_encoding(request.headers.get("accept-encoding", ""))
+        headers = {
+            "ETag": self.etag(encoding),
+            "Cache-Control": IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL,
+            "Vary": "Accept-Encoding",
+        }
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+
+        if (if_none_match := request.headers.get("if-none-match")) and self.not_modified(if_none_match, encoding):
+            return Response(status_code=304, headers=headers)
+
+        body = b"" if request.method == "HEAD" else self.bodies[encoding]
+        return Response(body, media_type=self.media_type, headers=headers)
+
+
+class AssetStore:
+    """Serve all files of a directory from memory
+
+    Files are read and compressed once by load() in a worker thread. Assets
+    requested with their content hash as "v" query parameter (see url()) are
+    cached forever by clients, the rest is revalidated via ETags. Relative
+    imports of JavaScript modules get the hash of the imported module as
+    well, so the modules an entry point imports are cached forever too.
+    """
+
+    def __init__(self, directory: Traversable, url_prefix: str) -> None:
+        self.directory = directory
+        self.url_prefix = url_prefix
+        self.assets: dict[str, Asset] = {}
+        self.loaded = asyncio.Event()
+        # Why loading failed, requests are answered with 500 then
+        self.error: BaseException | None = None
+
+        self._url_pattern = re.compile(rf'((?:src|href)="){re.escape(url_prefix)}/([^"?#]+)(")')
+
+    def _files(self, directory: Traversable, prefix: str = "") -> Iterator[tuple[str, Traversable]]:
+        for item in directory.iterdir():
+            path = prefix + item.name
+            if item.is_dir():
+                yield from self._files(item, path + "/")
+            else:
+                yield path, item
+
+    async def load(self) -> None:
+        # Compression releases the GIL, so the files are processed in parallel
+        try:
+            await asyncio.gather(
+                *[asyncio.to_thread(self._add_file, path, file) for path, file in self._files(self.directory)]
+            )
+            await asyncio.to_thread(self._hash_imports)
+        except BaseException as error:
+            self.error = error
+            raise
+        finally:
+            self.loaded.set()
+
+    def _add_file(self, path: str, file: Traversable) -> None:
+        self.add(path, file.read_bytes())
+
+    def add(self, path: str, body: bytes, media_type: str | None = None) -> Asset:
+        suffix = "." + path.rsplit(".", 1)[-1] if "." in path else ""
+        if not media_type:
+            media_type = "application/json" if suffix == ".map" else mimetypes.guess_type(path)[0]
+        self.assets[path] = asset = Asset(
+            body, media_type or "application/octet-stream", suffix in COMPRESSIBLE_SUFFIXES
+        )
+        return asset
+
+    def _hash_imports(self) -> None:
+        """Add content hashes to the relative imports of all JavaScript modules
+
+        A module's hash depends on the hashes of its imports, so imported
+        modules are rewritten first. Imports in cycles keep their plain URL.
+        """
+        done: set[str] = set()
+        visiting: set[str] = set()
+
+        def rewrite(path: str) -> None:
+            if path in done or path in visiting:
+                return
+            visiting.add(path)
+            body = self.assets[path].bodies["identity"]
+
+            def replace(match: re.Match[bytes]) -> bytes:
+                target = posixpath.normpath(posixpath.join(posixpath.dirname(path), match[3].decode()))
+                if target not in self.assets:
+                    return match[0]
+                rewrite(target)
+                if target in visiting:
+                    return match[0]
+                return match[1] + match[2] + match[3] + f"?v={self.assets[target].hash}".encode() + match[4]
+
+            if (hashed := IMPORT_PATTERN.sub(replace, body)) != body:
+                asset = self.assets[path]
+                self.add(path, hashed, asset.media_type)
+            visiting.discard(path)
+            done.add(path)
+
+        for path in [path for path in self.assets if path.endswith(".js")]:
+            rewrite(path)
+
+    def url(self, path: str) -> str:
+        """URL of an asset including its content hash"""
+        url = f"{self.url_prefix}/{path}"
+        if asset := self.assets.get(path):
+            url += f"?v={asset.hash}"
+        return url
+
+    def hash_urls(self, html: str) -> str:
+        """Add content hashes to all src and href URLs of our assets"""
+        return self._url_pattern.sub(lambda match: match[1] + self.url(match[2]) + match[3], html)
+
+    async def response(self, request: Request, path: str) -> Response:
+        await self.loaded.wait()
+        if self.error:
+            raise HTTPException(status_code=500, detail="Loading the assets failed")
+        if not (asset := self.assets.get(path)):
+            raise HTTPException(status_code=404)
+        return asset.response(request, immutable=request.query_params.get("v") == asset.hash)
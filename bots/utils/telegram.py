@@ -0,0 +1,86 @@
+from typing import Any, Iterable
+
+from telegram import Update
+from telegram.ext import (
+    Application,
+    BaseHandler,
+    CallbackQueryHandler,
+    ChatJoinRequestHandler,
+    ChatMemberHandler,
+    ChosenInlineResultHandler,
+    CommandHandler,
+    ConversationHandler,
+    InlineQueryHandler,
+    MessageHandler,
+    PollAnswerHandler,
+    PollHandler,
+    PreCheckoutQueryHandler,
+    ShippingQueryHandler,
+    StringCommandHandler,
+    StringRegexHandler,
+    TypeHandler,
+)
+
+MESSAGE_UPDATES = {
+    Update.MESSAGE,
+    Update.EDITED_MESSAGE,
+    Update.CHANNEL_POST,
+    Update.EDITED_CHANNEL_POST,
+}
+
+HANDLER_UPDATES: dict[type[BaseHandler[Any, Any]], set[str]] = {
+    CommandHandler: MESSAGE_UPDATES,
+    MessageHandler: MESSAGE_UPDATES,
+    CallbackQueryHandler: {Update.CALLBACK_QUERY},
+    InlineQueryHandler: {Update.INLINE_QUERY},
+    ChosenInlineResultHandler: {Update.CHOSEN_INLINE_RESULT},
+    ShippingQueryHandler: {Update.SHIPPING_QUERY},
+    PreCheckoutQueryHandler: {Update.PRE_CHECKOUT_QUERY},
+    PollHandler: {Update.POLL},
+    PollAnswerHandler: {Update.POLL_ANSWER},
+    ChatJoinRequestHandler: {Update.CHAT_JOIN_REQUEST},
+    # Not Telegram updates at all
+    StringCommandHandler: set(),
+    StringRegexHandler: set(),
+}
+
+
+def handler_update_types(handler: BaseHandler[Any, Any]) -> set[str]:
+    """Update types the handler can possibly handle
+
+    Unknown handlers are assumed to handle all update types.
+    """
+    if isinstance(handler, ConversationHandler):
+        handlers = [*handler.entry_points, *handler.fallbacks, *sum(handler.states.values(), [])]
+        return set().union(*map(handler_update_types, handlers))
+    if isinstance(handler, ChatMemberHandler):
+        if handler.chat_member_types == ChatMemberHandler.MY_CHAT_MEMBER:
+            return {Update.MY_CHAT_MEMBER}
+        if handler.chat_member_types == ChatMemberHandler.CHAT_MEMBER:
+            return {Update.CHAT_MEMBER}
+        return {Update.MY_CHAT_MEMBER, Update.CHAT_MEMBER}
+    if isinstance(handler, TypeHandler):
+        return set(Update.ALL_TYPES) if issubclass(Update, handler.type) else set()
+
+    for handler_class, update_types in HANDLER_UPDATES.items():
+        if isinstance(handler, handler_class):
+            return update_types
+    return set(Update.ALL_TYPES)
+
+
+def allowed_updates(
+    application: Application[Any, Any, Any, Any, Any, Any], exclude_groups: Iterable[int] = ()
+) -> list[str]:
+    """Update types any of the registered handlers can handle
+
+    Pass the result to start_polling() so Telegram doesn't send updates no
+    handler would use anyway. Without any handlers this is ["message"] rather
+    than [], which Telegram would take as all update types.
+    """
+    exclude_groups = set(exclude_groups)
+    update_types: set[str] = set()
+    for group, handlers in application.handlers.items():
+        if group not in exclude_groups:
+            for handler in handlers:
+                update_types |= handler_update_types(handler)
+    return sorted(update_types) or [Update.MESSAGE]
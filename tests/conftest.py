@@ -0,0 +1,21 @@
+from pathlib import Path
+from typing import Iterator
+
+import pytest
+
+from bots.config import Config, config
+
+
+@pytest.fixture
+def anyio_backend() -> str:
+    return "asyncio"
+
+
+@pytest.fixture(autouse=True)
+def test_config(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Iterator[Config]:
+    """A default config without apps, relative paths point into tmp_path"""
+    monkeypatch.chdir(tmp_path)
+    previous = object.__getattribute__(config, "_object")
+    object.__setattr__(config, "_object", Config(app_configs=[]))
+    yield config
+    object.__setattr__(config, "_object", previous)
@@ -0,0 +1,104 @@
+from typing import Any, AsyncIterator
+
+import pytest
+
+from bots import api
+from bots.api import ApiNamespace
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeApp:
+    id = "echo"
+
+
+@pytest.fixture
+def emitted() -> list[tuple[str, Any, Any]]:
+    return []
+
+
+@pytest.fixture
+async def namespace(
+    monkeypatch: pytest.MonkeyPatch, emitted: list[tuple[str, Any, Any]]
+) -> AsyncIterator[ApiNamespace]:
+    namespace = ApiNamespace()
+
+    async def emit(event: str, data: Any, room: Any = None, **kwargs: Any) -> None:
+        emitted.append((event, data, room))
+
+    async def enter_room(sid: str, room: str) -> None:
+        pass
+
+    monkeypatch.setattr(namespace, "emit", emit)
+    monkeypatch.setattr(namespace, "enter_room", enter_room)
+    monkeypatch.setattr(namespace, "leave_room", enter_room)
+    yield namespace
+    namespace.status_emitter.cancel()
+
+
+@pytest.fixture
+def info_calls(monkeypatch: pytest.MonkeyPatch) -> list[str]:
+    calls: list[str] = []
+
+    async def app_info(app: Any) -> dict[str, Any]:
+        calls.append("app_info")
+        return {"id": app.id}
+
+    async def apps_info(local: bool = False) -> list[Any]:
+        calls.append("apps_info")
+        return []
+
+    async def run_operation(operation: str, *args: Any) -> AsyncIterator[tuple[dict[str, Any], FakeApp]]:
+        yield {"app_id": "echo", "status": "success", "message": "Started"}, FakeApp()
+
+    monkeypatch.setattr(api, "app_info", app_info)
+    monkeypatch.setattr(api, "apps_info", apps_info)
+    monkeypatch.setattr(api, "run_operation", run_operation)
+    return calls
+
+
+async def test_receivers(namespace: ApiNamespace) -> None:
+    assert not namespace.has_receivers(None, ("apps",))
+    assert not namespace.has_receivers("client", ("apps",))
+    assert namespace.has_receivers(None, None)
+
+    await namespace.subscribe("client", ["app:echo"])
+    assert namespace.has_receivers(None, api.app_topics("echo"))
+    assert not namespace.has_receivers(None, ("apps",))
+    # Connected clients get the answers to their own requests
+    assert namespace.has_receivers("client", ("apps",))
+
+    await namespace.on_disconnect("client")
+    assert not namespace.has_receivers("client", api.app_topics("echo"))
+
+
+async def test_no_payload_without_receivers(
+    namespace: ApiNamespace, info_calls: list[str], emitted: list[tuple[str, Any, Any]]
+) -> None:
+    # The requesting client disconnected in the meantime and nobody else is subscribed
+    await namespace.run_operation("apps_start", "start", "gone", {})
+    assert info_calls == []
+    assert emitted == []
+
+
+async def test_payload_for_subscribers(
+    namespace: ApiNamespace, info_calls: list[str], emitted: list[tuple[str, Any, Any]]
+) -> None:
+    await namespace.subscribe("client", ["apps"])
+    await namespace.run_operation("apps_start", "start", "client", {})
+    assert info_calls == ["app_info", "apps_info"]
+    assert [event for event, *_ in emitted] == ["app_start", "apps_start"]
+
+
+async def test_only_start_wakes_apps_fully(namespace: ApiNamespace, monkeypatch: pytest.MonkeyPatch) -> None:
+    woken: list[tuple[str, bool]] = []
+
+    async def wake(app_id: str, start: bool = True) -> FakeApp:
+        woken.append((app_id, start))
+        return FakeApp()
+
+    monkeypatch.setattr(api.app_manager.hibernator, "apps", {"echo": None})
+    monkeypatch.setattr(api.app_manager.hibernator, "wake", wake)
+    await namespace.get_app_or_send_error("app_config", "client", "echo")
+    await namespace.get_app_or_send_error("app_start", "client", "echo", start=True)
+    assert woken == [("echo", False), ("echo", True)]
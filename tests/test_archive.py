@@ -0,0 +1,85 @@
+import logging
+from pathlib import Path
+from typing import Any, Iterator
+
+import pytest
+
+from bots.archive import LogArchive
+from bots.log import serialise_record
+
+
+def add(archive: LogArchive, created: float, message: str, stream: str = "manager", level: int = logging.INFO) -> None:
+    name = stream if stream != "manager" else "bot_manager"
+    record = logging.LogRecord(name, level, __file__, 0, message, None, None)
+    record.created = created
+    archive.append(created, level, stream, serialise_record(record, stream))
+
+
+@pytest.fixture
+def archive(tmp_path: Path) -> Iterator[LogArchive]:
+    archive = LogArchive(tmp_path / "archive", block_size=4)
+    archive.open()
+    for index in range(10):
+        add(archive, 1000 + index, f"Message {index}", stream="echo" if index % 2 else "manager")
+    add(archive, 1010, "Ärger mit Äpfeln", stream="echo", level=logging.ERROR)
+    yield archive
+    archive.close()
+
+
+def messages(archive: LogArchive, **kwargs: object) -> list[str]:
+    return [entry["message"] for entry in archive.search(**kwargs)["entries"]]  # type: ignore[arg-type]
+
+
+def test_newest_first(archive: LogArchive) -> None:
+    assert messages(archive, limit=3) == ["Ärger mit Äpfeln", "Message 9", "Message 8"]
+
+
+def test_filters(archive: LogArchive) -> None:
+    assert messages(archive, app="manager", start=1004) == ["Message 8", "Message 6", "Message 4"]
+    assert messages(archive, level="error") == ["Ärger mit Äpfeln"]
+    assert messages(archive, text="MESSAGE 3") == ["Message 3"]
+    assert messages(archive, start=1002, end=1003) == ["Message 3", "Message 2"]
+
+
+def test_non_ascii_text_is_case_insensitive(archive: LogArchive) -> None:
+    assert messages(archive, text="äpfeln") == ["Ärger mit Äpfeln"]
+    assert messages(archive, text="ÄRGER") == ["Ärger mit Äpfeln"]
+
+
+def test_cursor_pages_through_all_entries(archive: LogArchive) -> None:
+    found: list[str] = []
+    cursor = None
+    while True:
+        page = archive.search(app="echo", limit=2, cursor=cursor)
+        found += [entry["message"] for entry in page["entries"]]
+        if not (cursor := page["cursor"]):
+            break
+    assert found == ["Ärger mit Äpfeln", "Message 9", "Message 7", "Message 5", "Message 3", "Message 1"]
+
+
+def test_reopen_keeps_the_index(archive: LogArchive) -> None:
+    archive.close()
+    reopened = LogArchive(archive.directory, block_size=4)
+    reopened.open()
+    assert messages(reopened, app="echo", limit=2) == ["Ärger mit Äpfeln", "Message 9"]
+    reopened.close()
+
+
+def test_search_uses_a_snapshot_of_the_index(archive: LogArchive, monkeypatch: pytest.MonkeyPatch) -> None:
+    read_block = archive._read_block
+
+    def read_block_while_writing(*args: Any) -> bytes:
+        # The writer keeps appending blocks of the app during the search
+        for index in range(4):
+            add(archive, 2000 + index, f"New {index}", stream="echo")
+        return read_block(*args)
+
+    monkeypatch.setattr(archive, "_read_block", read_block_while_writing)
+    assert messages(archive, app="echo", end=1999) == [
+        "Ärger mit Äpfeln",
+        "Message 9",
+        "Message 7",
+        "Message 5",
+        "Message 3",
+        "Message 1",
+    ]
@@ -0,0 +1,138 @@
+import asyncio
+from typing import Any
+
+import pytest
+from telegram.error import Forbidden
+
+from bots.applications.manager import AppManager
+from bots.broadcast import BroadcastJob, ChatId
+from bots.config import Config
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeStore:
+    def __init__(self) -> None:
+        self.data: dict[str, Any] = {}
+
+    async def get(self, key: str, default: Any = None) -> Any:
+        return self.data.get(key, default)
+
+    def set(self, key: str, value: Any) -> None:
+        self.data[key] = value
+
+    def delete(self, key: str) -> None:
+        self.data.pop(key, None)
+
+
+class FakeApplication:
+    bot = None
+
+
+class FakeApp:
+    def __init__(self, id: str = "app") -> None:
+        self.id = id
+        self.storage = FakeStore()
+        self.application = FakeApplication()
+
+
+async def test_sends_to_all_chats() -> None:
+    app = FakeApp()
+    sent: list[ChatId] = []
+
+    async def send(bot: Any, chat_id: ChatId) -> None:
+        if chat_id == 3:
+            raise Forbidden("Blocked by the user")
+        sent.append(chat_id)
+
+    job = BroadcastJob(app, range(10), send, concurrency=3, rate=1000).start()  # type: ignore[arg-type]
+    progress = await job.wait()
+    assert sorted(sent) == [0, 1, 2, 4, 5, 6, 7, 8, 9]
+    assert progress["status"] == "finished"
+    assert (progress["processed"], progress["sent"], progress["failed"]) == (10, 9, 1)
+    assert progress["errors"] == {"Forbidden": 1}
+    assert job.checkpoint_key not in app.storage.data
+
+
+async def test_checkpoint_only_counts_chats_before_the_offset() -> None:
+    app = FakeApp()
+    blocked = asyncio.Event()
+    sent: list[ChatId] = []
+
+    async def send_blocking(bot: Any, chat_id: ChatId) -> None:
+        if chat_id == 0:
+            await blocked.wait()
+        elif chat_id == 3:
+            raise Forbidden("Blocked by the user")
+        sent.append(chat_id)
+
+    job = BroadcastJob(app, range(5), send_blocking, job_id="job", concurrency=5, rate=1000)  # type: ignore[arg-type]
+    job.start()
+    while len(sent) < 3:
+        await asyncio.sleep(0.01)
+    await job.cancel()
+
+    # Chat 0 wasn't processed, so nothing after it is checkpointed
+    assert (job.sent, job.failed) == (3, 1)
+    assert app.storage.data[job.checkpoint_key] == {"offset": 0, "sent": 0, "failed": 0, "errors": {}}
+
+    async def send(bot: Any, chat_id: ChatId) -> None:
+        sent.append(chat_id)
+
+    sent.clear()
+    resumed = BroadcastJob(app, range(5), send, job_id="job", concurrency=5, rate=1000)  # type: ignore[arg-type]
+    progress = await resumed.start().wait()
+    assert sorted(sent) == [0, 1, 2, 3, 4]
+    assert (progress["sent"], progress["failed"]) == (5, 0)
+
+
+async def test_checkpoint_resumes_after_the_offset() -> None:
+    app = FakeApp()
+    blocked = asyncio.Event()
+
+    async def send_blocking(bot: Any, chat_id: ChatId) -> None:
+        if chat_id == 2:
+            await blocked.wait()
+        elif chat_id == 1:
+            raise Forbidden("Blocked by the user")
+
+    job = BroadcastJob(app, range(4), send_blocking, job_id="job", concurrency=1, rate=1000)  # type: ignore[arg-type]
+    job.start()
+    while job.offset < 2:
+        await asyncio.sleep(0.01)
+    await job.cancel()
+    assert app.storage.data[job.checkpoint_key] == {"offset": 2, "sent": 1, "failed": 1, "errors": {"Forbidden": 1}}
+
+    sent: list[ChatId] = []
+
+    async def send(bot: Any, chat_id: ChatId) -> None:
+        sent.append(chat_id)
+
+    resumed = BroadcastJob(app, range(4), send, job_id="job", rate=1000)  # type: ignore[arg-type]
+    progress = await resumed.start().wait()
+    assert sent == [2, 3]
+    assert (progress["processed"], progress["sent"], progress["failed"]) == (4, 3, 1)
+    assert progress["errors"] == {"Forbidden": 1}
+
+
+async def test_manager_keeps_a_bounded_history(test_config: Config) -> None:
+    test_config.broadcast_history = 2
+    manager = AppManager()
+    app, other_app = FakeApp(), FakeApp("other")
+
+    async def send(bot: Any, chat_id: ChatId) -> None:
+        pass
+
+    for index in range(4):
+        await manager.start_broadcast(app, [1], send, job_id=f"job-{index}").wait()  # type: ignore[arg-type]
+    blocked = asyncio.Event()
+
+    async def send_blocking(bot: Any, chat_id: ChatId) -> None:
+        await blocked.wait()
+
+    running = manager.start_broadcast(other_app, [1], send_blocking, job_id="running")  # type: ignore[arg-type]
+    assert list(manager.broadcasts) == ["job-2", "job-3", "running"]
+
+    manager._remove_broadcasts(app)  # type: ignore[arg-type]
+    assert list(manager.broadcasts) == ["running"]
+    await running.cancel()
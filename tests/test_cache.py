@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+from bots.cache import ApiCache
+
+pytestmark = pytest.mark.anyio
+
+
+def test_lru_eviction_and_ttl() -> None:
+    cache = ApiCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    # "b" was the least recently used
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert cache.get_stats()["evictions"] == 1
+
+    cache.set("expired", 4, ttl=0)
+    assert cache.get("expired", "default") == "default"
+
+    cache.invalidate("c", "missing")
+    assert cache.get("c") is None
+    assert cache.get_stats()["invalidations"] == 1
+
+
+async def test_fetch_coalesces_concurrent_lookups() -> None:
+    cache = ApiCache()
+    calls = 0
+
+    async def lookup() -> str:
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "value"
+
+    assert await asyncio.gather(*[cache.fetch("key", lookup) for _ in range(5)]) == ["value"] * 5
+    assert await cache.fetch("key", lookup) == "value"
+    assert calls == 1
+    stats = cache.get_stats()
+    assert (stats["misses"], stats["coalesced"], stats["hits"]) == (1, 4, 1)
+
+
+async def test_failed_fetch_is_not_cached() -> None:
+    cache = ApiCache()
+
+    async def failing() -> str:
+        await asyncio.sleep(0.01)
+        raise RuntimeError("Lookup failed")
+
+    results = await asyncio.gather(cache.fetch("key", failing), cache.fetch("key", failing), return_exceptions=True)
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+    async def working() -> str:
+        return "value"
+
+    assert await cache.fetch("key", working) == "value"
+
+
+async def test_cancelled_lookup_is_retried_by_waiters() -> None:
+    cache = ApiCache()
+
+    async def slow() -> str:
+        await asyncio.sleep(0.05)
+        return "value"
+
+    first = asyncio.create_task(cache.fetch("key", slow))
+    await asyncio.sleep(0)
+    second = asyncio.create_task(cache.fetch("key", slow))
+    await asyncio.sleep(0)
+    first.cancel()
+    assert await second == "value"
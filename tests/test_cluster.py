@@ -0,0 +1,146 @@
+import asyncio
+import time
+from pathlib import Path
+from typing import Any, AsyncIterator
+
+import pytest
+from pydantic import ValidationError
+
+from bots.cluster import ClusterNode, NodeInfo, SQLiteLeaseStore, owner
+from bots.config import ApplicationConfig, ClusterConfig, Config
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def stores(tmp_path: Path) -> AsyncIterator[tuple[SQLiteLeaseStore, SQLiteLeaseStore]]:
+    """Two nodes sharing one database"""
+    first, second = SQLiteLeaseStore(tmp_path / "cluster.sqlite3"), SQLiteLeaseStore(tmp_path / "cluster.sqlite3")
+    await first.open()
+    await second.open()
+    yield first, second
+    await first.close()
+    await second.close()
+
+
+def node(id: str, ttl: float = 60) -> NodeInfo:
+    return NodeInfo(id=id, url=f"http://{id}", started=time.time(), expires=time.time() + ttl)
+
+
+async def test_leases_are_exclusive(stores: tuple[SQLiteLeaseStore, SQLiteLeaseStore]) -> None:
+    first, second = stores
+    assert await first.acquire(["a", "b"], "first", 60) == {"a", "b"}
+    assert await second.acquire(["b", "c"], "second", 60) == {"c"}
+    # Renewing keeps the lease
+    assert await first.acquire(["a", "b"], "first", 60) == {"a", "b"}
+
+    leases = await second.leases()
+    assert {app_id: lease["node_id"] for app_id, lease in leases.items()} == {"a": "first", "b": "first", "c": "second"}
+
+
+async def test_concurrent_acquires_have_one_winner(stores: tuple[SQLiteLeaseStore, SQLiteLeaseStore]) -> None:
+    first, second = stores
+    results = await asyncio.gather(first.acquire(["a"], "first", 60), second.acquire(["a"], "second", 60))
+    assert sorted(len(owned) for owned in results) == [0, 1]
+
+
+async def test_expired_leases_are_taken_over(stores: tuple[SQLiteLeaseStore, SQLiteLeaseStore]) -> None:
+    first, second = stores
+    assert await first.acquire(["a"], "first", 0.05) == {"a"}
+    assert await second.acquire(["a"], "second", 60) == set()
+    await asyncio.sleep(0.1)
+    assert await first.leases() == {}
+    assert await second.acquire(["a"], "second", 60) == {"a"}
+    # The previous owner can't renew it anymore
+    assert await first.acquire(["a"], "first", 60) == set()
+
+
+async def test_release_and_leave(stores: tuple[SQLiteLeaseStore, SQLiteLeaseStore]) -> None:
+    first, second = stores
+    await first.heartbeat(node("first"))
+    await second.heartbeat(node("second"))
+    await second.heartbeat(node("expired", ttl=-1))
+    assert [info["id"] for info in await first.nodes()] == ["first", "second"]
+
+    await first.acquire(["a", "b"], "first", 60)
+    await second.release(["a"], "second")
+    assert set(await second.leases()) == {"a", "b"}
+    await first.release(["a"], "first")
+    assert set(await second.leases()) == {"b"}
+
+    await first.leave("first")
+    assert await second.leases() == {}
+    assert [info["id"] for info in await second.nodes()] == ["second"]
+
+
+def test_owner_is_stable() -> None:
+    apps = [f"app-{index}" for index in range(100)]
+    nodes = ["node-1", "node-2", "node-3"]
+    owners = {app: owner(app, nodes) for app in apps}
+    assert owners == {app: owner(app, reversed(nodes)) for app in apps}
+    assert set(owners.values()) == set(nodes)
+    assert owner("app", []) is None
+
+    # Only the apps of the leaving node move
+    remaining = {app: owner(app, nodes[:2]) for app in apps}
+    assert all(remaining[app] == owners[app] for app in apps if owners[app] != "node-3")
+
+
+class SlowManager:
+    """Just enough of an AppManager to take over apps, "slow" never finishes loading"""
+
+    def __init__(self) -> None:
+        self.apps: dict[str, Any] = {}
+        self.storage = self
+
+    @property
+    def app_ids(self) -> set[str]:
+        return set(self.apps)
+
+    def forget(self, namespace: str) -> None:
+        pass
+
+    async def flush(self) -> None:
+        pass
+
+    async def load_app(self, app_id: str) -> Any:
+        self.apps[app_id] = app_id
+        if app_id == "slow":
+            await asyncio.sleep(60)
+
+    async def initialize_app(self, app: Any) -> Any:
+        return ApplicationConfig(id="", module="", telegram_token="")
+
+    async def destroy_apps(self, app_ids: list[str], timeout: float | None = None) -> None:
+        for app_id in app_ids:
+            del self.apps[app_id]
+
+
+async def test_slow_takeovers_dont_expire_the_leases(
+    stores: tuple[SQLiteLeaseStore, SQLiteLeaseStore], test_config: Config, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    first, second = stores
+    test_config.app_configs = [ApplicationConfig(id="fast", module="echo", telegram_token="")]
+    manager: Any = SlowManager()
+    node = ClusterNode(manager, first, "first", "http://first", lease_ttl=0.2, heartbeat_interval=0.05)
+    await node.tick()
+    assert node.owned == {"fast"}
+
+    # Longer than the lease ttl, the lease of "fast" is still renewed meanwhile
+    monkeypatch.setattr(ClusterNode, "operation_timeout", 0.4)
+    test_config.app_configs.append(ApplicationConfig(id="slow", module="echo", telegram_token=""))
+    renewal = asyncio.create_task(node._loop(node.renew, "Renewing the leases"))
+    tick = asyncio.create_task(node.tick())
+    await asyncio.sleep(0.3)
+    assert not tick.done()
+    assert await second.acquire(["fast", "slow"], "second", 60) == set()
+
+    # The failed takeover is released to be retried
+    await tick
+    assert node.owned == {"fast"}
+    renewal.cancel()
+
+
+def test_heartbeat_interval_must_be_under_the_lease_ttl() -> None:
+    with pytest.raises(ValidationError):
+        ClusterConfig(lease_ttl=15, heartbeat_interval=10)
@@ -0,0 +1,199 @@
+import asyncio
+import time
+from typing import Any
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from bots import hibernation
+from bots.config import Config
+from bots.hibernation import Hibernator
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeBotApi:
+    def __init__(self) -> None:
+        self.calls: list[dict[str, Any]] = []
+        self.pending: list[dict[str, Any]] = []
+
+    async def get_updates(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        self.calls.append(data)
+        updates = [update for update in self.pending if update["update_id"] >= data.get("offset", 0)][:1]
+        if not updates:
+            await asyncio.sleep(0.05)
+        return web.json_response({"ok": True, "result": updates})
+
+
+class FakeProcessor:
+    queued = running = 0
+    last_update_time: float | None = None
+    last_update_id: int | None = 41
+
+
+class FakePolling:
+    def model_copy(self, update: dict[str, Any]) -> "FakePolling":
+        return self
+
+
+class FakeAppConfig:
+    hibernate_after = 0.1
+    telegram_token = "TOKEN"
+    polling = FakePolling()
+
+
+class FakeBot:
+    link = "https://t.me/fake_bot"
+
+    def to_dict(self) -> dict[str, Any]:
+        return {"username": "fake_bot"}
+
+
+class FakeJobScheduler:
+    jobs: dict[str, Any] = {}
+
+
+class FakeApp:
+    def __init__(self, id: str) -> None:
+        self.id = id
+        self.running = False
+        self.started_at: float | None = None
+        self.config = FakeAppConfig()
+        self.update_processor = FakeProcessor()
+        self.job_scheduler = FakeJobScheduler()
+
+    async def get_bot(self) -> FakeBot:
+        return FakeBot()
+
+    def allowed_updates(self) -> list[str]:
+        return ["message"]
+
+
+class FakeStatus:
+    def notify(self) -> None:
+        pass
+
+
+class FakeManager:
+    def __init__(self) -> None:
+        self.apps: dict[str, FakeApp] = {}
+        self.broadcasts: dict[str, Any] = {}
+        self.status = FakeStatus()
+        self.loads = 0
+        self.start_failures = 0
+        # Update id processed while the app drains its updates on shutdown
+        self.drained_update_id: int | None = None
+
+    async def load_app(self, id: str) -> FakeApp:
+        self.loads += 1
+        self.apps[id] = app = FakeApp(id)
+        return app
+
+    async def initialize_app(self, app: FakeApp) -> FakeApp:
+        return app
+
+    async def start_app(self, app: FakeApp) -> FakeApp:
+        if self.start_failures:
+            self.start_failures -= 1
+            raise RuntimeError("Start failed")
+        app.running = True
+        app.started_at = time.time()
+        return app
+
+    async def destroy_app(self, id: str) -> None:
+        app = self.apps.pop(id)
+        if self.drained_update_id is not None:
+            app.update_processor.last_update_id = self.drained_update_id
+
+
+@pytest.fixture
+async def bot_api(monkeypatch: pytest.MonkeyPatch, test_config: Config) -> Any:
+    test_config.hibernation_check_interval = 0.05
+    test_config.hibernation_poll_timeout = 1
+
+    api = FakeBotApi()
+    server_app = web.Application()
+    server_app.router.add_post("/botTOKEN/getUpdates", api.get_updates)
+    server = TestServer(server_app)
+    await server.start_server()
+    monkeypatch.setattr(hibernation, "BOT_API_URL", str(server.make_url("/")) + "bot{token}/{method}")
+    yield api
+    await server.close()
+
+
+async def wait_for(condition: Any, timeout: float = 2) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Timed out"
+        await asyncio.sleep(0.01)
+
+
+async def test_hibernate_and_wake_on_update(bot_api: FakeBotApi) -> None:
+    manager = FakeManager()
+    hibernator = Hibernator(manager)  # type: ignore[arg-type]
+    await manager.start_app(await manager.load_app("app"))
+    hibernator.start()
+    try:
+        await wait_for(lambda: "app" in hibernator.apps)
+        assert "app" not in manager.apps
+        await wait_for(lambda: bot_api.calls)
+        # The offset confirms the processed updates only
+        assert bot_api.calls[-1]["offset"] == 42
+        assert bot_api.calls[-1]["allowed_updates"] == ["message"]
+
+        bot_api.pending.append({"update_id": 42})
+        await wait_for(lambda: "app" in manager.apps and manager.apps["app"].running)
+        assert "app" not in hibernator.apps
+        assert hibernator.get_stats()["wakeups"] == 1
+    finally:
+        await hibernator.stop()
+
+
+async def test_concurrent_wake_ups_load_once(bot_api: FakeBotApi) -> None:
+    manager = FakeManager()
+    hibernator = Hibernator(manager)  # type: ignore[arg-type]
+    await hibernator.hibernate(await manager.start_app(await manager.load_app("app")))  # type: ignore[arg-type]
+
+    first, second = await asyncio.gather(hibernator.wake("app"), hibernator.wake("app"))
+    assert first is second
+    assert manager.loads == 2
+    await hibernator.stop()
+
+
+async def test_updates_drained_on_hibernation_are_confirmed(bot_api: FakeBotApi) -> None:
+    manager = FakeManager()
+    manager.drained_update_id = 42
+    hibernator = Hibernator(manager)  # type: ignore[arg-type]
+    stub = await hibernator.hibernate(await manager.start_app(await manager.load_app("app")))  # type: ignore[arg-type]
+    assert stub.offset == 43
+    await hibernator.stop()
+
+
+async def test_failed_wake_up_stays_hibernated(bot_api: FakeBotApi) -> None:
+    manager = FakeManager()
+    hibernator = Hibernator(manager)  # type: ignore[arg-type]
+    await hibernator.hibernate(await manager.start_app(await manager.load_app("app")))  # type: ignore[arg-type]
+    manager.start_failures = 1
+
+    with pytest.raises(RuntimeError):
+        await hibernator.wake("app")
+    assert "app" not in manager.apps
+    stub = hibernator.apps["app"]
+    assert stub.wake_failures == 1
+    assert stub.task and not stub.task.done()
+    assert hibernator.get_stats()["wake_failures"] == 1
+
+    # Works again with the next try
+    await hibernator.wake("app")
+    assert manager.apps["app"].running
+    assert "app" not in hibernator.apps
+    await hibernator.stop()
+
+
+async def test_session_has_no_connection_limit() -> None:
+    hibernator = Hibernator(FakeManager())  # type: ignore[arg-type]
+    assert hibernator.session.connector is not None
+    assert hibernator.session.connector.limit == 0
+    await hibernator.stop()
@@ -0,0 +1,17 @@
+from pathlib import Path
+
+from bots.utils import json
+from bots.utils.pydantic import serialise
+
+
+def test_dumps() -> None:
+    assert json.dumps({"b": 1, "a": [Path("x")]}, sort_keys=True) == '{"a":["x"],"b":1}'
+    assert json.dumps({1: None}) == '{"1":null}'
+    assert json.loads(json.dumpb({"a": (1, 2)})) == {"a": [1, 2]}
+
+
+def test_serialise() -> None:
+    assert serialise({"path": Path("x"), "items": (1, 2)}) == {"path": "x", "items": [1, 2]}
+    # Kept as they were, orjson can't represent them
+    assert serialise({1: {"big": 2**70}}) == {1: {"big": 2**70}}
+    assert serialise([2**70, Path("x")]) == [2**70, "x"]
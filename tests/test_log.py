@@ -0,0 +1,54 @@
+import gzip
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from queue import SimpleQueue
+
+import pytest
+
+from bots import log
+from bots.log import ClosingQueueListener, JsonLinesHandler, RotatingFile, log_stream
+
+
+def record(name: str) -> logging.LogRecord:
+    return logging.LogRecord(name, logging.INFO, __file__, 0, "Message", None, None)
+
+
+def test_log_stream_matches_app_ids_with_dots(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(log, "app_loggers", {"echo", "echo.beta"})
+    assert log_stream(record("echo")) == "echo"
+    assert log_stream(record("echo.handlers")) == "echo"
+    assert log_stream(record("echo.beta")) == "echo.beta"
+    assert log_stream(record("echo.beta.handlers")) == "echo.beta"
+    assert log_stream(record("uvicorn.error")) == "manager"
+
+
+def test_rotation_keeps_only_own_backups(tmp_path: Path) -> None:
+    # Backups of another app whose id starts with the same name
+    other = tmp_path / "echo.beta.1000.jsonl.gz"
+    other.write_bytes(gzip.compress(b"other\n"))
+
+    with ThreadPoolExecutor(max_workers=1) as compressor:
+        file = RotatingFile(tmp_path / "echo.jsonl", max_bytes=10, interval=86400, backups=2, compressor=compressor)
+        for index in range(5):
+            file.write(f"line {index}\n".encode())
+        file.close()
+
+    backups = sorted(tmp_path.glob("echo.[0-9]*.jsonl.gz"))
+    assert len(backups) == 2
+    assert [gzip.decompress(backup.read_bytes()) for backup in backups] == [b"line 2\n", b"line 3\n"]
+    assert other.exists()
+    assert (tmp_path / "echo.jsonl").read_bytes() == b"line 4\n"
+
+
+def test_stopping_the_listener_closes_the_handlers(tmp_path: Path) -> None:
+    handler = JsonLinesHandler(tmp_path)
+    queue: SimpleQueue[logging.LogRecord] = SimpleQueue()
+    listener = ClosingQueueListener(queue, handler)
+    listener.start()
+    queue.put(record("bot_manager"))
+    listener.stop()
+
+    assert handler.compressor._shutdown
+    assert all(file.file is None for file in handler.files.values())
+    assert (tmp_path / "manager.jsonl").read_bytes().count(b"\n") == 1
@@ -0,0 +1,26 @@
+import asyncio
+from typing import Any
+
+import pytest
+
+from bots.applications.manager import AppManager
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_closing_run_operation_early_lets_operations_finish(monkeypatch: pytest.MonkeyPatch) -> None:
+    manager = AppManager()
+    finished: list[str] = []
+
+    async def run_app_operation(operation: str, app_id: str, timeout: float | None) -> tuple[Any, None]:
+        await asyncio.sleep(0 if app_id == "fast" else 0.05)
+        finished.append(app_id)
+        return {"app_id": app_id}, None
+
+    monkeypatch.setattr(manager, "_run_app_operation", run_app_operation)
+
+    results = manager.run_operation("start", ["fast", "slow"])
+    result, _ = await anext(results)
+    assert result["app_id"] == "fast"
+    await results.aclose()
+    assert finished == ["fast", "slow"]
@@ -0,0 +1,73 @@
+from typing import Any
+
+import pytest
+
+from bots.utils import MarkdownV2, escape_markdown
+
+pytestmark = pytest.mark.anyio
+
+
+def test_escape_markdown() -> None:
+    assert escape_markdown("1+1=2.") == r"1\+1\=2\."
+    assert escape_markdown("*bold*", "all") == r"\*bold\*"
+    assert escape_markdown("`code` *", "code") == r"\`code\` *"
+    assert escape_markdown("https://example.com/(a)", "text_link") == r"https://example.com/(a\)"
+
+
+def test_build() -> None:
+    message = MarkdownV2().bold("Status").text(": ok.\n").code("x = 1").link("Docs", "https://example.com/(1)")
+    assert message.build() == "*Status*: ok\\.\n`x = 1`[Docs](https://example.com/(1\\))"
+    assert len(message) == len(message.build())
+
+
+def test_short_messages_are_not_split() -> None:
+    message = MarkdownV2().text("Hello").bold("World")
+    assert message.split() == [message.build()]
+
+
+def test_split_at_line_breaks() -> None:
+    lines = [f"Line {index}" for index in range(20)]
+    chunks = MarkdownV2().text("\n".join(lines)).split(50)
+    assert all(len(chunk) <= 50 for chunk in chunks)
+    # Line breaks at the split points are dropped
+    assert "\n".join(chunks).split("\n") == lines
+
+
+def test_split_entities_are_reopened() -> None:
+    code = "\n".join(f"print({index})" for index in range(50))
+    chunks = MarkdownV2().bold("Log:").text("\n").pre(code, "python").split(100)
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 100 for chunk in chunks)
+    assert chunks[0].startswith("*Log:*\n```python\n")
+    for chunk in chunks:
+        assert chunk.count("```") == 2
+        assert chunk.endswith("\n```")
+
+
+def test_escape_sequences_are_not_split() -> None:
+    chunks = MarkdownV2().text("." * 30).split(9)
+    assert all(len(chunk) <= 9 for chunk in chunks)
+    assert all(chunk == "\\." * (len(chunk) // 2) for chunk in chunks)
+    assert "".join(chunks) == "\\." * 30
+
+
+def test_raw_markdown_is_never_split() -> None:
+    message = MarkdownV2().text("Intro ").raw("*" + "x" * 25 + "*")
+    assert message.split(30) == ["Intro ", "*" + "x" * 25 + "*"]
+    with pytest.raises(ValueError):
+        MarkdownV2().raw("x" * 31).split(30)
+
+
+async def test_send() -> None:
+    class Bot:
+        def __init__(self) -> None:
+            self.sent: list[tuple[Any, str, dict[str, Any]]] = []
+
+        async def send_message(self, chat_id: Any, text: str, **kwargs: Any) -> str:
+            self.sent.append((chat_id, text, kwargs))
+            return text
+
+    bot = Bot()
+    messages = await MarkdownV2().text("a " * 3000).send(bot, 1)  # type: ignore[arg-type]
+    assert len(messages) == 2
+    assert all(kwargs == {"parse_mode": "MarkdownV2"} for *_, kwargs in bot.sent)
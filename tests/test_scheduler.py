@@ -0,0 +1,84 @@
+import asyncio
+import datetime
+
+import pytest
+import pytz
+from telegram.ext import ApplicationBuilder, CallbackContext, Defaults
+
+from bots.scheduler import JobScheduler, SharedJobQueue
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_jobs_run_in_order() -> None:
+    scheduler = JobScheduler()
+    namespace = scheduler.namespace("app")
+    runs: list[str] = []
+
+    async def job(name: str) -> None:
+        runs.append(name)
+
+    now = datetime.datetime.now(pytz.utc)
+    namespace.add_job(job, "date", args=("second",), run_date=now + datetime.timedelta(seconds=0.1))
+    namespace.add_job(job, "date", args=("first",), run_date=now + datetime.timedelta(seconds=0.05))
+    namespace.start()
+    await asyncio.sleep(0.2)
+
+    assert runs == ["first", "second"]
+    assert namespace.stats()["runs"] == 2
+    # One off jobs are removed after their run
+    assert not namespace.jobs
+
+
+async def test_repeating_job_pause_and_stopped_namespace() -> None:
+    scheduler = JobScheduler()
+    namespace = scheduler.namespace("app")
+    runs = 0
+
+    async def job() -> None:
+        nonlocal runs
+        runs += 1
+
+    scheduled = namespace.add_job(job, "interval", seconds=0.05)
+    namespace.start()
+    await asyncio.sleep(0.18)
+    assert runs >= 2
+
+    scheduled.pause()
+    paused_at = runs
+    await asyncio.sleep(0.1)
+    assert runs == paused_at
+
+    scheduled.resume()
+    await namespace.shutdown()
+    await asyncio.sleep(0.1)
+    assert runs == paused_at
+
+    scheduler.remove_namespace("app")
+    assert not namespace.jobs and "app" not in scheduler.namespaces
+
+
+async def test_shared_job_queue_with_defaults() -> None:
+    scheduler = JobScheduler()
+    namespace = scheduler.namespace("app")
+    timezone = pytz.timezone("Europe/Zurich")
+    application = (
+        ApplicationBuilder()
+        .token("123:TOKEN")
+        .defaults(Defaults(tzinfo=timezone))
+        .job_queue(SharedJobQueue(namespace))
+        .build()
+    )
+    assert namespace.timezone is timezone
+
+    called = asyncio.Event()
+
+    async def callback(context: CallbackContext) -> None:  # type: ignore[type-arg]
+        called.set()
+
+    assert application.job_queue
+    job = application.job_queue.run_once(callback, 0.01, name="once")
+    assert job.name == "once"
+    await application.job_queue.start()
+    await asyncio.wait_for(called.wait(), 1)
+    await application.job_queue.stop()
@@ -0,0 +1,99 @@
+import asyncio
+from pathlib import Path
+
+import brotli
+import pytest
+from fastapi import HTTPException, Request
+
+from bots.utils.static import IMMUTABLE_CACHE_CONTROL, AssetStore
+
+pytestmark = pytest.mark.anyio
+
+SCRIPT = b"console.log('Hello World');\n" * 100
+
+
+def request(query: str = "", **headers: str) -> Request:
+    return Request(
+        {
+            "type": "http",
+            "method": "GET",
+            "path": "/",
+            "query_string": query.encode(),
+            "headers": [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()],
+        }
+    )
+
+
+@pytest.fixture
+def directory(tmp_path: Path) -> Path:
+    (tmp_path / "js").mkdir()
+    (tmp_path / "js/main.js").write_bytes(SCRIPT)
+    (tmp_path / "image.png").write_bytes(b"\x89PNG")
+    return tmp_path
+
+
+async def test_compressed_variants_and_etags(directory: Path) -> None:
+    store = AssetStore(directory, "/static")
+    await store.load()
+
+    response = await store.response(request(accept_encoding="gzip, br"), "js/main.js")
+    assert response.headers["content-encoding"] == "br"
+    assert brotli.decompress(response.body) == SCRIPT
+
+    response = await store.response(request(if_none_match=response.headers["etag"], accept_encoding="br"), "js/main.js")
+    assert response.status_code == 304
+
+    asset = store.assets["image.png"]
+    assert list(asset.bodies) == ["identity"]
+    response = await store.response(request(f"v={asset.hash}", accept_encoding="br"), "image.png")
+    assert response.headers["cache-control"] == IMMUTABLE_CACHE_CONTROL
+    assert response.body == b"\x89PNG"
+
+    with pytest.raises(HTTPException) as error:
+        await store.response(request(), "missing.js")
+    assert error.value.status_code == 404
+
+
+async def test_hash_urls(directory: Path) -> None:
+    store = AssetStore(directory, "/static")
+    await store.load()
+    html = '<script src="/static/js/main.js"></script><a href="/other">'
+    assert (
+        store.hash_urls(html)
+        == f'<script src="/static/js/main.js?v={store.assets["js/main.js"].hash}"></script><a href="/other">'
+    )
+
+
+async def test_hash_imports(tmp_path: Path) -> None:
+    (tmp_path / "lib").mkdir()
+    (tmp_path / "lib/util.js").write_text("export const util = 1;\n")
+    (tmp_path / "a.js").write_text('import "./b.js";\n')
+    (tmp_path / "b.js").write_text('import "./a.js";\n')
+    (tmp_path / "log.js").write_text('export * from "./lib/util.js";\n')
+    (tmp_path / "main.js").write_text(
+        'import { util } from "./lib/util.js";\nimport "./log.js";\nconst missing = import("./missing.js");\n'
+    )
+    store = AssetStore(tmp_path, "/static")
+    await store.load()
+
+    def body(path: str) -> str:
+        return store.assets[path].bodies["identity"].decode()
+
+    util_hash, log_hash = store.assets["lib/util.js"].hash, store.assets["log.js"].hash
+    assert f'"./lib/util.js?v={util_hash}"' in body("log.js")
+    assert f'"./lib/util.js?v={util_hash}"' in body("main.js")
+    assert f'import "./log.js?v={log_hash}"' in body("main.js")
+    assert 'import("./missing.js")' in body("main.js")
+    # The cycle is broken by keeping one plain URL
+    assert body("a.js") == 'import "./b.js";\n' or body("b.js") == 'import "./a.js";\n'
+
+
+async def test_requests_fail_if_loading_failed(tmp_path: Path) -> None:
+    store = AssetStore(tmp_path / "missing", "/static")
+    waiting = asyncio.create_task(store.response(request(), "js/main.js"))
+
+    with pytest.raises(FileNotFoundError):
+        await store.load()
+    with pytest.raises(HTTPException) as error:
+        await waiting
+    assert error.value.status_code == 500
@@ -0,0 +1,95 @@
+import asyncio
+from pathlib import Path
+from typing import AsyncIterator
+
+import pytest
+
+from bots.storage import KeyValuePersistence, Storage
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def storage(tmp_path: Path) -> AsyncIterator[Storage]:
+    storage = Storage(tmp_path / "storage.sqlite3", flush_interval=60, cache_size=2)
+    yield storage
+    await storage.close()
+
+
+async def test_values_survive_a_restart(storage: Storage) -> None:
+    store = storage.namespace("app")
+    store.set("list", [1, 2, 3])
+    store.set("deleted", "value")
+    store.delete("deleted")
+    # Served from the pending writes
+    assert await store.get("list") == [1, 2, 3]
+    await storage.close()
+
+    reopened = Storage(storage.path)
+    store = reopened.namespace("app")
+    assert await store.get("list") == [1, 2, 3]
+    assert await store.get("deleted", "default") == "default"
+    await reopened.close()
+
+
+async def test_namespaces_are_isolated(storage: Storage) -> None:
+    storage.namespace("app").set("key", "app")
+    storage.namespace("other").set("key", "other")
+    storage.namespace("other").set("key:2", "other 2")
+
+    assert await storage.namespace("app").get("key") == "app"
+    assert await storage.namespace("app").items() == {"key": "app"}
+    assert await storage.namespace("other").items("key:") == {"key:2": "other 2"}
+
+
+async def test_expiry(storage: Storage) -> None:
+    store = storage.namespace("app")
+    store.set("short", 1, ttl=0.05)
+    store.set("long", 2, ttl=60)
+    await asyncio.sleep(0.1)
+    assert await store.get("short") is None
+    assert await store.items() == {"long": 2}
+
+
+async def test_cache_is_bounded(storage: Storage) -> None:
+    store = storage.namespace("app")
+    for index in range(5):
+        store.set(str(index), index)
+    await store.flush()
+    assert len(storage._cache) == 2
+    # Evicted entries are read from the database
+    assert [await store.get(str(index)) for index in range(5)] == [0, 1, 2, 3, 4]
+
+
+async def test_batch_size_triggers_a_flush(tmp_path: Path) -> None:
+    storage = Storage(tmp_path / "storage.sqlite3", flush_interval=60, batch_size=3)
+    await storage.open()
+    store = storage.namespace("app")
+    for index in range(3):
+        store.set(str(index), index)
+    await asyncio.sleep(0.1)
+    assert not storage._pending
+    await storage.close()
+
+
+async def test_persistence(storage: Storage) -> None:
+    persistence = KeyValuePersistence(storage.namespace("app"))
+    await persistence.update_user_data(1, {"name": "Alice"})
+    await persistence.update_chat_data(-2, {"title": "Group"})
+    await persistence.update_conversation("conversation", (1, 1), "state")
+    await persistence.drop_chat_data(-2)
+
+    assert await persistence.get_user_data() == {1: {"name": "Alice"}}
+    assert await persistence.get_chat_data() == {}
+    assert await persistence.get_conversations("conversation") == {(1, 1): "state"}
+
+
+async def test_writes_during_a_read_are_not_overwritten(storage: Storage) -> None:
+    store = storage.namespace("app")
+    await storage.open()
+    read = asyncio.create_task(store.get("key"))
+    await asyncio.sleep(0)
+    store.set("key", 1)
+    await read
+    await store.flush()
+    assert await store.get("key") == 1
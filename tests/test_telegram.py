@@ -0,0 +1,23 @@
+from typing import Any
+
+from telegram import Update
+from telegram.ext import ApplicationBuilder, CallbackQueryHandler, CommandHandler
+
+from bots.utils.telegram import allowed_updates
+
+
+async def callback(update: Update, context: Any) -> None:
+    pass
+
+
+def test_allowed_updates() -> None:
+    application = ApplicationBuilder().token("123:TOKEN").build()
+    # An empty list would mean all update types to Telegram
+    assert allowed_updates(application) == [Update.MESSAGE]
+
+    application.add_handler(CallbackQueryHandler(callback))
+    application.add_handler(CommandHandler("start", callback), group=1)
+    update_types = allowed_updates(application)
+    assert Update.CALLBACK_QUERY in update_types and Update.MESSAGE in update_types
+    assert Update.INLINE_QUERY not in update_types
+    assert allowed_updates(application, exclude_groups=[0, 1]) == [Update.MESSAGE]
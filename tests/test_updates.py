@@ -0,0 +1,132 @@
+import asyncio
+import datetime
+
+import pytest
+from pydantic import ValidationError
+from telegram import Chat, Message, MessageEntity, Update
+
+from bots.config import UpdateQueueConfig
+from bots.updates import ChatOrderedUpdateProcessor
+
+pytestmark = pytest.mark.anyio
+
+
+def message_update(update_id: int, chat_id: int, text: str = "Hello", age: float = 0) -> Update:
+    date = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=age)
+    entities = [MessageEntity(MessageEntity.BOT_COMMAND, 0, len(text))] if text.startswith("/") else None
+    message = Message(update_id, date, Chat(chat_id, Chat.PRIVATE), text=text, entities=entities)
+    return Update(update_id, message=message)
+
+
+class Handler:
+    def __init__(self) -> None:
+        self.events: list[tuple[str, int]] = []
+        self.running = 0
+        self.max_running = 0
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def __call__(self, update: Update, duration: float = 0.02) -> None:
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        self.events.append(("start", update.update_id))
+        await self.release.wait()
+        await asyncio.sleep(duration)
+        self.events.append(("end", update.update_id))
+        self.running -= 1
+
+
+async def test_chats_are_ordered_but_concurrent() -> None:
+    processor = ChatOrderedUpdateProcessor(concurrency=4)
+    handler = Handler()
+    updates = [message_update(1, 100), message_update(2, 100), message_update(3, 200)]
+    for update in updates:
+        await processor.do_process_update(update, handler(update))
+    await processor.join()
+
+    events = handler.events
+    # The other chat doesn't wait for chat 100
+    assert events.index(("start", 3)) < events.index(("end", 1))
+    # The same chat is processed in order
+    assert events.index(("start", 2)) > events.index(("end", 1))
+    assert processor.processed == 3
+    assert processor.last_update_id == 3
+
+
+async def test_concurrency_limit() -> None:
+    processor = ChatOrderedUpdateProcessor(concurrency=2)
+    handler = Handler()
+    for update_id in range(6):
+        update = message_update(update_id, update_id)
+        await processor.do_process_update(update, handler(update))
+    await processor.join()
+    assert handler.max_running == 2
+    assert processor.stats()["max_queued"] == 6
+
+
+async def test_commands_are_prioritised() -> None:
+    processor = ChatOrderedUpdateProcessor(concurrency=1)
+    handler = Handler()
+    handler.release.clear()
+    updates = [message_update(1, 1), message_update(2, 2), message_update(3, 3, "/start")]
+    for update in updates:
+        await processor.do_process_update(update, handler(update))
+    handler.release.set()
+    await processor.join()
+    assert [update_id for event, update_id in handler.events if event == "start"] == [1, 3, 2]
+
+
+async def test_overflow_drop_sheds_new_updates() -> None:
+    processor = ChatOrderedUpdateProcessor(concurrency=1, max_size=2, overflow="drop", priority_reserve=0)
+    handler = Handler()
+    handler.release.clear()
+    for update_id in range(5):
+        update = message_update(update_id, update_id)
+        await processor.do_process_update(update, handler(update))
+        await asyncio.sleep(0)
+    # One update is being processed, max_size updates wait for a slot
+    assert processor.queued == 2
+    handler.release.set()
+    await processor.join()
+    assert processor.shed == {"overflow": 2}
+    assert processor.processed == 3
+
+
+async def test_overflow_wait_blocks_admission() -> None:
+    processor = ChatOrderedUpdateProcessor(concurrency=1, max_size=1, priority_reserve=0)
+    handler = Handler()
+    handler.release.clear()
+    updates = [message_update(update_id, update_id) for update_id in range(3)]
+    for update in updates[:2]:
+        await processor.do_process_update(update, handler(update))
+        await asyncio.sleep(0)
+
+    admission = asyncio.create_task(processor.do_process_update(updates[2], handler(updates[2])))
+    await asyncio.sleep(0.05)
+    assert not admission.done()
+
+    handler.release.set()
+    await admission
+    await processor.join()
+    assert processor.processed == 3
+    assert processor.backpressure_time > 0
+
+
+async def test_expired_updates_are_shed() -> None:
+    processor = ChatOrderedUpdateProcessor(max_age=60)
+    handler = Handler()
+    new, old = message_update(1, 1), message_update(2, 1, age=120)
+    await processor.do_process_update(new, handler(new))
+    await processor.do_process_update(old, handler(old))
+    await processor.join()
+    assert processor.shed == {"expired": 1}
+    assert [update_id for event, update_id in handler.events if event == "start"] == [1]
+    # Shed updates are confirmed as well
+    assert processor.last_update_id == 2
+
+
+def test_max_size_must_admit_updates() -> None:
+    with pytest.raises(ValueError):
+        ChatOrderedUpdateProcessor(max_size=0)
+    with pytest.raises(ValidationError):
+        UpdateQueueConfig(max_size=0)